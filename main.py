@@ -1,93 +1,427 @@
 import argparse
-import cv2
+import logging
+import sys
 import time
+import threading
 import numpy as np
 
-from vision.tag_detection import VisionSystem
-from navigation.navigation import RobotChassis
+from navigation.backends import set_backend
+from vision.tracking import TagTracker
+from runtime.pipeline import LatestValue, DetectionPacket, age_s
+from runtime.metrics import metrics
+from runtime.recorder import FlightRecorder
+from runtime.scheduler import scheduler
+from runtime.startup import Startup, warm_up
+
+# cv2, pupil_apriltags, pigpio e simple_pid só são importados na partida
+# (start_robot), em paralelo; importar este módulo (ex: replay.py) é barato
 
 TARGET_DISTANCE_M = 0.30   # o robô deve parar a 30 cm da tag!
 MAX_LINEAR_SPEED = 20.0    # cm/s (Limitador de segurança, vel. linear)
 MAX_ANGULAR_SPEED = 40.0   # deg/s (Limitador do giro, vel. angular)
 
+# resolução da captura; o VisionSystem usa a calibração dessa resolução
+CAMERA_RESOLUTION = (640, 480)
+
 # Kp_linear: Converte erro de metros para cm/s
 # Se o erro for 0.5m, e Kp=40, ele anda a 20 cm/s
-KP_LINEAR = 100.0           
+KP_LINEAR = 100.0
 
 # Kp_angular: Converte erro lateral (metros) para deg/s
 # Se o erro for 0.1m (10cm), e Kp=300, ele gira a 30 deg/s
 KP_ANGULAR = 300.0
 
+# Modo pipeline: pose mais velha que isso (desde a captura) não é usada,
+# e se nenhuma detecção chegar nesse tempo o robô para
+MAX_POSE_AGE_S = 0.25
+
+# Modo com rastreador (--kalman): o controle roda nessa taxa fixa sobre a pose
+# prevista, e só para se a tag ficar sem detecção por mais que MAX_TRACK_AGE_S
+CONTROL_HZ = 50.0
+MAX_TRACK_AGE_S = 0.5
+
+# imprimir a tag achada a cada frame custa tempo no console do Pi; só com --verbose
+VERBOSE = False
+
+# gravador de voo (--record), None se não estiver gravando
+RECORDER = None
+
+
+def record_frame(seq, t_capture, frame, detections):
+    if RECORDER is not None:
+        RECORDER.record_frame(seq, t_capture, frame)
+        RECORDER.record_detections(seq, t_capture, detections)
+
+
+def find_target(detections, april_id):
+    for d in detections:
+        # a pose pode faltar se o solvePnP falhou (fica None ou NaN)
+        if d.tag_id == april_id and d.pose_t is not None and np.all(np.isfinite(d.pose_t)):
+            return d
+    return None
+
+
+def detect(args, vision, frame):
+    if args.track:
+        return vision.track_tag(frame, args.april_id, draw=False)
+    # só a tag da missão precisa de pose; as outras só são detectadas
+    return frame, vision.detect(frame, ids=(args.april_id,), pose='wanted')
+
+
+def compute_command(target_tag):
+    """
+    Controle P: retorna (linear_cmd, angular_cmd) a partir da tag alvo.
+    Sem tag, o robô deve parar por segurança.
+    """
+    t0 = metrics.start('control')
+    linear_cmd = 0.0
+    angular_cmd = 0.0
+
+    if target_tag is not None:
+        x_m = target_tag.pose_t[0]   # desvio lateral (metros)
+        z_m = target_tag.pose_t[2]   # distancia ate tag (metros)
+
+        if VERBOSE:
+            print(f"Achou tag! x={x_m} z={z_m}")
+
+        error_dist = z_m - TARGET_DISTANCE_M
+        error_ang = -x_m
+
+        linear_cmd = error_dist * KP_LINEAR
+        angular_cmd = error_ang * KP_ANGULAR
+
+    # Segurança: robô tem que respeitar limites máximos
+    linear_cmd = np.clip(linear_cmd, -MAX_LINEAR_SPEED, MAX_LINEAR_SPEED)
+    angular_cmd = np.clip(angular_cmd, -MAX_ANGULAR_SPEED, MAX_ANGULAR_SPEED)
+
+    # deadzone
+    if abs(linear_cmd) < 1.0: linear_cmd = 0.0
+    if abs(angular_cmd) < 1.0: angular_cmd = 0.0
+
+    metrics.record('control', t0)
+    return linear_cmd, angular_cmd
+
+
+def run_sequential(args, chassis, vision, camera):
+    "Captura, detecta, controla e atua um depois do outro, no mesmo loop."
+    seq = 0
+    while True:
+        ret, frame = camera.read()
+        if not ret:
+            print("Erro da câmera!")
+            return
+        seq += 1
+        t_capture = time.monotonic()
+
+        frame, detections = detect(args, vision, frame)
+        record_frame(seq, t_capture, frame, detections)
+
+        # Se a lista estiver vazia OU se a lista tem tags mas não a que queremos
+        # o compute_command devolve zero
+        target_tag = find_target(detections, args.april_id)
+        linear_cmd, angular_cmd = compute_command(target_tag)
+
+        chassis.set_velocity(linear_cmd, angular_cmd)
+
+
+def control_direct(args, chassis, results, stats):
+    "Atua uma vez por detecção nova; sem detecção a tempo, para."
+    while True:
+        packet = results.get(timeout=MAX_POSE_AGE_S)
+
+        if packet is None:
+            if results.closed:
+                print("Erro da câmera!")
+                return
+            # nenhuma detecção nova a tempo, para por segurança
+            chassis.stop()
+            continue
+
+        if age_s(packet) > MAX_POSE_AGE_S:
+            stats['stale_poses'] += 1
+            target_tag = None
+        else:
+            target_tag = find_target(packet.detections, args.april_id)
+
+        linear_cmd, angular_cmd = compute_command(target_tag)
+        chassis.set_velocity(linear_cmd, angular_cmd)
+
+
+def control_tracked(args, chassis, results, stats):
+    """
+    Atua a CONTROL_HZ fixos (prazo absoluto, runtime/scheduler.py) sobre a
+    pose prevista pelo filtro de Kalman; cada detecção nova corrige a
+    trilha. Perder alguns frames não para o robô, só uma trilha mais velha
+    que MAX_TRACK_AGE_S.
+    """
+    tracker = TagTracker()
+
+    def step():
+        # não espera detecção: o que chegou desde o último ciclo corrige a trilha
+        packet = results.get(timeout=0)
+        if packet is not None:
+            tracker.update(packet.detections, packet.t_capture)
+        elif results.closed:
+            print("Erro da câmera!")
+            return False
+        else:
+            stats['predicted_steps'] += 1
+
+        track = tracker.get(args.april_id, time.monotonic())
+        if track is not None and track.age_s > MAX_TRACK_AGE_S:
+            stats['lost_tracks'] += 1
+            track = None
+
+        # TrackEstimate tem pose_t, o compute_command usa igual a uma detecção
+        linear_cmd, angular_cmd = compute_command(track)
+        tracker.set_command(linear_cmd, angular_cmd)
+        chassis.set_velocity(linear_cmd, angular_cmd)
+
+    # roda nesta thread (a principal), no núcleo e prioridade de controle se configurados
+    scheduler.add('tag_control', step, CONTROL_HZ, realtime=True).run()
+
+
+def run_pipelined(args, chassis, vision, camera):
+    """
+    Captura (thread da câmera), detecção (thread própria) e atuação (esta
+    thread) rodam em paralelo, ligados por filas de um valor só. Frames e
+    detecções velhos são descartados em vez de processados atrasados, e o
+    timestamp de captura viaja junto para sabermos a idade da pose.
+    """
+    results = LatestValue()
+    stats = {'frames': 0, 'skipped_frames': 0, 'stale_poses': 0,
+             'predicted_steps': 0, 'lost_tracks': 0}
+
+    def detection_stage():
+        last_seq = 0
+        while not results.closed:
+            item = camera.wait_frame(last_seq)
+            if item is None:
+                if not camera.running:
+                    break
+                continue
+
+            seq, t_capture, frame = item
+            if last_seq and seq > last_seq + 1:
+                stats['skipped_frames'] += seq - last_seq - 1
+            last_seq = seq
+
+            _, detections = detect(args, vision, frame)
+            record_frame(seq, t_capture, frame, detections)
+            stats['frames'] += 1
+            results.put(DetectionPacket(seq, t_capture, time.monotonic(), detections))
+
+        results.close()
+
+    def parallel_stage():
+        "Com --workers: só manda os frames para os processos; os resultados chegam em on_result."
+        last_seq = 0
+        while not results.closed:
+            item = camera.wait_frame(last_seq)
+            if item is None:
+                if not camera.running:
+                    break
+                continue
+
+            seq, t_capture, frame = item
+            if last_seq and seq > last_seq + 1:
+                stats['skipped_frames'] += seq - last_seq - 1
+            last_seq = seq
+
+            if engine.submit(seq, t_capture, frame) and RECORDER is not None:
+                RECORDER.record_frame(seq, t_capture, frame)
+
+        results.close()
+
+    def on_result(packet):
+        stats['frames'] += 1
+        if RECORDER is not None:
+            RECORDER.record_detections(packet.seq, packet.t_capture, packet.detections)
+        results.put(packet)
+
+    engine = None
+    if args.workers:
+        from vision.parallel import ParallelDetector
+        engine = ParallelDetector(
+            args.workers, CAMERA_RESOLUTION, on_result=on_result,
+            tag_size_meters=vision.tag_size, camera_name=args.camera_name,
+            undistort=vision.undistort,
+            # igual ao detect() sequencial: só a tag da missão com pose
+            detect_kwargs={'ids': (args.april_id,), 'pose': 'wanted'},
+        ).start()
+        detector_thread = threading.Thread(target=parallel_stage, daemon=True)
+    else:
+        detector_thread = threading.Thread(target=detection_stage, daemon=True)
+    detector_thread.start()
+
+    try:
+        if args.kalman:
+            control_tracked(args, chassis, results, stats)
+        else:
+            control_direct(args, chassis, results, stats)
+    finally:
+        results.close()
+        detector_thread.join(timeout=1.0)
+        if engine is not None:
+            engine.close()
+            print(f"Processos de detecção: {engine.get_stats()}")
+        print(f"Pipeline: {stats['frames']} frames detectados, "
+              f"{stats['skipped_frames']} frames pulados, "
+              f"{results.dropped} detecções descartadas, "
+              f"{stats['stale_poses']} poses velhas demais")
+        if args.kalman:
+            print(f"Rastreador: {stats['predicted_steps']} passos só com previsão, "
+                  f"{stats['lost_tracks']} passos com a trilha perdida")
+
+
+def start_robot(args):
+    """
+    Sobe chassi (GPIO), visão (detector + aquecimento) e câmera ao mesmo
+    tempo. Retorna (chassis, vision, camera, startup); o que falhar vem None.
+    """
+    startup = Startup()
+    budget_s = args.budget_ms / 1000.0 if args.budget_ms is not None else None
+
+    def init_chassis():
+        from navigation.navigation import RobotChassis
+        return RobotChassis(closed_loop=args.closed_loop)
+
+    def init_vision():
+        from vision.tag_detection import VisionSystem
+        vision = VisionSystem(tag_size_meters=0.05, resolution=CAMERA_RESOLUTION, adaptive=args.adaptive,
+                              frame_budget_s=budget_s, camera_name=args.camera_name,
+                              undistort=None if args.undistort == 'none' else args.undistort)
+        # a primeira detecção paga alocações; melhor aqui do que no meio da missão
+        warm_up(vision, CAMERA_RESOLUTION)
+        return vision
+
+    def init_camera():
+        from vision.camera import get_camera
+        # o controle não desenha nada: a câmera entrega só a luminância, sem montar o BGR
+        return get_camera(int(args.camera) if args.camera.isdigit() else args.camera, CAMERA_RESOLUTION,
+                          color_mode='gray', pixel_format=args.pixel_format)
+
+    parts = startup.parallel({'chassis': init_chassis, 'vision': init_vision, 'camera': init_camera})
+    return parts['chassis'], parts['vision'], parts['camera'], startup
+
+
 def main():
     parser = argparse.ArgumentParser(description="Recebe id da tag da missão")
     parser.add_argument('april_id', type=int, help="ID da apriltag para seguir")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="captura, detecção e atuação em threads separadas")
+    parser.add_argument('--kalman', action='store_true',
+                        help="controle a taxa fixa sobre a pose prevista por filtro de Kalman "
+                             "(implica --pipeline)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="detecta em N processos, um frame por processo (implica --pipeline)")
+    parser.add_argument('--track', action='store_true',
+                        help="depois de achar a tag, detecta só numa região em volta dela")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="escolhe a decimação do detector pela distância da tag")
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="orçamento de tempo de detecção por frame no modo adaptativo")
+    parser.add_argument('--sim', action='store_true',
+                        help="usa a planta simulada no lugar do pigpio (roda sem o robô)")
+    parser.add_argument('--closed-loop', action='store_true',
+                        help="controla a velocidade das rodas com os encoders (PID a 100 Hz)")
+    parser.add_argument('--camera', default='0',
+                        help="índice da câmera, arquivo de vídeo ou 'sim' (câmera simulada)")
+    parser.add_argument('--pixel-format', choices=('YUYV', 'MJPG'), default='YUYV',
+                        help="formato cru pedido à câmera (só a luminância é usada)")
+    parser.add_argument('--camera-name', default='default',
+                        help="nome da calibração da câmera (python -m vision.calibration)")
+    parser.add_argument('--undistort', choices=('corners', 'remap', 'none'), default='corners',
+                        help="com calibração: corrige só os cantos das tags ou o frame inteiro")
+    parser.add_argument('--control-cpu', type=int, default=None,
+                        help="fixa as tarefas de controle a taxa fixa (--kalman, --closed-loop) neste núcleo")
+    parser.add_argument('--control-priority', type=int, default=None,
+                        help="prioridade SCHED_FIFO (1-99) dessas tarefas; precisa de root ou CAP_SYS_NICE")
+    parser.add_argument('--record', metavar='LOG',
+                        help="grava detecções, comandos, PWM e encoders neste arquivo (ver replay.py)")
+    parser.add_argument('--record-frames', type=int, default=0, metavar='N',
+                        help="com --record, grava também 1 a cada N frames (0 = nenhum)")
+    parser.add_argument('--verbose', action='store_true',
+                        help="imprime a pose da tag a cada frame")
+    parser.add_argument('--metrics-sample', type=int, default=1,
+                        help="mede o tempo das etapas 1 a cada N vezes (0 desliga)")
+    parser.add_argument('--metrics-log-s', type=float, default=0.0,
+                        help="loga o resumo das métricas a cada N segundos (0 = só no fim)")
     args = parser.parse_args()
-    
-    chassis = RobotChassis()
-    vision = VisionSystem(tag_size_meters=0.05)
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
 
-    chassis.start()
+    global VERBOSE, RECORDER
+    VERBOSE = args.verbose
+    metrics.configure(enabled=args.metrics_sample > 0, sample_every=max(args.metrics_sample, 1))
+    if args.metrics_log_s > 0:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+        metrics.start_reporter(args.metrics_log_s)
 
-    try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Erro da câmera!")
-                return
+    if args.workers and (args.track or args.adaptive):
+        print("--track e --adaptive dependem do frame anterior; ignorados com --workers")
 
-            frame, detections = vision.detect_tags(frame, draw=False)
+    if args.sim:
+        set_backend('sim')
 
-            linear_cmd = 0.0
-            angular_cmd = 0.0
+    # vale para as tarefas criadas depois (malha fechada das rodas e controle do --kalman)
+    scheduler.configure(control_cpu=args.control_cpu, control_priority=args.control_priority)
 
-            target_tag = None
+    chassis, vision, camera, startup = start_robot(args)
+    for name, phase in startup.report()['phases'].items():
+        status = "ok" if phase['ok'] else f"FALHOU: {phase['error']}"
+        print(f"Partida: {name} em {phase['duration_s'] * 1000:.0f} ms ({status})")
+
+    if chassis is None or vision is None or camera is None:
+        if chassis is not None:
+            chassis.close()
+        if camera is not None:
+            camera.stop()
+        sys.exit(1)
 
-            if detections:
-                for d in detections:
-                    if d.tag_id == args.april_id:
-                        target_tag = d
-                        break
-
-            if target_tag is not None:
-                x_m = target_tag.pose_t[0]   # desvio lateral (metros)
-                z_m = target_tag.pose_t[2]   # distancia ate tag (metros)
-
-                print(f"Achou tag! x={x_m} z={z_m}")
-
-                error_dist = z_m - TARGET_DISTANCE_M
-                error_ang = -x_m
-
-                linear_cmd = error_dist * KP_LINEAR
-                angular_cmd = error_ang * KP_ANGULAR
-            
-            else:
-                # Se a lista estiver vazia OU se a lista tem tags mas não a que queremos
-                # O robô deve parar por segurança
-                linear_cmd = 0.0
-                angular_cmd = 0.0
-            
-            # Segurança: robô tem que respeitar limites máximos
-            linear_cmd = np.clip(linear_cmd, -MAX_LINEAR_SPEED, MAX_LINEAR_SPEED)
-            angular_cmd = np.clip(angular_cmd, -MAX_ANGULAR_SPEED, MAX_ANGULAR_SPEED)
-            
-            # deadzone
-            if abs(linear_cmd) < 1.0: linear_cmd = 0.0
-            if abs(angular_cmd) < 1.0: angular_cmd = 0.0
-
-            chassis.set_velocity(linear_cmd, angular_cmd)
+    if args.record:
+        RECORDER = FlightRecorder(args.record, frame_every=args.record_frames)
+        RECORDER.record_meta({
+            'source': 'main.py',
+            'args': vars(args),
+            'resolution': list(CAMERA_RESOLUTION),
+            'tag_size': vision.tag_size,
+            'camera_params': [float(v) for v in vision.camera_params],
+        })
+        chassis.recorder = RECORDER
+
+    chassis.start()
+    startup.mark_ready()
+    print(f"Pronto para controlar em {startup.elapsed_s():.2f} s")
+
+    try:
+        if args.pipeline or args.kalman or args.workers:
+            run_pipelined(args, chassis, vision, camera)
+        else:
+            run_sequential(args, chassis, vision, camera)
 
     except KeyboardInterrupt:
         print("Interrupção via teclado")
     finally:
         print("Parando robô")
-        chassis.stop()
-        chassis.l_wheel_motor.close()
-        chassis.r_wheel_motor.close()
-        cap.release()
-        cv2.destroyAllWindows()
+        chassis.close()
+        camera.stop()
+        if RECORDER is not None:
+            RECORDER.close()
+
+        for name, task in scheduler.get_stats().items():
+            if task['loops']:
+                print(f"{name} @ {task['hz']:.0f} Hz: {task['loops']} ciclos, {task['overruns']} overruns, "
+                      f"{task['skipped']} pulados, atraso p99 {task['jitter_p99_ms']:.2f} ms, "
+                      f"máx {task['jitter_max_ms']:.2f} ms")
+
+        for name, stage in sorted(metrics.snapshot()['stages'].items()):
+            if stage['p50_ms'] is not None:
+                print(f"{name}: {stage['count']} amostras, p50 {stage['p50_ms']:.2f} ms, "
+                      f"p99 {stage['p99_ms']:.2f} ms, máx {stage['max_ms']:.2f} ms")
+
+        if args.adaptive:
+            for level in vision.get_adaptive_summary():
+                print(f"Decimação {level['quad_decimate']}: {level['frames']} frames, "
+                      f"{level['avg_time_ms']} ms/frame")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
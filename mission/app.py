@@ -2,24 +2,46 @@
 """
 Sistema de Controle de Missão - Empilhadeira Autônoma
 Servidor Flask com WebSockets para controle em tempo real
+
+MISSION_ASYNC_MODE=eventlet liga o modo cooperativo: cada cliente vira um
+greenlet em vez de uma thread do SO, e visão/JPEG rodam num pool de
+threads nativas. O padrão continua sendo 'threading'.
 """
 
 import sys
 import os
 
+ASYNC_MODE = os.environ.get('MISSION_ASYNC_MODE', 'threading')
+
+# processo do detector paralelo (spawn) reimportando este arquivo como __main__
+# do pai: não mexe no socket/threading dele (ver server.py, que evita até o import)
+IS_SPAWNED_WORKER = __name__ == '__mp_main__'
+
+if ASYNC_MODE == 'eventlet' and not IS_SPAWNED_WORKER:
+    # precisa vir antes de qualquer import que use socket/threading
+    import eventlet
+    eventlet.monkey_patch()
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from flask import Flask, render_template, jsonify, Response
+from flask import Flask, render_template, jsonify, Response, request
 from flask_socketio import SocketIO, emit
 import logging
 from datetime import datetime
-import threading
-import time
-import cv2
 
-from vision.tag_detection import VisionSystem
+from mission.state_publisher import StatePublisher
+from mission.teleop import TeleopController
+from runtime.workers import enable_eventlet
+from runtime.metrics import metrics
+from runtime.scheduler import scheduler
+from runtime.startup import Startup, warm_up
+
+# visão, câmera e chassi (cv2, pupil_apriltags, pigpio) só são importados no
+# initialize_system, em paralelo. Rodando app.py direto, os workers do detector
+# paralelo (spawn) reimportam este arquivo: pagam o Flask e o Socket.IO, mas não
+# o eventlet nem nada do initialize_system. Com server.py não pagam nem isso.
 
 # Configuração de logging
 logging.basicConfig(
@@ -33,10 +55,40 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'empilhadeira-iot-secret-2025'
 
 # Inicialização do SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
+
+if ASYNC_MODE == 'eventlet' and not IS_SPAWNED_WORKER:
+    # visão e JPEG em threads nativas, o loop de eventos nunca trava
+    enable_eventlet(int(os.environ.get('MISSION_WORKERS', 4)))
+
+# Resolução baixa para performance no Raspberry Pi
+CAMERA_RESOLUTION = (320, 240)
+
+# Câmera: índice do /dev/video, arquivo de vídeo ou 'sim' (simulada, ver mission/loadtest.py)
+CAMERA_DEVICE = os.environ.get('MISSION_CAMERA', '0')
+CAMERA_DEVICE = int(CAMERA_DEVICE) if CAMERA_DEVICE.isdigit() else CAMERA_DEVICE
+
+# Mapa das tags no mundo (para localizar o robô); sem ele só lista as tags vistas
+TAG_MAP_PATH = os.environ.get('MISSION_TAG_MAP', os.path.join(os.path.dirname(__file__), 'tag_map.json'))
 
-# Inicialização do sistema de visão de tag
-vision_system = VisionSystem(family='tag36h11')
+# pose pelas tags pior que isso é ignorada (reflexo, tag mal detectada, longe demais)
+LOCALIZE_MAX_RMS_PX = 3.0
+LOCALIZE_MAX_STD_CM = 50.0
+
+# opções do detector, as mesmas no VisionSystem do app e nos workers paralelos
+VISION_OPTIONS = {'family': 'tag36h11'}
+
+# Visão, vídeo e chassi são criados no initialize_system (o chassi fica None sem hardware)
+vision_system = None
+video_broadcaster = None
+parallel_detector = None
+robot_chassis = None
+
+# tempo de cada fase da partida (aparece no /api/status)
+startup = Startup()
+
+# Teleoperação: junta os comandos e aplica o último a cada ciclo do loop
+teleop = TeleopController()
 
 # Estado global do sistema
 system_state = {
@@ -45,46 +97,56 @@ system_state = {
     'fork_height': 0.0,
     'connected_clients': 0,
     'last_update': None,
-    'visible_tags': []
+    'visible_tags': [],
+    'localization': None
 }
 
+# Publica só o que mudou, para cada cliente na taxa que ele pediu
+state_publisher = StatePublisher(socketio, system_state)
+
 # ============================================================================
 # GERADOR DE VÍDEO
 # ============================================================================
-def generate_frames():
-    """
-    Gera stream MJPEG capturando frame, passando pelo VisionSystem e retornando JPEG.
-    """
-    camera = cv2.VideoCapture(0)
-    # Resolução baixa para performance no Raspberry Pi
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 320)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 240)
-    
-    if not camera.isOpened():
-        logger.error("[CAM] Não foi possível abrir a câmera")
+def publish_visible_tags(results):
+    """Atualiza o estado com os IDs encontrados no último frame e, se houver
+    mapa, a pose do robô resolvida com todas as tags visíveis"""
+    state_publisher.set('visible_tags', [r.tag_id for r in results])
+
+    estimate = vision_system.localize(results)
+    if estimate is None:
         return
 
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        # Passa o frame cru para o script processar e
-        # devolve o frame desenhado e a lista de resultados
-        frame, results = vision_system.detect_tags(frame, draw=True)
-        
-        # atualiza a variável global com os IDs encontrados
-        current_ids = [r.tag_id for r in results]
-        system_state['visible_tags'] = current_ids
+    cov = estimate.covariance
+    std_x, std_y, std_theta = (float(cov[i, i]) ** 0.5 for i in range(3))
+    applied = estimate.rms_px <= LOCALIZE_MAX_RMS_PX and max(std_x, std_y) <= LOCALIZE_MAX_STD_CM
+
+    if applied:
+        if robot_chassis is not None and robot_chassis.odometry is not None:
+            # funde com a odometria pesando pela covariância (não sobrescreve);
+            # o loop do robô publica a pose dela em robot_pose
+            applied = robot_chassis.correct_pose(estimate.x_cm, estimate.y_cm, estimate.theta_deg, cov)
+        else:
+            state_publisher.set('robot_pose', {
+                'x': estimate.x_cm, 'y': estimate.y_cm, 'theta': estimate.theta_deg
+            })
+
+    state_publisher.set('localization', {
+        'tag_ids': estimate.tag_ids,
+        'rms_px': round(estimate.rms_px, 2),
+        'std_x_cm': round(std_x, 2),
+        'std_y_cm': round(std_y, 2),
+        'std_theta_deg': round(std_theta, 2),
+        'applied': applied,
+    })
 
-        # codifica para JPEG para enviar ao navegador
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
 
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+# Detecção em processos separados (MISSION_DETECT_WORKERS > 0): não disputa o GIL
+# com o Flask/Socket.IO e usa os outros núcleos do Pi
+DETECT_WORKERS = int(os.environ.get('MISSION_DETECT_WORKERS', 0))
 
-    camera.release()
+# Odometria pelos encoders (pinos 17 e 27): desligada por padrão, o encoder
+# do GPIO27 não funcionou no robô e a pose derivaria numa roda sem aviso
+ODOMETRY = os.environ.get('MISSION_ODOMETRY', '0') == '1'
 
 
 # ============================================================================
@@ -99,7 +161,15 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(),
+    """
+    Stream MJPEG. Parâmetros opcionais: ?fps=10 (máximo para este viewer)
+    e ?quality=60 (qualidade JPEG).
+    """
+    if video_broadcaster is None:
+        return Response("Sistema iniciando", status=503)
+    quality = request.args.get('quality', 95, type=int)
+    max_fps = request.args.get('fps', None, type=float)
+    return Response(video_broadcaster.stream(quality, max_fps),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/api/status')
@@ -108,10 +178,47 @@ def api_status():
     return jsonify({
         'status': 'online',
         'system_state': system_state,
+        'teleop': teleop.get_stats(),
+        'startup': startup.report(),
+        'scheduler': scheduler.get_stats(),
         'timestamp': datetime.now().isoformat()
     })
 
 
+@app.route('/api/metrics')
+def api_metrics():
+    """Tempo por etapa (captura, cinza, detecção, pose, PWM, loop do robô...). Só leitura."""
+    snapshot = metrics.snapshot()
+    snapshot['timestamp'] = datetime.now().isoformat()
+    return jsonify(snapshot)
+
+
+@app.route('/api/metrics', methods=['POST'])
+def api_metrics_configure():
+    """
+    Muda as métricas. Corpo JSON (ou formulário), todos opcionais:
+    {'enabled': 0|1, 'sample': N (mede 1 a cada N), 'reset': 1 (zera)}.
+    Só por POST: um GET de pré-carregamento ou de polling não desliga nem apaga nada.
+    """
+    data = request.get_json(silent=True) or request.form
+    try:
+        enabled = data.get('enabled')
+        sample = data.get('sample')
+        metrics.configure(
+            enabled=None if enabled is None else int(enabled),
+            sample_every=None if sample is None else int(sample)
+        )
+        reset = int(data.get('reset', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'enabled, sample e reset devem ser inteiros'}), 400
+    if reset:
+        metrics.reset()
+
+    snapshot = metrics.snapshot()
+    snapshot['timestamp'] = datetime.now().isoformat()
+    return jsonify(snapshot)
+
+
 # ============================================================================
 # EVENTOS WEBSOCKET
 # ============================================================================
@@ -119,20 +226,33 @@ def api_status():
 @socketio.on('connect')
 def handle_connect():
     """Cliente conectou via WebSocket"""
-    system_state['connected_clients'] += 1
+    state_publisher.set('connected_clients', system_state['connected_clients'] + 1)
     logger.info(f"Cliente conectado. Total: {system_state['connected_clients']}")
     
-    # Envia estado inicial para o cliente
+    # Registra antes de mandar o estado inicial, assim nenhuma mudança se perde
+    state_publisher.add_client(request.sid)
     emit('system_status', system_state)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Cliente desconectou"""
-    system_state['connected_clients'] -= 1
+    state_publisher.remove_client(request.sid)
+    state_publisher.set('connected_clients', system_state['connected_clients'] - 1)
     logger.info(f"Cliente desconectado. Total: {system_state['connected_clients']}")
 
 
+@socketio.on('subscribe_status')
+def handle_subscribe_status(data):
+    """
+    Cliente escolhe como quer receber o estado
+    Formato esperado: {'rates': {'robot_pose': 20, ...}, 'encoding': 'msgpack' | 'json'}
+    """
+    data = data or {}
+    encoding = state_publisher.subscribe(request.sid, data.get('rates'), data.get('encoding', 'json'))
+    emit('subscription_ack', {'encoding': encoding})
+
+
 @socketio.on('ping')
 def handle_ping(data):
     """
@@ -158,13 +278,15 @@ def handle_teleop_command(data):
     """
     Recebe comandos de teleoperação
     Formato esperado: {'linear': float, 'angular': float}
+    Caminho quente: sem log e sem emit por mensagem. O comando só é guardado
+    e o loop de controle aplica o mais novo; o retorno vira ack apenas se o
+    cliente pedir um callback.
     """
-    logger.info(f"[TELEOP] Comando recebido: {data}")
-    
-    # TODO: Integrar com navigation.py
-    # robot_chassis.set_velocity(data['linear'], data['angular'])
-    
-    emit('command_ack', {'status': 'received', 'data': data})
+    try:
+        teleop.submit(data['linear'], data['angular'])
+    except (KeyError, TypeError, ValueError):
+        return {'status': 'invalid'}
+    return {'status': 'received'}
 
 
 @socketio.on('set_fork_height')
@@ -178,7 +300,7 @@ def handle_fork_height(data):
     # TODO: Integrar com navigation.py
     # robot_chassis.move_fork(data['height_cm'])
     
-    system_state['fork_height'] = data['height_cm']
+    state_publisher.set('fork_height', data['height_cm'])
     emit('fork_status', {'height': data['height_cm']})
 
 
@@ -191,57 +313,129 @@ def handle_video_request():
 # LOOP PRINCIPAL DO ROBÔ (Background Thread)
 # ============================================================================
 
-def robot_control_loop():
+# Frequência do loop do robô (50 Hz = 20 ms), por prazo absoluto (runtime/scheduler.py)
+ROBOT_LOOP_HZ = 50.0
+
+
+def robot_control_step():
     """
-    Thread principal que atualiza o estado do robô
+    Um ciclo do loop principal que atualiza o estado do robô
     Aqui chamaremos robot_chassis.update() e vision.detect_*()
     """
-    logger.info("[LOOP] Thread de controle iniciada")
-    
-    while True:
-        try:
-            # TODO: Integrar módulos de navegação e visão
-            # robot_chassis.update()
-            # pose = robot_chassis.get_pose()
-            # system_state['robot_pose'] = {'x': pose[0], 'y': pose[1], 'theta': pose[2]}
-            
-            system_state['last_update'] = datetime.now().isoformat()
-            
-            # Emite estado atualizado para todos os clientes conectados
-            socketio.emit('system_status', system_state)
-            
-            # Controle de frequência do loop (50Hz = 20ms)
-            time.sleep(0.02)
-            
-        except Exception as e:
-            logger.error(f"[LOOP] Erro no loop de controle: {e}")
-            time.sleep(1.0)  # Espera mais tempo em caso de erro
+    try:
+        t0 = metrics.start('robot_loop')
+
+        # aplica o comando de teleoperação mais novo (ou para, se o watchdog estourou)
+        moving = teleop.tick()
+        state_publisher.set('mode', 'TELEOP' if moving else 'IDLE')
+
+        # a odometria integra em thread própria, aqui só lê o snapshot
+        if robot_chassis is not None and robot_chassis.odometry is not None:
+            pose = robot_chassis.get_pose()
+            state_publisher.set('robot_pose', {'x': pose[0], 'y': pose[1], 'theta': pose[2]})
+
+        # Manda para cada cliente só o que mudou (e na taxa que ele pediu)
+        state_publisher.flush()
+        metrics.record('robot_loop', t0)
+
+    except Exception as e:
+        # sem dormir aqui: a tarefa pode estar em SCHED_FIFO, e o próximo prazo já vem
+        logger.error(f"[LOOP] Erro no loop de controle: {e}")
 
 
 # ============================================================================
 # INICIALIZAÇÃO DO SERVIDOR
 # ============================================================================
 
+def init_vision():
+    from vision.tag_detection import VisionSystem
+    vision = VisionSystem(
+        resolution=CAMERA_RESOLUTION,
+        tag_map=TAG_MAP_PATH if os.path.exists(TAG_MAP_PATH) else None,
+        **VISION_OPTIONS
+    )
+    # a primeira detecção paga alocações; melhor aqui do que no primeiro viewer
+    warm_up(vision, CAMERA_RESOLUTION)
+    return vision
+
+
+def init_camera():
+    # abre já na partida; se falhar, o VideoBroadcaster tenta de novo no primeiro viewer
+    from vision.camera import get_camera
+    return get_camera(CAMERA_DEVICE, CAMERA_RESOLUTION)
+
+
+def init_chassis():
+    from navigation.navigation import RobotChassis
+    chassis = RobotChassis(odometry=ODOMETRY)
+    chassis.start()
+    return chassis
+
+
+def init_parallel_detector():
+    from vision.parallel import ParallelDetector
+    return ParallelDetector(DETECT_WORKERS, CAMERA_RESOLUTION, **VISION_OPTIONS).start()
+
+
 def initialize_system():
     """Inicializa todos os módulos do robô"""
     logger.info("=" * 60)
     logger.info("SISTEMA DE CONTROLE DE MISSÃO - EMPILHADEIRA AUTÔNOMA")
     logger.info("=" * 60)
+
+    global vision_system, video_broadcaster, parallel_detector, robot_chassis
+
+    # câmera, detector e GPIO não dependem um do outro: sobem ao mesmo tempo
+    tasks = {'vision': init_vision, 'camera': init_camera, 'chassis': init_chassis}
+    if DETECT_WORKERS > 0:
+        # só aqui, não no import: os workers (spawn) importam este módulo de novo
+        tasks['detector_workers'] = init_parallel_detector
+    parts = startup.parallel(tasks)
+
+    vision_system = parts['vision']
+    if vision_system is None:
+        raise RuntimeError(f"Visão não iniciou: {startup.phases['vision']['error']}")
+    parallel_detector = parts.get('detector_workers')
+
+    robot_chassis = parts['chassis']
+    if robot_chassis is not None:
+        teleop.chassis = robot_chassis
+        logger.info(f"[OK] Chassi inicializado {'com' if ODOMETRY else 'sem'} odometria")
+    else:
+        logger.warning(f"[CHASSI] Sem chassi ({startup.phases['chassis']['error']}), seguindo sem navegação")
+
+    # Detecta e codifica cada frame uma vez só, para todos os viewers
+    from mission.video import VideoBroadcaster
+    from vision.camera import get_camera
+    video_broadcaster = VideoBroadcaster(
+        lambda: get_camera(CAMERA_DEVICE, CAMERA_RESOLUTION),
+        vision_system,
+        on_detections=publish_visible_tags,
+        detector=parallel_detector,
+        # sem mapa de tags só os IDs são usados: não calcula pose de nenhuma
+        detect_options={'pose': 'all' if vision_system.tag_map is not None else 'none'}
+    )
+
+    logger.info("[OK] Módulos inicializados")
     
-    # TODO: Inicializar módulos quando estiverem prontos
-    # global robot_chassis, vision_system
-    # robot_chassis = RobotChassis()
-    # vision_system = VisionSystem()
-    
-    logger.info("[OK] Módulos inicializados (simulação)")
-    
-    # Inicia thread de controle do robô
-    control_thread = threading.Thread(target=robot_control_loop, daemon=True)
-    control_thread.start()
+    # Inicia thread de controle do robô (greenlet no modo eventlet). Núcleo e
+    # prioridade de controle (RUNTIME_CONTROL_CPU/PRIORITY) só numa thread de
+    # verdade: no eventlet fixaria o loop de eventos inteiro
+    robot_loop = scheduler.add('robot_loop', robot_control_step, ROBOT_LOOP_HZ,
+                               realtime=ASYNC_MODE == 'threading')
+    socketio.start_background_task(robot_loop.run)
     logger.info("[OK] Thread de controle iniciada")
 
+    # resumo das métricas no log de tempos em tempos (0 desliga)
+    metrics_log_s = float(os.environ.get('MISSION_METRICS_LOG_S', 60))
+    if metrics_log_s > 0:
+        metrics.start_reporter(metrics_log_s)
 
-if __name__ == '__main__':
+    # loga o tempo de cada fase e avisa o systemd (Type=notify)
+    startup.mark_ready()
+
+
+def main():
     try:
         # Inicializa o sistema
         initialize_system()
@@ -262,3 +456,7 @@ if __name__ == '__main__':
         logger.info("Servidor encerrado pelo usuário")
     except Exception as e:
         logger.error(f"Erro fatal: {e}")
+
+
+if __name__ == '__main__':
+    main()
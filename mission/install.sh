@@ -56,7 +56,7 @@ Type=simple
 User=$USER
 WorkingDirectory=$CURRENT_DIR
 Environment="PATH=$CURRENT_DIR/venv/bin:/usr/local/bin:/usr/bin:/bin"
-ExecStart=$CURRENT_DIR/venv/bin/python3 $CURRENT_DIR/app.py
+ExecStart=$CURRENT_DIR/venv/bin/python3 $CURRENT_DIR/server.py
 Restart=always
 RestartSec=10
 
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+Teste de carga do servidor de missão (app.py).
+
+Abre N clientes Socket.IO simulados (cada um manda 'ping' e
+'teleop_command' na taxa pedida e assina o estado, como um dashboard) e M
+viewers do /video_feed, e mede:
+  - ida e volta do ping e do ack do teleop_command (p50/p95/p99/máx);
+  - frames de estado (system_status_delta com robot_pose) atrasados ou
+    perdidos em relação à taxa assinada, e a idade do estado ao chegar;
+  - FPS do MJPEG por viewer;
+  - CPU e memória do processo do servidor (e dos filhos, ex: workers do
+    detector paralelo), lidos do /proc.
+
+Com --spawn o próprio teste sobe o app com chassi e câmera simulados
+(ROBOT_BACKEND=sim, MISSION_CAMERA=sim), espera o "pronto" e derruba no
+fim, então a mesma linha de comando dá números comparáveis entre versões:
+
+    python mission/loadtest.py --spawn --clients 20 --video-clients 2 --duration 30 --json carga.json
+
+Sem --spawn, mede um servidor já rodando (--url; --server-pid para CPU/memória).
+Precisa do cliente do python-socketio (pip install "python-socketio[client]").
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+import socketio
+
+try:
+    import msgpack
+except ImportError:     # opcional, só para --encoding msgpack
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+BOUNDARY = b'--frame'
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(samples):
+    "p50/p95/p99/máx em ms de uma lista de durações em segundos."
+    n = len(samples)
+    if not n:
+        return {'count': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    s = sorted(samples)
+    return {
+        'count': n,
+        'p50_ms': round(s[n // 2] * 1000.0, 2),
+        'p95_ms': round(s[min(int(n * 0.95), n - 1)] * 1000.0, 2),
+        'p99_ms': round(s[min(int(n * 0.99), n - 1)] * 1000.0, 2),
+        'max_ms': round(s[-1] * 1000.0, 2),
+    }
+
+
+def run_at(rate_hz, fn, stop):
+    "Chama fn() a rate_hz até stop, com prazos absolutos (o atraso de uma chamada não desloca as outras)."
+    period = 1.0 / rate_hz
+    next_t = time.monotonic()
+    while not stop.is_set():
+        fn()
+        next_t += period
+        delay = next_t - time.monotonic()
+        if delay > 0:
+            stop.wait(delay)
+        else:
+            next_t = time.monotonic()   # atrasou mais de um período: não tenta compensar em rajada
+
+
+class DashboardClient:
+    def __init__(self, index, args, measuring):
+        """
+        Um dashboard simulado.
+        measuring: Event; amostras só contam com ele ligado (fora do aquecimento).
+        """
+        self.index = index
+        self.args = args
+        self.measuring = measuring
+        self.sio = socketio.Client(reconnection=False)
+
+        self.connect_s = None
+        self.ping_sent = 0
+        self.ping_rtt = []
+        self.teleop_sent = 0
+        self.teleop_rtt = []
+        self.status_frames = 0
+        self.status_age = []        # last_update do servidor -> chegada aqui
+        self.status_gaps = []       # intervalo entre frames com robot_pose
+        self._last_status_t = None
+        self._seq = 0
+
+        self.sio.on('pong', self._on_pong)
+        self.sio.on('system_status_delta', self._on_status)
+
+    def connect(self):
+        t0 = time.perf_counter()
+        self.sio.connect(self.args.url, transports=[self.args.transport])
+        self.connect_s = time.perf_counter() - t0
+        self.sio.emit('subscribe_status', {
+            'rates': {'robot_pose': self.args.status_hz},
+            'encoding': self.args.encoding,
+        })
+
+    def _on_pong(self, data):
+        sent = (data.get('received_data') or {}).get('t')
+        if sent is not None and self.measuring.is_set():
+            self.ping_rtt.append(time.perf_counter() - sent)
+
+    def _on_status(self, data):
+        now = time.monotonic()
+        if isinstance(data, (bytes, bytearray)):
+            data = msgpack.unpackb(data, raw=False)
+        if 'robot_pose' not in data:
+            return
+
+        if self.measuring.is_set():
+            self.status_frames += 1
+            if self._last_status_t is not None:
+                self.status_gaps.append(now - self._last_status_t)
+            if data.get('last_update'):
+                # mesmo relógio de parede que o servidor (rodando na mesma máquina)
+                age = (datetime.now() - datetime.fromisoformat(data['last_update'])).total_seconds()
+                self.status_age.append(max(age, 0.0))
+        self._last_status_t = now
+
+    def ping(self):
+        self._seq += 1
+        if self.measuring.is_set():
+            self.ping_sent += 1
+        self.sio.emit('ping', {'client': self.index, 'seq': self._seq, 't': time.perf_counter()})
+
+    def teleop(self):
+        # anda devagar para frente: a pose muda sempre e o servidor publica robot_pose na taxa assinada
+        t0 = time.perf_counter()
+        measuring = self.measuring.is_set()
+        if measuring:
+            self.teleop_sent += 1
+
+        def ack(*_):
+            if measuring:
+                self.teleop_rtt.append(time.perf_counter() - t0)
+
+        self.sio.emit('teleop_command', {'linear': 5.0, 'angular': 0.0}, callback=ack)
+
+    def reset(self):
+        self._last_status_t = None
+
+    def summary(self, duration_s):
+        period = 1.0 / self.args.status_hz
+        late = [g for g in self.status_gaps if g > 2.0 * period]
+        # frames que deviam ter chegado dentro dos buracos
+        dropped = sum(max(int(round(g / period)) - 1, 0) for g in late)
+        return {
+            'client': self.index,
+            'connect_ms': round(self.connect_s * 1000.0, 1) if self.connect_s is not None else None,
+            'ping': dict(percentiles(self.ping_rtt), sent=self.ping_sent, lost=self.ping_sent - len(self.ping_rtt)),
+            'teleop': dict(percentiles(self.teleop_rtt), sent=self.teleop_sent,
+                           lost=self.teleop_sent - len(self.teleop_rtt)),
+            'status': {
+                'frames': self.status_frames,
+                'hz': round(self.status_frames / duration_s, 2),
+                'late': len(late),
+                'dropped': dropped,
+                'age': percentiles(self.status_age),
+            },
+        }
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+class VideoClient:
+    def __init__(self, index, args, measuring, stop):
+        "Um viewer do /video_feed que só conta os frames do multipart."
+        self.index = index
+        self.url = f"{args.url}/video_feed?fps={args.video_fps}&quality={args.video_quality}"
+        self.measuring = measuring
+        self.stop = stop
+        self.frames = 0
+        self.bytes = 0
+        self.frame_gaps = []
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=5.0) as resp:
+                tail = b''
+                last_t = None
+                while not self.stop.is_set():
+                    chunk = resp.read1(65536)
+                    if not chunk:
+                        break
+                    data = tail + chunk
+                    n = data.count(BOUNDARY)
+                    # o marcador pode vir partido entre dois chunks
+                    tail = data[-(len(BOUNDARY) - 1):]
+                    if not self.measuring.is_set():
+                        last_t = None
+                        continue
+                    self.bytes += len(chunk)
+                    if n:
+                        now = time.monotonic()
+                        if last_t is not None:
+                            self.frame_gaps.append(now - last_t)
+                        last_t = now
+                        self.frames += n
+        except Exception as e:
+            if not self.stop.is_set():
+                self.error = str(e)
+
+    def summary(self, duration_s):
+        return {
+            'client': self.index,
+            'fps': round(self.frames / duration_s, 2),
+            'kbytes_s': round(self.bytes / duration_s / 1024.0, 1),
+            'frame_gap': percentiles(self.frame_gaps),
+            'error': self.error,
+        }
+
+    def join(self):
+        self._thread.join(timeout=2.0)
+
+
+class ProcessSampler:
+    def __init__(self, pid, interval_s=1.0):
+        "CPU (%, 100 = um núcleo) e RSS do processo e dos filhos, do /proc, numa thread."
+        self.pid = pid
+        self.interval_s = interval_s
+        self.cpu = []
+        self.rss_mb = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ticks_s = os.sysconf('SC_CLK_TCK')
+
+    def _tree(self):
+        pids, i = [self.pid], 0
+        while i < len(pids):
+            try:
+                for task in os.listdir(f'/proc/{pids[i]}/task'):
+                    with open(f'/proc/{pids[i]}/task/{task}/children') as f:
+                        pids.extend(int(p) for p in f.read().split())
+            except OSError:
+                pass
+            i += 1
+        return pids
+
+    def _read(self):
+        ticks, rss_kb = 0, 0
+        for pid in self._tree():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    # o nome do processo (campo 2) pode ter espaços
+                    fields = f.read().rpartition(')')[2].split()
+                ticks += int(fields[11]) + int(fields[12])     # utime + stime
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            rss_kb += int(line.split()[1])
+            except (OSError, IndexError, ValueError):
+                pass    # processo acabou entre a listagem e a leitura
+        return ticks, rss_kb
+
+    def _run(self):
+        last_ticks, _ = self._read()
+        last_t = time.monotonic()
+        while not self._stop.wait(self.interval_s):
+            ticks, rss_kb = self._read()
+            now = time.monotonic()
+            self.cpu.append((ticks - last_ticks) / self._ticks_s / (now - last_t) * 100.0)
+            self.rss_mb.append(rss_kb / 1024.0)
+            last_ticks, last_t = ticks, now
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+
+    def summary(self):
+        if not self.cpu:
+            return None
+        return {
+            'pid': self.pid,
+            'cpu_mean_pct': round(sum(self.cpu) / len(self.cpu), 1),
+            'cpu_max_pct': round(max(self.cpu), 1),
+            'rss_max_mb': round(max(self.rss_mb), 1),
+        }
+
+
+def get_json(url, timeout=2.0, post=None):
+    "GET (ou POST com o dicionário post em JSON) e decodifica a resposta."
+    request = url
+    if post is not None:
+        request = urllib.request.Request(url, data=json.dumps(post).encode(),
+                                         headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def spawn_server(args):
+    "Sobe o app.py com chassi e câmera simulados e espera o 'pronto' da partida."
+    env = dict(os.environ)
+    env.setdefault('ROBOT_BACKEND', 'sim')
+    env.setdefault('MISSION_CAMERA', 'sim')
+    env.setdefault('MISSION_METRICS_LOG_S', '0')
+    log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'mission', 'server.py')],
+                              env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + args.startup_timeout_s
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Servidor saiu na partida (código {server.returncode})")
+        try:
+            if get_json(f"{args.url}/api/status").get('startup', {}).get('ready'):
+                return server
+        except OSError:
+            pass    # ainda não está ouvindo
+        time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError(f"Servidor não ficou pronto em {args.startup_timeout_s} s")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)   # o app sai pelo KeyboardInterrupt
+    try:
+        server.wait(timeout=5.0)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def merge(summaries, key):
+    "Percentis de todos os clientes juntos (recalculados a partir das amostras)."
+    samples = []
+    for s in summaries:
+        samples.extend(getattr(s, key))
+    return percentiles(samples)
+
+
+def run(args):
+    server = spawn_server(args) if args.spawn else None
+    server_pid = server.pid if server is not None else args.server_pid
+
+    measuring = threading.Event()
+    stop = threading.Event()
+    clients = [DashboardClient(i, args, measuring) for i in range(args.clients)]
+    viewers = [VideoClient(i, args, measuring, stop) for i in range(args.video_clients)]
+    threads = []
+    sampler = None
+
+    try:
+        # conecta em rampa, para não medir só a tempestade de conexões
+        for client in clients:
+            client.connect()
+            if args.ping_hz > 0:
+                threads.append(threading.Thread(target=run_at, args=(args.ping_hz, client.ping, stop), daemon=True))
+            if args.teleop_hz > 0:
+                threads.append(threading.Thread(target=run_at, args=(args.teleop_hz, client.teleop, stop), daemon=True))
+            if args.ramp_s > 0:
+                time.sleep(args.ramp_s / max(len(clients), 1))
+        for t in threads:
+            t.start()
+        for viewer in viewers:
+            viewer.start()
+
+        logger.info(f"{len(clients)} clientes e {len(viewers)} viewers conectados, aquecendo {args.warmup_s} s")
+        time.sleep(args.warmup_s)
+
+        try:
+            get_json(f"{args.url}/api/metrics", post={'reset': 1})
+        except OSError:
+            pass
+        if server_pid:
+            sampler = ProcessSampler(server_pid)
+            sampler.start()
+        for client in clients:
+            client.reset()
+        measuring.set()
+        t0 = time.monotonic()
+        time.sleep(args.duration)
+        measuring.clear()
+        duration_s = time.monotonic() - t0
+
+        try:
+            server_status = get_json(f"{args.url}/api/status")
+            server_metrics = get_json(f"{args.url}/api/metrics")
+        except OSError as e:
+            logger.warning(f"Não consegui ler /api/status e /api/metrics: {e}")
+            server_status, server_metrics = {}, {}
+
+    finally:
+        stop.set()
+        if sampler is not None:
+            sampler.stop()
+        for client in clients:
+            client.close()
+        for viewer in viewers:
+            viewer.join()
+        if server is not None:
+            stop_server(server)
+
+    client_summaries = [c.summary(duration_s) for c in clients]
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('json', 'server_log')},
+        'duration_s': round(duration_s, 2),
+        'ping': merge(clients, 'ping_rtt'),
+        'teleop': merge(clients, 'teleop_rtt'),
+        'status_age': merge(clients, 'status_age'),
+        'status_late': sum(s['status']['late'] for s in client_summaries),
+        'status_dropped': sum(s['status']['dropped'] for s in client_summaries),
+        'server_process': sampler.summary() if sampler is not None else None,
+        'server_teleop': server_status.get('teleop'),
+        'server_stages': {name: {k: stage[k] for k in ('count', 'p50_ms', 'p99_ms', 'max_ms')}
+                          for name, stage in server_metrics.get('stages', {}).items()},
+        'clients': client_summaries,
+        'video': [v.summary(duration_s) for v in viewers],
+    }
+
+
+def print_report(report):
+    def line(name, p):
+        if not p['count']:
+            return f"{name}: sem amostras"
+        return f"{name}: {p['count']} amostras, p50 {p['p50_ms']} ms, p95 {p['p95_ms']} ms, " \
+               f"p99 {p['p99_ms']} ms, máx {p['max_ms']} ms"
+
+    cfg = report['config']
+    print(f"{cfg['clients']} clientes (ping {cfg['ping_hz']} Hz, teleop {cfg['teleop_hz']} Hz, "
+          f"estado {cfg['status_hz']} Hz), {cfg['video_clients']} viewers, {report['duration_s']} s")
+    print(line("Ping ida e volta", report['ping']))
+    print(line("Teleop ack", report['teleop']))
+    print(line("Idade do estado", report['status_age']))
+    lost_ping = sum(c['ping']['lost'] for c in report['clients'])
+    lost_teleop = sum(c['teleop']['lost'] for c in report['clients'])
+    print(f"Perdidos: {lost_ping} pings, {lost_teleop} acks de teleop; frames de estado: "
+          f"{report['status_late']} atrasados, ~{report['status_dropped']} perdidos")
+    for v in report['video']:
+        extra = f" (erro: {v['error']})" if v['error'] else ""
+        print(f"Vídeo {v['client']}: {v['fps']} fps, {v['kbytes_s']} kB/s, "
+              f"intervalo p99 {v['frame_gap']['p99_ms']} ms{extra}")
+    proc = report['server_process']
+    if proc is not None:
+        print(f"Servidor: CPU média {proc['cpu_mean_pct']}%, máx {proc['cpu_max_pct']}%, "
+              f"RSS máx {proc['rss_max_mb']} MB")
+    teleop = report['server_teleop']
+    if teleop:
+        print(f"Teleop no servidor: comando -> PWM p99 {teleop['latency_p99_ms']} ms, "
+              f"{teleop['coalesced']} comandos agrupados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor de missão")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true',
+                        help="sobe o app.py com chassi e câmera simulados e derruba no fim")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="sem --spawn: PID do servidor para medir CPU e memória")
+    parser.add_argument('--server-log', default=None, help="com --spawn: grava a saída do servidor aqui")
+    parser.add_argument('--startup-timeout-s', type=float, default=60.0)
+    parser.add_argument('--clients', type=int, default=10, help="dashboards Socket.IO simulados")
+    parser.add_argument('--ping-hz', type=float, default=1.0, help="pings por segundo por cliente")
+    parser.add_argument('--teleop-hz', type=float, default=5.0,
+                        help="teleop_command por segundo por cliente (a interface manda a cada 200 ms)")
+    parser.add_argument('--status-hz', type=float, default=20.0, help="taxa de robot_pose assinada")
+    parser.add_argument('--encoding', choices=('json', 'msgpack'), default='json')
+    parser.add_argument('--transport', choices=('websocket', 'polling'), default='websocket')
+    parser.add_argument('--video-clients', type=int, default=1, help="viewers do /video_feed")
+    parser.add_argument('--video-fps', type=float, default=15.0)
+    parser.add_argument('--video-quality', type=int, default=80)
+    parser.add_argument('--ramp-s', type=float, default=2.0, help="tempo para conectar todos os clientes")
+    parser.add_argument('--warmup-s', type=float, default=3.0, help="tempo antes de começar a medir")
+    parser.add_argument('--duration', type=float, default=20.0, help="tempo medido (s)")
+    parser.add_argument('--json', default=None, help="grava o relatório completo neste arquivo")
+    args = parser.parse_args()
+
+    if args.encoding == 'msgpack' and msgpack is None:
+        parser.error("--encoding msgpack precisa do msgpack instalado")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Relatório completo em {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Ponto de entrada do servidor de missão para produção (o serviço systemd).
+
+Faz o mesmo que rodar app.py, mas os processos do detector paralelo
+(MISSION_DETECT_WORKERS, iniciados com spawn) reimportam o __main__ do pai:
+sendo este arquivo, eles não importam Flask/Socket.IO nem aplicam o
+monkey_patch do eventlet, só o vision.parallel.
+"""
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from mission.app import main
+    main()
@@ -0,0 +1,132 @@
+"""
+Publicador do estado do sistema para os clientes Socket.IO.
+
+Em vez de mandar o system_state inteiro para todo mundo a 50 Hz, cada campo
+tem uma versão; cada cliente recebe só os campos que mudaram desde o último
+envio para ele, respeitando a taxa máxima que ele pediu por campo (ex: pose
+a 20 Hz, tags só quando mudam). Se o msgpack estiver instalado e o cliente
+pedir, a mensagem vai em binário.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:     # opcional, sem ele tudo vai em JSON
+    msgpack = None
+
+# taxa máxima padrão por campo (Hz); 0 = manda sempre que mudar
+DEFAULT_RATES = {
+    'robot_pose': 20.0,
+}
+
+
+class ClientSubscription:
+    def __init__(self, sid, rates=None, encoding='json'):
+        self.sid = sid
+        self.rates = dict(DEFAULT_RATES)
+        if rates:
+            self.rates.update(rates)
+        self.encoding = encoding
+        self.sent_versions = {}     # campo -> versão que este cliente já recebeu
+        self.last_sent = {}         # campo -> quando foi mandado (time.monotonic())
+
+
+class StatePublisher:
+    def __init__(self, socketio, state, event='system_status_delta'):
+        """
+        socketio: instância do Flask-SocketIO usada para emitir.
+        state: dicionário com o estado (o system_state do app); continua
+            podendo ser lido direto, mas deve ser escrito por set().
+        event: nome do evento das atualizações parciais.
+        """
+        self.socketio = socketio
+        self.state = state
+        self.event = event
+
+        self._lock = threading.Lock()
+        self._version = 0
+        self._versions = {field: 0 for field in state}
+        self._clients = {}
+
+    def set(self, field, value):
+        "Atualiza um campo; só gera versão nova se o valor mudou de verdade."
+        with self._lock:
+            if field in self.state and self.state[field] == value:
+                return
+            self._version += 1
+            self._versions[field] = self._version
+            self.state[field] = value
+            self.state['last_update'] = datetime.now().isoformat()
+
+    def add_client(self, sid):
+        "Registra um cliente que já recebeu o estado completo agora."
+        with self._lock:
+            client = ClientSubscription(sid)
+            client.sent_versions = dict(self._versions)
+            self._clients[sid] = client
+
+    def remove_client(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def subscribe(self, sid, rates=None, encoding='json'):
+        """
+        Muda as taxas e a codificação de um cliente.
+        rates: {campo: Hz} (0 = a cada mudança).
+        encoding: 'json' ou 'msgpack' (volta para json se o msgpack não estiver instalado).
+        """
+        if encoding == 'msgpack' and msgpack is None:
+            encoding = 'json'
+
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return None
+            if rates:
+                client.rates.update({field: float(hz) for field, hz in rates.items()})
+            client.encoding = encoding
+            return encoding
+
+    def flush(self):
+        """
+        Manda a cada cliente os campos que mudaram e cuja taxa já permite.
+        Chamado periodicamente pelo loop do robô. Clientes com o mesmo
+        conjunto de campos e codificação dividem a mesma mensagem codificada.
+        """
+        now = time.monotonic()
+        outgoing = []
+        with self._lock:
+            for client in self._clients.values():
+                fields = []
+                for field, version in self._versions.items():
+                    if version <= client.sent_versions.get(field, 0):
+                        continue
+                    hz = client.rates.get(field, 0.0)
+                    if hz > 0 and now - client.last_sent.get(field, 0.0) < 1.0 / hz:
+                        continue
+                    fields.append(field)
+                    client.sent_versions[field] = version
+                    client.last_sent[field] = now
+
+                if fields:
+                    outgoing.append((client.sid, client.encoding, tuple(fields)))
+
+            encoded = {}
+            for sid, encoding, fields in outgoing:
+                key = (encoding, fields)
+                if key not in encoded:
+                    delta = {field: self.state[field] for field in fields}
+                    delta['last_update'] = self.state.get('last_update')
+                    encoded[key] = self._encode(delta, encoding)
+
+        for sid, encoding, fields in outgoing:
+            self.socketio.emit(self.event, encoded[(encoding, fields)], to=sid)
+
+    @staticmethod
+    def _encode(delta, encoding):
+        if encoding == 'msgpack':
+            return msgpack.packb(delta, use_bin_type=True)
+        return delta
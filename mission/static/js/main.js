@@ -12,6 +12,10 @@ const appState = {
     systemState: null
 };
 
+// O servidor para o robô se ficar sem comando por 0.5 s (homem-morto),
+// então enquanto o robô deve andar o comando é reenviado periodicamente
+const TELEOP_HEARTBEAT_MS = 200;
+
 // ===================================================================
 // INICIALIZAÇÃO
 // ===================================================================
@@ -37,6 +41,12 @@ function initializeWebSocket() {
         appState.connected = true;
         updateConnectionStatus(true);
         addLogEntry('Sistema conectado ao servidor', 'received');
+
+        // Pede só as mudanças, pose a no máximo 20 Hz, em binário se der
+        appState.socket.emit('subscribe_status', {
+            rates: { robot_pose: 20 },
+            encoding: window.MessagePack ? 'msgpack' : 'json'
+        });
     });
 
     // Evento: Desconectado
@@ -61,6 +71,15 @@ function initializeWebSocket() {
         updateSystemInfo(data);
     });
 
+    // Evento: Atualização parcial do estado (só os campos que mudaram)
+    appState.socket.on('system_status_delta', (data) => {
+        if (data instanceof ArrayBuffer) {
+            data = MessagePack.decode(new Uint8Array(data));
+        }
+        appState.systemState = Object.assign(appState.systemState || {}, data);
+        updateSystemInfo(appState.systemState);
+    });
+
     // Evento: Confirmação de Comando
     appState.socket.on('command_ack', (data) => {
         console.log('Comando reconhecido:', data);
@@ -108,6 +127,15 @@ function setupEventListeners() {
 
     // Controle do Garfo
     document.getElementById('btn-set-fork').addEventListener('click', setForkHeight);
+
+    // Mantém o watchdog do servidor alimentado enquanto os sliders não estão no zero
+    setInterval(() => {
+        const linear = parseFloat(document.getElementById('linear-speed').value);
+        const angular = parseFloat(document.getElementById('angular-speed').value);
+        if (linear !== 0 || angular !== 0) {
+            sendTeleopCommand();
+        }
+    }, TELEOP_HEARTBEAT_MS);
 }
 
 // ===================================================================
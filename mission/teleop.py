@@ -0,0 +1,108 @@
+"""
+Caminho de teleoperação: navegador -> RobotChassis.set_velocity.
+
+O navegador pode mandar teleop_command muito mais rápido do que os motores
+aproveitam. submit() só guarda o último comando (sem log, sem emit); tick(),
+chamado a cada ciclo do loop do robô, aplica o mais novo e descarta os
+intermediários. Se nenhum comando chegar dentro de timeout_s com o robô
+andando, o watchdog (homem-morto) para o chassi.
+"""
+
+import math
+import time
+import logging
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class TeleopController:
+    # quantas amostras de latência comando -> PWM guardar
+    LATENCY_WINDOW = 500
+
+    def __init__(self, chassis=None, timeout_s=0.5, max_linear=50.0, max_angular=90.0):
+        """
+        chassis: RobotChassis (pode ser None, aí só conta os comandos).
+        timeout_s: tempo sem comando até o watchdog parar o robô.
+        max_linear, max_angular: limites aceitos (cm/s e graus/s), os mesmos dos sliders.
+        """
+        self.chassis = chassis
+        self.timeout_s = timeout_s
+        self.max_linear = max_linear
+        self.max_angular = max_angular
+
+        self._pending = None        # (seq, linear, angular, recebido_em), trocado inteiro
+        self._received = 0
+        # handlers do Socket.IO podem rodar em threads: seq e _pending mudam juntos
+        self._submit_lock = threading.Lock()
+        self._applied_seq = 0
+        self._applied = 0
+        self._last_command_t = 0.0
+        self._moving = False
+        self.watchdog_trips = 0
+
+        self._latency_s = array('d', [0.0]) * self.LATENCY_WINDOW
+
+    def submit(self, linear, angular):
+        """
+        Chamado a cada mensagem do navegador. Tem que ser barato: só guarda o último.
+        Levanta ValueError se um valor não for um número finito (ex: 'nan').
+        """
+        linear, angular = float(linear), float(angular)
+        if not (math.isfinite(linear) and math.isfinite(angular)):
+            raise ValueError("comando de teleop não finito")
+        linear = max(min(linear, self.max_linear), -self.max_linear)
+        angular = max(min(angular, self.max_angular), -self.max_angular)
+        with self._submit_lock:
+            self._received += 1
+            self._pending = (self._received, linear, angular, time.monotonic())
+
+    def tick(self):
+        """
+        Chamado uma vez por ciclo de controle. Aplica o comando mais novo (se
+        chegou algum) ou para o robô se o watchdog estourou.
+        Retorna True se o robô está sendo comandado a andar.
+        """
+        cmd = self._pending
+        now = time.monotonic()
+
+        if cmd is not None and cmd[0] != self._applied_seq:
+            seq, linear, angular, received_at = cmd
+            # consumido antes de aplicar: se o chassi falhar, o mesmo comando não é
+            # repetido a cada ciclo e o watchdog continua podendo parar o robô
+            self._applied_seq = seq
+            if self.chassis is not None:
+                self.chassis.set_velocity(linear, angular)
+
+            self._latency_s[self._applied % self.LATENCY_WINDOW] = time.monotonic() - received_at
+            self._applied += 1
+            self._last_command_t = received_at
+            self._moving = linear != 0.0 or angular != 0.0
+
+        elif self._moving and now - self._last_command_t > self.timeout_s:
+            if self.chassis is not None:
+                self.chassis.stop()
+            self._moving = False
+            self.watchdog_trips += 1
+            logger.warning(f"[TELEOP] Sem comando há {now - self._last_command_t:.2f} s, robô parado")
+
+        return self._moving
+
+    def get_stats(self):
+        n = min(self._applied, self.LATENCY_WINDOW)
+        samples = sorted(self._latency_s[:n])
+        stats = {
+            'received': self._received,
+            'applied': self._applied,
+            'coalesced': self._received - self._applied,
+            'watchdog_trips': self.watchdog_trips,
+            'latency_p50_ms': None,
+            'latency_p99_ms': None,
+            'latency_max_ms': None,
+        }
+        if n:
+            stats['latency_p50_ms'] = samples[n // 2] * 1000.0
+            stats['latency_p99_ms'] = samples[min(int(n * 0.99), n - 1)] * 1000.0
+            stats['latency_max_ms'] = samples[-1] * 1000.0
+        return stats
@@ -0,0 +1,190 @@
+"""
+Distribuição do vídeo anotado para os viewers do /video_feed.
+
+Um produtor só pega o frame novo da câmera, roda a detecção e desenha uma
+vez; o JPEG é codificado uma vez por nível de qualidade e o mesmo bloco
+multipart (bytes imutáveis) é entregue a todos os viewers. Cada viewer tem
+FPS máximo próprio e sempre recebe o frame mais novo: cliente lento pula
+frames em vez de segurar o produtor.
+"""
+
+import threading
+import time
+import logging
+
+import cv2
+
+from runtime.workers import offload
+
+logger = logging.getLogger(__name__)
+
+BOUNDARY_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+class VideoBroadcaster:
+    # níveis de qualidade JPEG aceitos (o pedido do viewer é arredondado para um deles)
+    QUALITY_LEVELS = (60, 80, 95)
+
+    def __init__(self, camera_factory, vision_system, on_detections=None, detector=None,
+                 detect_options=None):
+        """
+        camera_factory: função que retorna o CameraService (chamada na thread do produtor).
+        vision_system: VisionSystem usado para detectar e desenhar.
+        on_detections: chamada com a lista de detecções de cada frame novo.
+        detector: ParallelDetector (vision/parallel.py) opcional; com ele a
+            detecção roda em outros processos, vários frames ao mesmo tempo,
+            e aqui só se desenha o resultado.
+        detect_options: argumentos extras do detect_tags (ex: {'pose': 'none'}
+            quando só os IDs interessam), também no detector paralelo.
+        """
+        self._camera_factory = camera_factory
+        self._vision = vision_system
+        self._on_detections = on_detections
+        self._detector = detector
+        self._detect_options = detect_options or {}
+        self._in_flight = {}    # seq -> frame esperando o resultado do detector paralelo
+        self._in_flight_lock = threading.Lock()     # produtor e coletora do detector mexem juntos
+        if detector is not None:
+            detector.on_result = self._on_parallel_result
+
+        self._cond = threading.Condition()
+        self._frame = None      # (seq, frame anotado)
+        self._chunks = {}       # qualidade -> (seq, bloco multipart) do frame atual
+        self._viewers = 0
+        self._thread = None
+        self._running = False
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._produce, daemon=True)
+                self._thread.start()
+
+    def _produce(self):
+        try:
+            camera = self._camera_factory()
+        except RuntimeError as e:
+            logger.error(f"[CAM] {e}")
+            camera = None
+
+        last_seq = 0
+        while camera is not None and self._running:
+            # sem ninguém assistindo, não gasta CPU detectando
+            with self._cond:
+                self._cond.wait_for(lambda: self._viewers > 0 or not self._running)
+
+            item = camera.wait_frame(last_seq)
+            if item is None:
+                if not camera.running:
+                    break
+                continue
+
+            last_seq, t_capture, frame = item
+
+            if self._detector is not None:
+                # o resultado chega depois, em _on_parallel_result
+                with self._in_flight_lock:
+                    self._in_flight[last_seq] = frame
+                if not self._detector.submit(last_seq, t_capture, frame, self._detect_options):
+                    with self._in_flight_lock:
+                        self._in_flight.pop(last_seq, None)
+                continue
+
+            # o frame é compartilhado com outros leitores da câmera, desenha numa cópia
+            frame, results = offload(self._vision.detect_tags, frame.copy(), draw=True,
+                                     **self._detect_options)
+            self._publish(last_seq, frame, results)
+
+        with self._cond:
+            self._running = False
+            self._thread = None
+            self._cond.notify_all()
+
+    def _on_parallel_result(self, packet):
+        with self._in_flight_lock:
+            frame = self._in_flight.pop(packet.seq, None)
+            # os resultados chegam em ordem: o que ficou para trás se perdeu
+            for seq in [seq for seq in self._in_flight if seq < packet.seq]:
+                del self._in_flight[seq]
+        if frame is None:
+            return
+        frame = frame.copy()
+        self._vision.draw(frame, packet.detections)
+        self._publish(packet.seq, frame, packet.detections)
+
+    def _publish(self, seq, frame, results):
+        if self._on_detections is not None:
+            self._on_detections(results)
+
+        with self._cond:
+            self._frame = (seq, frame)
+            self._chunks = {}
+            self._cond.notify_all()
+
+    def _chunk(self, quality):
+        """
+        Bloco multipart do frame atual, codificado uma vez por qualidade.
+        O imencode roda fora do _cond, senão segura o produtor e os outros
+        viewers; dois viewers podem codificar o mesmo frame ao mesmo tempo,
+        mas só um resultado fica guardado.
+        """
+        with self._cond:
+            seq, frame = self._frame
+            cached = self._chunks.get(quality)
+        if cached is not None and cached[0] == seq:
+            return cached
+
+        _, buffer = offload(cv2.imencode, '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        # memoryview evita o tobytes(): o buffer do OpenCV é copiado uma vez só, aqui
+        chunk = b''.join((BOUNDARY_HEADER, memoryview(buffer), b'\r\n'))
+
+        with self._cond:
+            # se chegou frame novo enquanto codificava, não guarda o velho
+            if self._frame[0] == seq:
+                self._chunks[quality] = (seq, chunk)
+        return seq, chunk
+
+    def stream(self, quality=95, max_fps=None):
+        """
+        Gerador MJPEG para um viewer.
+        quality: qualidade JPEG desejada.
+        max_fps: limite de quadros por segundo deste viewer (None = o da câmera).
+        """
+        quality = min(self.QUALITY_LEVELS, key=lambda q: abs(q - quality))
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+
+        self._ensure_started()
+        with self._cond:
+            self._viewers += 1
+            self._cond.notify_all()
+
+        try:
+            last_seq = 0
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: not self._running or (self._frame is not None and self._frame[0] > last_seq),
+                        timeout=1.0
+                    )
+                    if not self._running:
+                        break
+                    if self._frame is None or self._frame[0] <= last_seq:
+                        continue
+
+                sent_at = time.monotonic()
+                last_seq, chunk = self._chunk(quality)
+                yield chunk
+
+                # respeita o FPS do viewer; os frames que passarem nesse meio tempo são pulados
+                if min_interval:
+                    remaining = min_interval - (time.monotonic() - sent_at)
+                    if remaining > 0:
+                        time.sleep(remaining)
+        finally:
+            with self._cond:
+                self._viewers -= 1
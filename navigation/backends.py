@@ -0,0 +1,355 @@
+"""
+Backends de GPIO do módulo de navegação.
+
+PigpioBackend fala com o daemon pigpio de verdade (só no Raspberry Pi).
+SimBackend simula uma base diferencial: dinâmica dos motores a partir do
+duty cycle, a assimetria que o l_trim corrige, e bordas de encoder em taxas
+realistas. Com ele dá para rodar RobotChassis, main.py e o servidor de
+missão num notebook, inclusive mais rápido que o tempo real.
+
+O backend é escolhido pela variável de ambiente ROBOT_BACKEND (pigpio|sim)
+ou por set_backend() antes de criar motores e encoders. Todos os
+dispositivos dividem uma conexão só por backend (connect/disconnect contam
+referências), em vez de cada um abrir o seu socket com o daemon.
+"""
+
+import math
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# mesmos valores do pigpio, para o navigation.py não precisar importar pigpio
+INPUT = 0
+OUTPUT = 1
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+
+TICK_MASK = 0xFFFFFFFF  # tick do pigpio é um contador de 32 bits em microssegundos
+
+
+class PigpioBackend:
+    name = 'pigpio'
+
+    def __init__(self):
+        self._pi = None
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        "Retorna a conexão compartilhada com o daemon, abrindo na primeira vez."
+        with self._lock:
+            if self._pi is None:
+                import pigpio   # só existe (e só funciona) no Raspberry Pi
+
+                pi = pigpio.pi()
+                if not pi.connected:
+                    raise RuntimeError("pigpio não conseguiu conectar-se à placa!")
+                self._pi = pi
+                logger.info("[GPIO] Conectado ao daemon pigpio")
+            self._users += 1
+            return self._pi
+
+    def disconnect(self):
+        "Devolve a conexão; fecha de verdade quando o último dispositivo solta."
+        with self._lock:
+            self._users -= 1
+            if self._users <= 0 and self._pi is not None:
+                self._pi.stop()
+                self._pi = None
+                self._users = 0
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimMotor:
+    def __init__(self, pwm_pin, inA_pin, inB_pin, encoder_pin=None, max_rpm=176.0,
+                 gain=1.0, tau_s=0.08, deadband=0.08, edges_per_rev=32):
+        """
+        Motor DC simulado com roda e encoder óptico de um canal.
+        max_rpm: rotação com 100% de duty (176 rpm ~ 60 cm/s numa roda de 6.5 cm).
+        gain: fração do max_rpm que este motor realmente alcança (assimetria entre rodas).
+        tau_s: constante de tempo mecânica (resposta de primeira ordem).
+        deadband: fração de duty abaixo da qual o motor não vence o atrito.
+        edges_per_rev: bordas do encoder por volta (o Encoder conta subida e descida).
+        """
+        self.pwm_pin = pwm_pin
+        self.inA_pin = inA_pin
+        self.inB_pin = inB_pin
+        self.encoder_pin = encoder_pin
+        self.max_rps = max_rpm / 60.0
+        self.gain = gain
+        self.tau_s = tau_s
+        self.deadband = deadband
+        self.edges_per_rev = edges_per_rev
+
+        self.rps = 0.0          # velocidade angular atual (voltas/s, com sinal)
+        self.revolutions = 0.0  # voltas acumuladas (com sinal)
+        self._edge_level = 0
+
+    def target_rps(self, inA, inB, duty_fraction):
+        if inA == inB:
+            return 0.0  # ponte-H em freio (ou desligada)
+
+        u = duty_fraction if inA else -duty_fraction
+        if abs(u) <= self.deadband:
+            return 0.0
+        effective = (abs(u) - self.deadband) / (1.0 - self.deadband)
+        return math.copysign(effective * self.max_rps * self.gain, u)
+
+    def step(self, dt, target):
+        "Avança a dinâmica e retorna quantas bordas de encoder aconteceram."
+        before = self.revolutions
+        self.rps += (target - self.rps) * min(dt / self.tau_s, 1.0)
+        self.revolutions += self.rps * dt
+
+        # encoder de um canal não sabe o sentido: toda borda cruzada conta
+        return abs(math.floor(self.revolutions * self.edges_per_rev) -
+                   math.floor(before * self.edges_per_rev))
+
+
+class SimCallback:
+    def __init__(self, backend, gpio, edge, func):
+        self._backend = backend
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+        self._backend._remove_callback(self)
+
+
+class SimPi:
+    "Imita a parte da API do pigpio.pi que o navigation.py usa."
+    connected = True
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def set_mode(self, gpio, mode):
+        self._backend.modes[gpio] = mode
+
+    def write(self, gpio, level):
+        self._backend.levels[gpio] = 1 if level else 0
+
+    def read(self, gpio):
+        return self._backend.levels.get(gpio, 0)
+
+    def set_PWM_range(self, gpio, range_):
+        self._backend.pwm_range[gpio] = range_
+
+    def set_PWM_frequency(self, gpio, frequency):
+        self._backend.pwm_frequency[gpio] = frequency
+        return frequency
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        self._backend.duty[gpio] = dutycycle
+
+    def set_bank_1(self, bits):
+        for gpio in range(32):
+            if bits >> gpio & 1:
+                self._backend.levels[gpio] = 1
+
+    def clear_bank_1(self, bits):
+        for gpio in range(32):
+            if bits >> gpio & 1:
+                self._backend.levels[gpio] = 0
+
+    def callback(self, gpio, edge=RISING_EDGE, func=None):
+        return self._backend._add_callback(gpio, edge, func)
+
+    def get_current_tick(self):
+        return self._backend.tick()
+
+    def stop(self):
+        pass
+
+
+class SimBackend:
+    name = 'sim'
+
+    def __init__(self, speed=1.0, dt=0.001, wheel_diameter_cm=6.5, track_width_cm=17.0, motors=None):
+        """
+        Planta simulada da empilhadeira.
+        speed: quantos segundos simulados por segundo real (1.0 = tempo real,
+            10.0 = dez vezes mais rápido, None = o mais rápido possível).
+        dt: passo de integração em segundos.
+        motors: lista de SimMotor; o padrão segue a pinagem do RobotChassis,
+            com a roda esquerda mais fraca (é isso que o l_trim = 1.4 compensa).
+        """
+        self.speed = speed
+        self.dt = dt
+        self.wheel_circumference_cm = math.pi * wheel_diameter_cm
+        self.track_width_cm = track_width_cm
+
+        if motors is None:
+            motors = [
+                SimMotor(12, 5, 6, encoder_pin=17, gain=1.0 / 1.4),    # esquerda
+                SimMotor(13, 7, 8, encoder_pin=27),                   # direita
+            ]
+        self.motors = motors
+
+        # estado dos pinos, escrito pelos SimPi
+        self.modes = {}
+        self.levels = {}
+        self.pwm_range = {}
+        self.pwm_frequency = {}
+        self.duty = {}
+
+        self.time_s = 0.0
+        self.pose = (0.0, 0.0, 0.0)     # pose real (x_cm, y_cm, theta_rad), para comparar com odometria
+
+        self._callbacks = {}
+        self._callbacks_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._pi = SimPi(self)
+        self._users = 0
+
+    # ---------------------------------------------------------------- pigpio
+
+    def connect(self):
+        if not self._running:
+            self.start()
+        self._users += 1
+        return self._pi
+
+    def disconnect(self):
+        self._users -= 1
+        if self._users <= 0:
+            self._users = 0
+            self.stop()
+
+    def monotonic(self):
+        return self.time_s
+
+    def tick(self):
+        return int(self.time_s * 1e6) & TICK_MASK
+
+    def sleep(self, seconds):
+        "Dorme em tempo simulado."
+        target = self.time_s + seconds
+        while self.time_s < target and self._running:
+            if self.speed is None:
+                time.sleep(0)
+            else:
+                time.sleep(min((target - self.time_s) / self.speed, 0.001))
+
+    def _add_callback(self, gpio, edge, func):
+        cb = SimCallback(self, gpio, edge, func)
+        with self._callbacks_lock:
+            self._callbacks.setdefault(gpio, []).append(cb)
+        return cb
+
+    def _remove_callback(self, cb):
+        with self._callbacks_lock:
+            callbacks = self._callbacks.get(cb.gpio, [])
+            if cb in callbacks:
+                callbacks.remove(cb)
+
+    # ---------------------------------------------------------------- física
+
+    def step(self, dt=None):
+        "Avança a simulação um passo. Pode ser chamado direto para simulação determinística."
+        dt = self.dt if dt is None else dt
+        start_us = self.time_s * 1e6
+
+        speeds_cm_s = []
+        for motor in self.motors:
+            duty_range = self.pwm_range.get(motor.pwm_pin, 255)
+            duty = min(self.duty.get(motor.pwm_pin, 0) / duty_range, 1.0)
+            target = motor.target_rps(self.levels.get(motor.inA_pin, 0),
+                                      self.levels.get(motor.inB_pin, 0), duty)
+            edges = motor.step(dt, target)
+            speeds_cm_s.append(motor.rps * self.wheel_circumference_cm)
+
+            if edges and motor.encoder_pin is not None:
+                self._fire_edges(motor, edges, start_us, dt * 1e6)
+
+        self.time_s += dt
+
+        # cinemática diferencial para a pose real
+        if len(speeds_cm_s) >= 2:
+            v_l, v_r = speeds_cm_s[0], speeds_cm_s[1]
+            v = (v_l + v_r) / 2.0
+            w = (v_r - v_l) / self.track_width_cm
+            x, y, theta = self.pose
+            x += v * math.cos(theta) * dt
+            y += v * math.sin(theta) * dt
+            theta += w * dt
+            self.pose = (x, y, theta)
+
+    def _fire_edges(self, motor, edges, start_us, dt_us):
+        with self._callbacks_lock:
+            callbacks = list(self._callbacks.get(motor.encoder_pin, ()))
+
+        for i in range(edges):
+            # espalha as bordas igualmente dentro do passo
+            tick = int(start_us + dt_us * (i + 1) / edges) & TICK_MASK
+            motor._edge_level ^= 1
+            level = motor._edge_level
+            self.levels[motor.encoder_pin] = level
+            for cb in callbacks:
+                if (cb.edge == EITHER_EDGE or (cb.edge == RISING_EDGE and level == 1)
+                        or (cb.edge == FALLING_EDGE and level == 0)):
+                    cb.func(motor.encoder_pin, level, tick)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"[SIM] Planta simulada iniciada (speed={self.speed})")
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _run(self):
+        real_start = time.monotonic()
+        sim_start = self.time_s
+        while self._running:
+            self.step()
+            if self.speed is None:
+                continue
+
+            # mantém o ritmo: tempo simulado = tempo real * speed
+            ahead = (self.time_s - sim_start) / self.speed - (time.monotonic() - real_start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def make_backend(name):
+    if name == 'pigpio':
+        return PigpioBackend()
+    if name == 'sim':
+        speed = os.environ.get('ROBOT_SIM_SPEED', '1.0')
+        return SimBackend(speed=None if speed == 'max' else float(speed))
+    raise ValueError(f"Backend de GPIO desconhecido: {name}")
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = make_backend(os.environ.get('ROBOT_BACKEND', 'pigpio'))
+    return _backend
+
+
+def set_backend(backend):
+    "Troca o backend. Aceita uma instância ou o nome ('pigpio' ou 'sim')."
+    global _backend
+    if isinstance(backend, str):
+        backend = make_backend(backend)
+    _backend = backend
+    return backend
@@ -1,9 +1,13 @@
 import math
-import pigpio
-from simple_pid import PID
+from array import array
 import time
 import threading
 
+from navigation.backends import get_backend, INPUT, OUTPUT, EITHER_EDGE, TICK_MASK
+from navigation.odometry import Odometry
+from runtime.metrics import metrics
+from runtime.scheduler import scheduler
+
 
 class DCMotor:
     def __init__(self, pwm_pin: int, inA_pin: int, inB_pin: int, freq: int):
@@ -15,73 +19,168 @@ class DCMotor:
         freq: frequência da onda PWM.
         '''
 
-        self.pi = pigpio.pi()
-        if not self.pi.connected:
-            raise RuntimeError("pigpio não conseguiu conectar-se à placa!")
-    
+        # conexão compartilhada com os outros dispositivos (pigpio de verdade ou simulação)
+        self._backend = get_backend()
+        self.pi = self._backend.connect()
+
         self.pwm_pin = pwm_pin
         self.inA_pin = inA_pin
         self.inB_pin = inB_pin
         self.freq = freq
 
-        self.pi.set_mode(self.pwm_pin, pigpio.OUTPUT)
-        self.pi.set_mode(self.inA_pin, pigpio.OUTPUT)
-        self.pi.set_mode(self.inB_pin, pigpio.OUTPUT)
+        self.pi.set_mode(self.pwm_pin, OUTPUT)
+        self.pi.set_mode(self.inA_pin, OUTPUT)
+        self.pi.set_mode(self.inB_pin, OUTPUT)
 
         self.pi.set_PWM_range(self.pwm_pin, 100)    # agora duty cycle máximo é 100 (antes era 255)
         self.pi.set_PWM_frequency(self.pwm_pin, self.freq)
 
+        # último estado mandado ao daemon, para não repetir escrita que não muda nada
+        self._direction = None  # (inA, inB)
+        self._duty = None
+
         self.stop() # começar parado para evitar surpresinhas fdp
 
+    def _apply(self, inA, inB, duty_percent, force=False):
+        if force or (inA, inB) != self._direction:
+            self.pi.write(self.inA_pin, inA)
+            self.pi.write(self.inB_pin, inB)
+            self._direction = (inA, inB)
+        self.set_duty(duty_percent, force=force)
+
+    def set_duty(self, duty_percent, force=False):
+        """
+        Só o duty cycle, sem mexer na direção. Repetir o último valor não
+        escreve nada, a não ser com force=True.
+        """
+        duty = int(duty_percent)    # o pigpio trunca para inteiro de qualquer jeito
+        if force or duty != self._duty:
+            self.pi.set_PWM_dutycycle(self.pwm_pin, duty)
+            self._duty = duty
+
+    def direction_pins(self, direction, force=False):
+        """
+        Para quem escreve vários motores de uma vez (MotorBank): os pares
+        (pino, nível) que precisam mudar para chegar em direction = (inA, inB),
+        ou () se já está assim. Depois de escrever, chamar mark_direction().
+        """
+        if not force and direction == self._direction:
+            return ()
+        return ((self.inA_pin, direction[0]), (self.inB_pin, direction[1]))
+
+    def mark_direction(self, direction):
+        "Registra a direção escrita por fora (ver direction_pins)."
+        self._direction = direction
+
+    def get_direction(self):
+        "1 para frente, -1 para ré, 0 parado."
+        if self._direction == (1, 0):
+            return 1
+        if self._direction == (0, 1):
+            return -1
+        return 0
+
     def forward(self, duty_percent):
-        self.pi.write(self.inA_pin, 1)
-        self.pi.write(self.inB_pin, 0)
-        self.pi.set_PWM_dutycycle(self.pwm_pin, duty_percent)
+        self._apply(1, 0, duty_percent)
 
     def reverse(self, duty_percent):
-        self.pi.write(self.inA_pin, 0)
-        self.pi.write(self.inB_pin, 1)
-        self.pi.set_PWM_dutycycle(self.pwm_pin, duty_percent)
+        self._apply(0, 1, duty_percent)
     
     def stop(self):
-        self.pi.write(self.inA_pin, 0)
-        self.pi.write(self.inB_pin, 0)
-        self.pi.set_PWM_dutycycle(self.pwm_pin, 0)
+        # sempre escreve: se algo mexeu nos pinos por fora, o cache pode estar errado
+        self._apply(0, 0, 0, force=True)
 
     def close(self):
-        self.stop()     # para rodas...
-        self.pi.stop()  # e mata conexão com o rpi
+        self.stop()                     # para rodas...
+        self._backend.disconnect()      # e solta a conexão com o rpi
+
+
+class MotorBank:
+    def __init__(self, motors):
+        """
+        Comanda vários DCMotor de uma vez, com o mínimo de chamadas ao daemon:
+        todos os pinos de direção vão em um clear_bank_1 e um set_bank_1, e
+        os duty cycles logo em seguida, um atrás do outro. Diminui a latência
+        por comando e a defasagem entre as rodas.
+        Os motores precisam estar na mesma conexão e usar GPIOs 0-31.
+        """
+        self.motors = motors
+        self.pi = motors[0].pi
+
+    def apply(self, duties, force=False):
+        """
+        duties: um duty com sinal por motor (positivo frente, negativo ré, zero para).
+        force: escreve tudo mesmo que o cache diga que não mudou (para parar).
+        """
+        t0 = metrics.start('pwm_write')
+        set_mask = 0
+        clear_mask = 0
+        directions = []
+
+        for motor, duty in zip(self.motors, duties):
+            if duty > 0:
+                direction = (1, 0)
+            elif duty < 0:
+                direction = (0, 1)
+            else:
+                direction = (0, 0)
+            directions.append(direction)
+
+            for pin, level in motor.direction_pins(direction, force=force):
+                if level:
+                    set_mask |= 1 << pin
+                else:
+                    clear_mask |= 1 << pin
+
+        # primeiro desliga, depois liga: nunca passa por inA = inB = 1
+        if clear_mask:
+            self.pi.clear_bank_1(clear_mask)
+        if set_mask:
+            self.pi.set_bank_1(set_mask)
+
+        for motor, direction, duty in zip(self.motors, directions, duties):
+            motor.mark_direction(direction)
+            motor.set_duty(abs(duty), force=force)
+        metrics.record('pwm_write', t0)
 
 
 class Encoder:
-    def __init__(self, interrupt_pin: int, ppr: int, debounce_us: float=0):
+    def __init__(self, interrupt_pin: int, ppr: int, debounce_us: float=0, window: int=16,
+                 window_us: int=50000, timeout_us: int=250000):
         """
         Cria um novo encoder rotatório óptico.
         interrupt_pin: o pino que vai receber os pulsos do OUT do encoder.
         ppr: (pulses per revolution) quantos pulsos o encoder gera para uma volta completa.
         debounce_us: em microssegundos, o intervalo de debounce (ignora pulsos dentro do intervalo)
+        window: quantos ticks de borda guardar no buffer circular.
+        window_us: a velocidade é a média das bordas dentro desse intervalo (mas sempre
+            pelo menos um período, mesmo que seja mais longo).
+        timeout_us: sem borda por mais tempo que isso, a roda é considerada parada.
         """
 
         self.interrupt_pin = interrupt_pin
         self.ppr = ppr
         self.debounce_us = debounce_us
+        self.window_us = window_us
+        self.timeout_us = timeout_us
 
         self.last_tick = 0
         self.pulses = 0
         self._lock = threading.Lock()
 
-        self._last_calc_time = time.time()
-        self._last_calc_pulses = 0
+        # tick (us, do pigpio) de cada borda, num buffer circular de tamanho fixo
+        self._ticks = array('L', [0]) * window
+        self._edges = 0     # total de bordas gravadas no buffer (não zera no reset)
 
-        self.pi = pigpio.pi()
-        if not self.pi.connected:
-            raise RuntimeError("pigpio não conseguiu conectar-se à placa!")
-        
-        self.pi.set_mode(self.interrupt_pin, pigpio.INPUT)
+        backend = get_backend()
+        self._backend = backend
+        self.pi = backend.connect()
+
+        self.pi.set_mode(self.interrupt_pin, INPUT)
 
         self._cb = self.pi.callback(
             interrupt_pin,
-            pigpio.EITHER_EDGE,
+            EITHER_EDGE,
             self._pulse_callback
         )
     
@@ -90,13 +189,16 @@ class Encoder:
 
     def _pulse_callback(self, gpio, level, tick):
         if self.debounce_us > 0:
-            if (tick - self.last_tick) < self.debounce_us:
+            # o tick dá a volta em 32 bits (~72 min), então a diferença é mascarada
+            if ((tick - self.last_tick) & TICK_MASK) < self.debounce_us:
                 return      # está dentro do intervalo de debouncing
             self.last_tick = tick
             
         with self._lock:    # evita concorrência de threads
             #print(f"{self}: ticked!")
             self.pulses += 1
+            self._edges += 1
+            self._ticks[self._edges % len(self._ticks)] = tick
     
     def get_pulses(self):
         with self._lock:
@@ -105,27 +207,56 @@ class Encoder:
     def reset(self):
         with self._lock:
             self.pulses = 0
-    
-    def get_rpm(self):
-        now = time.time()
-        dt = now - self._last_calc_time
-        
-        if dt <= 0:
-            return 0
 
-        pulses_now = self.get_pulses()
-        dp = pulses_now - self._last_calc_pulses
+    def get_edge_rate(self):
+        """
+        Bordas por segundo, estimadas pelos ticks de hardware das últimas bordas.
+        Estimador híbrido: em baixa rotação usa o período da última borda (não
+        depende de quantas vezes alguém chama esta função); em alta rotação
+        faz a média de todas as bordas dentro de window_us. Se já passou mais
+        tempo desde a última borda do que o período médio, a roda está
+        freando e esse tempo vira o limite.
+        """
+        size = len(self._ticks)
 
-        self._last_calc_time = now
-        self._last_calc_pulses = pulses_now
+        with self._lock:
+            # tick lido dentro do lock: uma borda gravada entre a leitura e o
+            # lock ficaria "no futuro" e a diferença daria a volta em 32 bits
+            now = self.pi.get_current_tick()
+            n = self._edges
+            if n < 2:
+                return 0.0
+
+            last = self._ticks[n % size]
+            intervals = 0
+            span = 0
+            for j in range(1, min(n, size)):
+                age = (last - self._ticks[(n - j) % size]) & TICK_MASK
+                if age > self.window_us and intervals > 0:
+                    break
+                intervals = j
+                span = age
+
+        since_last = (now - last) & TICK_MASK
+        if since_last > TICK_MASK // 2:
+            # borda com tick à frente do relógio (a simulação carimba as bordas
+            # até o fim do passo): acabou de acontecer, não é a volta do contador
+            since_last = 0
+        if since_last > self.timeout_us or span == 0:
+            return 0.0
 
-        revolutions = dp / self.ppr
-        
-        return (revolutions / dt) * 60.0    # rpm!
+        rate = intervals * 1e6 / span
+        if since_last * intervals > span:
+            rate = min(rate, 1e6 / since_last)
+        return rate
+    
+    def get_rpm(self):
+        revolutions_s = self.get_edge_rate() / self.ppr
+        return revolutions_s * 60.0    # rpm!
     
     def stop(self):
         self._cb.cancel()
-        self.pi.stop()
+        self._backend.disconnect()
 
 
 class Wheel:
@@ -170,13 +301,23 @@ class Wheel:
 
 
 class SpeedPID:
-    def __init__(self, kp:float, ki:float, kd:float, setpoint:float=0.0, output_lim:tuple=(-100,100)):
+    def __init__(self, kp:float, ki:float, kd:float, setpoint:float=0.0, output_lim:tuple=(-100,100),
+                 sample_time:float | None = 0.05):
+        """
+        sample_time: período mínimo entre atualizações (padrão 20 Hz). Com
+            None o PID não descarta nenhuma chamada: quem chama controla a
+            taxa e passa o dt medido no update (ex: PeriodicTask.dt); com um
+            sample_time fixo, um ciclo que chega um pouco adiantado pelo
+            jitter devolveria a saída anterior.
+        """
+        from simple_pid import PID     # só quem usa a malha fechada paga o import
         self.pid = PID(kp, ki, kd, setpoint=setpoint)
         self.pid.output_limits = output_lim
-        self.pid.sample_time = 0.05     # 20 Hz, um vigésimo de segundo
+        self.pid.sample_time = sample_time     # padrão 20 Hz, um vigésimo de segundo
 
-    def update(self, current_speed:float) -> float:
-        return self.pid(current_speed)
+    def update(self, current_speed:float, dt:float | None = None) -> float:
+        "dt: passo de tempo medido por quem chama (senão o simple_pid mede sozinho)."
+        return self.pid(current_speed, dt=dt)
     
     def set_target(self, target: float):
         self.pid.setpoint = target
@@ -186,9 +327,19 @@ class SpeedPID:
 
 
 class RobotChassis:
-    def __init__(self):
+    def __init__(self, closed_loop=False, control_hz=100.0, wheel_diameter_cm=6.5,
+                 encoder_pins=(17, 27), encoder_ppr=32, odometry=False):
+        """
+        closed_loop: se True, uma thread a control_hz lê os encoders e corrige
+            o PWM de cada roda com um SpeedPID, usando o modelo de malha aberta
+            como feed-forward. Se False, é só o modelo (com o l_trim na mão).
+        odometry: se True, integra a pose pelos encoders (ver get_pose()).
+        wheel_diameter_cm, encoder_pins, encoder_ppr: só usados com encoders
+            (malha fechada ou odometria).
+        """
         self.l_wheel_motor = DCMotor(12, 5 ,6, 500)
         self.r_wheel_motor = DCMotor(13, 7, 8, 500) 
+        self._drive = MotorBank([self.l_wheel_motor, self.r_wheel_motor])
 
         self.track_width = 17.0     # Distância entre as rodas (cm)
         
@@ -198,17 +349,40 @@ class RobotChassis:
         # Calibração pra roda esquerda girar certo...
         self.l_trim = 1.4   
 
-    def set_velocity(self, linear_cm_s, angular_deg_s):
-        """
-        Converte velocidade desejada (cm/s) diretamente para PWM (0-100)
-        sem feedback de sensores.
-        """
+        self.closed_loop = closed_loop
+        self.control_hz = control_hz
+        self._targets = (0.0, 0.0)      # velocidade alvo de cada roda (cm/s), trocada inteira
+        self._control_task = None
+        self.recorder = None            # FlightRecorder (runtime/recorder.py), opcional
+
+        self.l_wheel = None
+        self.r_wheel = None
+        if closed_loop or odometry:
+            self.l_wheel = Wheel(wheel_diameter_cm, self.l_wheel_motor, Encoder(encoder_pins[0], encoder_ppr))
+            self.r_wheel = Wheel(wheel_diameter_cm, self.r_wheel_motor, Encoder(encoder_pins[1], encoder_ppr))
+
+        self.odometry = None
+        if odometry:
+            self.odometry = Odometry(self.l_wheel, self.r_wheel, self.track_width)
+
+        if closed_loop:
+            # o PID só corrige o que o feed-forward errou, então a saída é menor que 100%;
+            # o dt de cada passo vem do agendador (intervalo medido, não o nominal)
+            self._pids = (
+                SpeedPID(1.0, 2.0, 0.0, output_lim=(-40, 40), sample_time=None),
+                SpeedPID(1.0, 2.0, 0.0, output_lim=(-40, 40), sample_time=None),
+            )
+            self._applied = [0.0, 0.0]  # duty aplicado em cada roda no último ciclo
+
+    def _wheel_targets(self, linear_cm_s, angular_deg_s):
         angular_rad_s = math.radians(angular_deg_s)
         
         # velocidade linear necessária para cada roda em cm/s
         target_v_l = linear_cm_s - (angular_rad_s * self.track_width / 2.0)
         target_v_r = linear_cm_s + (angular_rad_s * self.track_width / 2.0)
+        return target_v_l, target_v_r
 
+    def _feed_forward(self, target_v_l, target_v_r):
         # conversão para PWM 
         # PWM = (Velocidade_Alvo / Velocidade_Maxima) * 100
         pwm_l = (target_v_l / self.estimated_max_speed_cm_s) * 100.0
@@ -217,42 +391,135 @@ class RobotChassis:
         # cada roda tava girando em uma velocidade angular diferente com o mesmo PWM
         # isso aqui é uma multiplicação q conserta 
         pwm_l = pwm_l * self.l_trim
+        return pwm_l, pwm_r
+
+    def set_velocity(self, linear_cm_s, angular_deg_s):
+        """
+        Converte velocidade desejada (cm/s) para PWM (0-100).
+        Em malha aberta aplica direto, sem feedback de sensores; em malha
+        fechada só troca o alvo e a thread de controle cuida do resto.
+        """
+        if self.recorder is not None:
+            self.recorder.record_command(time.monotonic(), linear_cm_s, angular_deg_s)
 
-        # aplicar aos motores com limites
-        self._set_motor_power(self.l_wheel_motor, pwm_l)
-        self._set_motor_power(self.r_wheel_motor, pwm_r)
+        target_v_l, target_v_r = self._wheel_targets(linear_cm_s, angular_deg_s)
+
+        if self.closed_loop:
+            self._targets = (target_v_l, target_v_r)
+            return
 
-    def _set_motor_power(self, motor, pwm_value):
+        pwm_l, pwm_r = self._feed_forward(target_v_l, target_v_r)
+
+        # aplicar aos motores com limites, as duas rodas juntas
+        duties = [self._motor_power(pwm_l), self._motor_power(pwm_r)]
+        self._drive.apply(duties)
+        if self.recorder is not None:
+            self._record(duties)
+
+    def _motor_power(self, pwm_value):
         """
         Função auxiliar para lidar com PWM positivo (frente), negativo (ré) 
-        e limite de 100%.
+        e limite de 100%. Retorna o duty com sinal (zero = parado).
         """
         # Limita entre -100 e 100 (Clamp)
         pwm_value = max(min(pwm_value, 100.0), -100.0)
 
         # deadzone
         if abs(pwm_value) < 10.0:
-            motor.stop()
-            return
+            return 0.0
 
-        if pwm_value > 0:
-            motor.forward(abs(pwm_value))
-        elif pwm_value < 0:
-            motor.reverse(abs(pwm_value))
-        else:
-            motor.stop()
+        return pwm_value
+
+    def _control_step(self):
+        "Um ciclo da malha fechada; o agendador chama a control_hz por prazo absoluto."
+        t0 = metrics.start('wheel_pid')
+        targets = self._targets
+        ff = self._feed_forward(*targets)
+        dt = self._control_task.dt
+
+        duties = []
+        for i, wheel in enumerate((self.l_wheel, self.r_wheel)):
+            if targets[i] == 0.0:
+                self._pids[i].reset()   # parado: sem integral acumulando
+                duties.append(0.0)
+                continue
+
+            # encoder de um canal não sabe o sentido, usa o do último comando
+            speed = math.copysign(wheel.get_speed_cm_s(), self._applied[i])
+            self._pids[i].set_target(targets[i])
+            correction = self._pids[i].update(speed, dt=dt)
+            duties.append(max(min(ff[i] + correction, 100.0), -100.0))
+        metrics.record('wheel_pid', t0)
+
+        self._drive.apply(duties)
+        self._applied = duties
+        if self.recorder is not None:
+            self._record(duties)
+
+    def _record(self, duties):
+        "Grava o PWM aplicado e, se tiver encoders, os pulsos acumulados."
+        t = time.monotonic()
+        self.recorder.record_pwm(t, duties)
+        if self.l_wheel is not None:
+            self.recorder.record_ticks(t, self.l_wheel.encoder.get_pulses(), self.r_wheel.encoder.get_pulses())
+
+    def get_loop_stats(self):
+        "Estatísticas de temporização da malha fechada (ms), ver PeriodicTask.get_stats()."
+        if self._control_task is None or self._control_task.runs == 0:
+            return None
+        return self._control_task.get_stats()
+
+    def get_pose(self):
+        "Retorna (x_cm, y_cm, theta_graus) da odometria, ou None sem odometria."
+        if self.odometry is None:
+            return None
+        return self.odometry.get_pose()
+
+    def reset_pose(self, x_cm=0.0, y_cm=0.0, theta_deg=0.0):
+        if self.odometry is not None:
+            self.odometry.reset_pose(x_cm, y_cm, theta_deg)
+
+    def correct_pose(self, x_cm, y_cm, theta_deg, covariance):
+        "Funde uma pose medida (com covariância) na odometria, ver Odometry.correct()."
+        if self.odometry is None:
+            return False
+        return self.odometry.correct(x_cm, y_cm, theta_deg, covariance)
 
     def start(self):
-        print("RobotChassis (Open Loop): Sistema pronto.")
+        if self.odometry is not None:
+            self.odometry.start()
+
+        if not self.closed_loop:
+            print("RobotChassis (Open Loop): Sistema pronto.")
+            return
+
+        # relógio do backend: na simulação o tempo pode andar mais rápido que o real
+        backend = self.l_wheel_motor._backend
+        self._control_task = scheduler.add('chassis_control', self._control_step, self.control_hz,
+                                           realtime=True, clock=backend.monotonic, sleep=backend.sleep)
+        self._control_task.start()
+        print(f"RobotChassis (Closed Loop @ {self.control_hz:.0f} Hz): Sistema pronto.")
 
     def stop(self):
-        self.l_wheel_motor.stop()
-        self.r_wheel_motor.stop()
+        self._targets = (0.0, 0.0)
+        self._drive.apply([0, 0], force=True)
+        if self.recorder is not None:
+            self.recorder.record_command(time.monotonic(), 0.0, 0.0)
+            self._record([0.0, 0.0])
         
     def close(self):
         self.stop()
-        self.l_wheel_motor.close()
-        self.r_wheel_motor.close()
+        if self._control_task is not None:
+            self._control_task.stop()
+            self._drive.apply([0, 0], force=True)
+        if self.odometry is not None:
+            self.odometry.stop()
+        if self.l_wheel is not None:
+            self.l_wheel.close()
+            self.r_wheel.close()
+        else:
+            self.l_wheel_motor.close()
+            self.r_wheel_motor.close()
 
 if __name__ == "__main__":
     lwheel = DCMotor(12, 5, 6, 500)
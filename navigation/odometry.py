@@ -0,0 +1,169 @@
+import math
+import threading
+import logging
+
+from navigation.backends import get_backend
+from runtime.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class Odometry:
+    # variância que a pose ganha por cm rodado (escorregamento, diâmetro da roda...)
+    XY_VAR_PER_CM = 0.05        # cm² por cm do centro do robô
+    THETA_VAR_PER_CM = 2e-5     # rad² por cm somado das duas rodas
+    # antes da primeira correção a pose no mapa é desconhecida
+    INITIAL_VAR = 1e6
+    # correção com inovação acima de tantos desvios é descartada (outlier)
+    GATE_SIGMAS = 3.0
+    # ...a não ser que venham tantas seguidas: aí a odometria é que se perdeu
+    # (roda patinou, robô carregado na mão) e a pose vai para a medida
+    RESYNC_AFTER = 10
+
+    def __init__(self, l_wheel, r_wheel, track_width_cm: float, rate_hz: float=200.0):
+        """
+        Odometria de base diferencial a partir da contagem de pulsos dos encoders.
+        Integra a pose numa thread própria, em alta frequência, e publica um
+        snapshot imutável: ler a pose nunca bloqueia o loop de controle.
+        l_wheel, r_wheel: objetos Wheel com encoder.
+        track_width_cm: distância entre as rodas.
+        rate_hz: frequência de integração.
+        """
+        self.l_wheel = l_wheel
+        self.r_wheel = r_wheel
+        self.track_width_cm = track_width_cm
+        self.rate_hz = rate_hz
+
+        backend = get_backend()
+        self._clock = backend.monotonic
+        self._sleep = backend.sleep
+        self._task = None
+
+        # o encoder é de um canal só: o sentido vem do comando do motor;
+        # com a ponte-H parada a roda ainda pode estar girando no último sentido
+        self._signs = [1, 1]
+        self._last_pulses = [l_wheel.encoder.get_pulses(), r_wheel.encoder.get_pulses()]
+
+        # (x_cm, y_cm, theta_rad, timestamp), trocado inteiro a cada passo
+        self._pose = (0.0, 0.0, 0.0, self._clock())
+        # variância de (x_cm, y_cm, theta_rad), eixos independentes; só com _lock
+        self._var = [self.INITIAL_VAR] * 3
+        self._rejected = 0      # correções descartadas seguidas
+        self._lock = threading.Lock()   # entre integração, correct e reset_pose
+
+    def start(self):
+        # tarefa de controle do agendador (runtime/scheduler.py), com o relógio do backend
+        self._task = scheduler.add('odometry', self.update, self.rate_hz, realtime=True,
+                                   clock=self._clock, sleep=self._sleep)
+        self._task.start()
+        logger.info(f"[ODOM] Odometria iniciada a {self.rate_hz:.0f} Hz")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.stop()
+            self._task = None
+
+    def _wheel_distance(self, i, wheel):
+        pulses = wheel.encoder.get_pulses()
+        dp = pulses - self._last_pulses[i]
+        self._last_pulses[i] = pulses
+
+        direction = wheel.motor.get_direction()
+        if direction != 0:
+            self._signs[i] = direction
+
+        revolutions = dp / wheel.encoder.ppr
+        return self._signs[i] * revolutions * wheel._wheel_circumference_cm
+
+    def update(self):
+        "Integra um passo. Chamado pela thread, mas pode ser chamado à mão."
+        with self._lock:
+            d_l = self._wheel_distance(0, self.l_wheel)
+            d_r = self._wheel_distance(1, self.r_wheel)
+
+            x, y, theta, _ = self._pose
+            d = (d_l + d_r) / 2.0
+            d_theta = (d_r - d_l) / self.track_width_cm
+
+            # integra no ângulo do meio do passo (melhor que Euler nas curvas)
+            theta_mid = theta + d_theta / 2.0
+            x += d * math.cos(theta_mid)
+            y += d * math.sin(theta_mid)
+            theta = math.atan2(math.sin(theta + d_theta), math.cos(theta + d_theta))
+
+            self._pose = (x, y, theta, self._clock())
+
+            # a incerteza cresce com o quanto andou
+            self._var[0] += self.XY_VAR_PER_CM * abs(d)
+            self._var[1] += self.XY_VAR_PER_CM * abs(d)
+            self._var[2] += self.THETA_VAR_PER_CM * (abs(d_l) + abs(d_r))
+
+    def get_pose(self):
+        "Retorna (x_cm, y_cm, theta_graus) sem travar nada."
+        x, y, theta, _ = self._pose
+        return x, y, math.degrees(theta)
+
+    def get_pose_stamped(self):
+        "Retorna (x_cm, y_cm, theta_graus, timestamp) do último passo integrado."
+        x, y, theta, stamp = self._pose
+        return x, y, math.degrees(theta), stamp
+
+    def get_std(self):
+        "Desvio padrão estimado de (x_cm, y_cm, theta_graus)."
+        var_x, var_y, var_theta = self._var
+        return math.sqrt(var_x), math.sqrt(var_y), math.degrees(math.sqrt(var_theta))
+
+    def reset_pose(self, x_cm: float=0.0, y_cm: float=0.0, theta_deg: float=0.0):
+        "Define a pose na marra, como conhecida (variância zero)."
+        with self._lock:
+            self._pose = (x_cm, y_cm, math.radians(theta_deg), self._clock())
+            self._var = [0.0, 0.0, 0.0]
+            self._rejected = 0
+
+    def correct(self, x_cm, y_cm, theta_deg, covariance):
+        """
+        Funde uma medida absoluta da pose (ex: localização pelas tags) com a
+        odometria, um filtro de Kalman escalar por eixo: cada eixo anda em
+        direção à medida na proporção var_odom / (var_odom + var_medida).
+        Medida ruidosa mexe pouco; odometria que já rodou muito, mais.
+        covariance: 3x3 de (x_cm, y_cm, theta_graus), como a do localize().
+        Retorna False (sem mexer em nada) se a medida ficou a mais de
+        GATE_SIGMAS desvios da pose atual em algum eixo; depois de
+        RESYNC_AFTER assim seguidas, aceita a medida como está.
+        """
+        measured = (x_cm, y_cm, math.radians(theta_deg))
+        deg2 = math.radians(1.0) ** 2
+        noise = (float(covariance[0][0]), float(covariance[1][1]), float(covariance[2][2]) * deg2)
+
+        with self._lock:
+            pose = list(self._pose[:3])
+            innovations = []
+            for i in range(3):
+                innovation = measured[i] - pose[i]
+                if i == 2:
+                    innovation = math.atan2(math.sin(innovation), math.cos(innovation))
+                innovations.append(innovation)
+
+            outlier = any(innovation ** 2 > self.GATE_SIGMAS ** 2 * (self._var[i] + noise[i])
+                          for i, innovation in enumerate(innovations))
+            if outlier:
+                self._rejected += 1
+                if self._rejected < self.RESYNC_AFTER:
+                    return False
+                logger.warning(f"[ODOM] {self._rejected} correções seguidas longe da odometria, "
+                               f"reposicionando pela medida")
+                self._rejected = 0
+                self._pose = (measured[0], measured[1], measured[2], self._clock())
+                self._var = list(noise)
+                return True
+            self._rejected = 0
+
+            for i, innovation in enumerate(innovations):
+                total = self._var[i] + noise[i]
+                gain = self._var[i] / total if total > 0 else 1.0
+                pose[i] += gain * innovation
+                self._var[i] *= 1.0 - gain
+
+            theta = math.atan2(math.sin(pose[2]), math.cos(pose[2]))
+            self._pose = (pose[0], pose[1], theta, self._clock())
+        return True
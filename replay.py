@@ -0,0 +1,163 @@
+"""
+Reproduz um log do gravador de voo (main.py --record) sem robô nem câmera.
+
+Os frames gravados passam de novo pelo VisionSystem e as detecções pelo
+mesmo controle do main.py (compute_command, e o TagTracker se a missão foi
+gravada com --kalman), na ordem e com os timestamps do log, o mais rápido
+possível. No fim mostra onde o resultado diverge do que foi gravado: tags
+diferentes, erro de pose e comandos diferentes. Serve para depurar falhas
+de campo e para medir mudanças na visão/controle com tráfego real.
+
+Uso (da raiz do repositório):
+    python replay.py missao.log
+    python replay.py missao.log --no-vision       # só o controle, com as detecções gravadas
+    python replay.py missao.log --realtime 1.0    # respeita o tempo original
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import main as mission
+from runtime.recorder import LogReader, META, FRAME, DETECTIONS, COMMAND
+from vision.tag_detection import VisionSystem
+from vision.tracking import TagTracker
+
+
+def make_vision(meta, frame):
+    args = meta['args']
+    undistort = args.get('undistort', 'corners')
+    vision = VisionSystem(
+        tag_size_meters=meta['tag_size'],
+        resolution=(frame.shape[1], frame.shape[0]),
+        camera_name=args.get('camera_name', 'default'),
+        undistort=None if undistort == 'none' else undistort,
+    )
+    if not np.allclose(vision.camera_params, meta['camera_params']):
+        print(f"AVISO: intrínsecos diferentes dos gravados ({vision.camera_params} x {meta['camera_params']})")
+    if args.get('adaptive'):
+        print("AVISO: missão gravada com --adaptive; o replay usa decimação fixa")
+    return vision
+
+
+def compare_detections(replayed, recorded, stats):
+    new_ids = {d.tag_id for d in replayed}
+    old_ids = {d.tag_id for d in recorded}
+    if new_ids != old_ids:
+        stats['tag_mismatches'] += 1
+    old_by_id = {d.tag_id: d for d in recorded}
+    for d in replayed:
+        old = old_by_id.get(d.tag_id)
+        if old is not None and d.pose_t is not None:
+            err = float(np.linalg.norm(d.pose_t.ravel() - old.pose_t.ravel()))
+            stats['max_pose_diff_m'] = max(stats['max_pose_diff_m'], err)
+
+
+def replay(path, use_vision=True, realtime=None, tolerance=0.5):
+    reader = LogReader(path)
+    stats = {
+        'frames': 0, 'detections': 0, 'commands': 0, 'command_mismatches': 0,
+        'tag_mismatches': 0, 'max_pose_diff_m': 0.0, 'max_command_diff': 0.0,
+        'vision_s': 0.0,
+    }
+
+    meta = None
+    vision = None
+    tracker = None
+    april_id = None
+    replayed = {}       # seq -> detecções refeitas do frame (até chegar o registro gravado)
+    expected = None     # comando que o controle do replay daria, esperando o gravado
+    t_first = None
+    wall_first = time.monotonic()
+
+    for kind, t, value in reader:
+        if realtime and kind != META:
+            if t_first is None:
+                t_first = t
+            delay = (t - t_first) / realtime - (time.monotonic() - wall_first)
+            if delay > 0:
+                time.sleep(delay)
+
+        if kind == META:
+            meta = value
+            april_id = meta['args']['april_id']
+            if meta['args'].get('kalman'):
+                tracker = TagTracker()
+
+        elif kind == FRAME and use_vision and meta is not None:
+            seq, frame = value
+            if vision is None:
+                vision = make_vision(meta, frame)
+            t0 = time.perf_counter()
+            if meta['args'].get('track'):
+                _, detections = vision.track_tag(frame, april_id, draw=False)
+            else:
+                _, detections = vision.detect_tags(frame, draw=False)
+            stats['vision_s'] += time.perf_counter() - t0
+            stats['frames'] += 1
+            replayed[seq] = detections
+
+        elif kind == DETECTIONS and meta is not None:
+            seq, recorded = value
+            stats['detections'] += 1
+            detections = replayed.pop(seq, None)
+            if detections is None:
+                detections = recorded
+            else:
+                compare_detections(detections, recorded, stats)
+
+            if tracker is not None:
+                tracker.update(detections, t)
+            else:
+                expected = mission.compute_command(mission.find_target(detections, april_id))
+
+        elif kind == COMMAND and meta is not None:
+            stats['commands'] += 1
+            if tracker is not None:
+                track = tracker.get(april_id, t)
+                if track is not None and track.age_s > mission.MAX_TRACK_AGE_S:
+                    track = None
+                expected = mission.compute_command(track)
+                tracker.set_command(*expected)
+            if expected is None:
+                continue    # parada por timeout, não vem de uma detecção
+
+            diff = max(abs(expected[0] - value[0]), abs(expected[1] - value[1]))
+            stats['max_command_diff'] = max(stats['max_command_diff'], diff)
+            if diff > tolerance:
+                stats['command_mismatches'] += 1
+            if tracker is None:
+                expected = None
+
+    replayed.clear()
+    stats['wall_s'] = time.monotonic() - wall_first
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduz um log do gravador de voo")
+    parser.add_argument('log', help="arquivo gravado com main.py --record")
+    parser.add_argument('--no-vision', action='store_true',
+                        help="não refaz a detecção, usa as detecções gravadas")
+    parser.add_argument('--realtime', type=float, default=None, metavar='SPEED',
+                        help="respeita o tempo gravado (1.0 = tempo real, 2.0 = dobro)")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="diferença de comando (cm/s ou graus/s) aceita como igual")
+    args = parser.parse_args()
+
+    stats = replay(args.log, use_vision=not args.no_vision, realtime=args.realtime,
+                   tolerance=args.tolerance)
+
+    print(f"{stats['frames']} frames refeitos, {stats['detections']} registros de detecção, "
+          f"{stats['commands']} comandos em {stats['wall_s']:.2f} s")
+    if stats['frames']:
+        print(f"Visão: {stats['frames'] / stats['vision_s']:.1f} FPS, "
+              f"{stats['tag_mismatches']} frames com tags diferentes, "
+              f"maior diferença de pose {stats['max_pose_diff_m'] * 1000:.1f} mm")
+    print(f"Controle: {stats['command_mismatches']} comandos diferentes do gravado "
+          f"(maior diferença {stats['max_command_diff']:.2f})")
+
+
+if __name__ == '__main__':
+    main()
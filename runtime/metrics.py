@@ -0,0 +1,171 @@
+"""
+Métricas de tempo por etapa (captura, cinza, detecção, pose, controle, PWM...).
+
+Feito para ficar ligado em produção: cada etapa guarda as últimas amostras
+num array pré-alocado e conta num histograma de faixas fixas, sem alocar
+nada por amostra. Uso:
+
+    t0 = metrics.start('detect')
+    ... trabalho ...
+    metrics.record('detect', t0)
+
+Com as métricas desligadas start() retorna 0 e record() não faz nada.
+sample_every=N mede só 1 a cada N chamadas de start() de cada etapa, para
+cortar o custo ainda mais (etapas encadeadas, com o retorno de record()
+abrindo a seguinte, seguem a amostragem da primeira). Liga/desliga pelo ambiente (RUNTIME_METRICS=0/1,
+RUNTIME_METRICS_SAMPLE=N) ou por configure() em tempo de execução.
+"""
+
+import logging
+import os
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# limites superiores das faixas do histograma (ms); a última pega o resto
+BUCKETS_MS = (0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, float('inf'))
+
+
+class StageStats:
+    WINDOW = 1024
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self._samples = array('d', [0.0]) * self.WINDOW
+        self._buckets = array('L', [0]) * len(BUCKETS_MS)
+
+    def add(self, dt):
+        # várias threads podem gravar na mesma etapa; no pior caso uma amostra se perde
+        self._samples[self.count % self.WINDOW] = dt
+        self.count += 1
+        self.total_s += dt
+        if dt > self.max_s:
+            self.max_s = dt
+        dt_ms = dt * 1000.0
+        for i, limit in enumerate(BUCKETS_MS):
+            if dt_ms <= limit:
+                self._buckets[i] += 1
+                break
+
+    def reset(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        for i in range(len(self._buckets)):
+            self._buckets[i] = 0
+
+    def summary(self):
+        n = min(self.count, self.WINDOW)
+        samples = sorted(self._samples[:n])
+        stats = {
+            'count': self.count,
+            'mean_ms': None,
+            'p50_ms': None,
+            'p95_ms': None,
+            'p99_ms': None,
+            'max_ms': self.max_s * 1000.0,
+            'histogram_ms': {str(limit): c for limit, c in zip(BUCKETS_MS, self._buckets)},
+        }
+        if n:
+            stats['mean_ms'] = self.total_s / self.count * 1000.0
+            stats['p50_ms'] = samples[n // 2] * 1000.0
+            stats['p95_ms'] = samples[min(int(n * 0.95), n - 1)] * 1000.0
+            stats['p99_ms'] = samples[min(int(n * 0.99), n - 1)] * 1000.0
+        return stats
+
+
+class Metrics:
+    def __init__(self, enabled=True, sample_every=1):
+        self.enabled = enabled
+        self.sample_every = max(int(sample_every), 1)
+        self._calls = {}        # etapa -> chamadas de start(), para a amostragem
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._reporter = None
+
+    def configure(self, enabled=None, sample_every=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_every is not None:
+            self.sample_every = max(int(sample_every), 1)
+
+    def start(self, name=None):
+        """
+        Marca o início da etapa name. Retorna 0 se esta chamada não vai ser
+        medida. O contador da amostragem é por etapa: com threads intercalando
+        etapas diferentes, nenhuma fica com todas as chamadas puladas.
+        """
+        if not self.enabled:
+            return 0.0
+        if self.sample_every > 1:
+            # várias threads na mesma etapa: no pior caso uma contagem se perde
+            calls = self._calls.get(name, 0) + 1
+            self._calls[name] = calls
+            if calls % self.sample_every:
+                return 0.0
+        return time.perf_counter()
+
+    def record(self, name, t0):
+        "Fecha a etapa aberta por start(). Retorna o instante atual (para encadear etapas)."
+        if not t0:
+            return 0.0
+        now = time.perf_counter()
+        stage = self._stages.get(name)
+        if stage is None:
+            with self._lock:
+                stage = self._stages.setdefault(name, StageStats(name))
+        stage.add(now - t0)
+        return now
+
+    def observe(self, name, dt):
+        "Grava uma duração medida por fora (ex: entre processos, com time.monotonic())."
+        if self.enabled:
+            self.record(name, time.perf_counter() - dt)
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'sample_every': self.sample_every,
+            'stages': {name: stage.summary() for name, stage in list(self._stages.items())},
+        }
+
+    def reset(self, names=None):
+        "Zera todas as etapas, ou só as de names."
+        for name, stage in list(self._stages.items()):
+            if names is None or name in names:
+                stage.reset()
+
+    def log_summary(self):
+        parts = []
+        for name, stage in sorted(self._stages.items()):
+            s = stage.summary()
+            if s['p50_ms'] is not None:
+                parts.append(f"{name} p50={s['p50_ms']:.2f} p99={s['p99_ms']:.2f} max={s['max_ms']:.2f}")
+        if parts:
+            logger.info("[METRICS] " + " | ".join(parts))
+
+    def start_reporter(self, interval_s=30.0):
+        "Loga o resumo periodicamente numa thread daemon."
+        if self._reporter is not None:
+            return
+
+        def report():
+            while True:
+                time.sleep(interval_s)
+                if self.enabled:
+                    self.log_summary()
+
+        self._reporter = threading.Thread(target=report, daemon=True)
+        self._reporter.start()
+
+
+# instância do processo, usada por todos os módulos
+metrics = Metrics(
+    enabled=os.environ.get('RUNTIME_METRICS', '1') != '0',
+    sample_every=int(os.environ.get('RUNTIME_METRICS_SAMPLE', 1)),
+)
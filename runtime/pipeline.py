@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import namedtuple
+
+# frame capturado + quando foi capturado (time.monotonic())
+FramePacket = namedtuple('FramePacket', ['seq', 't_capture', 'frame'])
+
+# resultado da detecção, carregando o timestamp do frame de origem
+DetectionPacket = namedtuple('DetectionPacket', ['seq', 't_capture', 't_detect', 'detections'])
+
+
+class LatestValue:
+    def __init__(self):
+        """
+        "Fila" de tamanho 1 entre dois estágios do pipeline.
+        put() sempre sobrescreve o valor anterior: se o consumidor ainda não
+        tinha pego, aquele valor é descartado (e contado em dropped), porque
+        é melhor processar o dado mais novo do que processar dado velho atrasado.
+        Pensado para um produtor e um consumidor.
+        """
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0           # quantos valores já foram colocados
+        self._taken_seq = 0     # até qual valor o consumidor já pegou
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._seq > self._taken_seq:
+                self.dropped += 1   # ninguém pegou o anterior, foi descartado
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Espera um valor que ainda não foi consumido e retorna ele.
+        Retorna None se deu timeout ou se a fila foi fechada.
+        """
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._seq > self._taken_seq or self._closed,
+                timeout=timeout
+            )
+            if not ready or self._seq == self._taken_seq:
+                return None
+            self._taken_seq = self._seq
+            return self._item
+
+    def peek(self):
+        "Retorna o último valor sem consumir (ou None se não teve nenhum)."
+        return self._item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+def age_s(packet):
+    "Idade (em segundos) do dado, medida desde a captura do frame."
+    return time.monotonic() - packet.t_capture
@@ -0,0 +1,205 @@
+"""
+Gravador de voo: registra uma execução (frames, detecções, comandos, PWM e
+pulsos dos encoders) num log binário, para reproduzir depois (replay.py).
+
+Formato: cabeçalho MAGIC e depois registros em sequência, só acrescentados:
+    tipo (u8) | t (f64, time.monotonic()) | tamanho do payload (u32) | payload
+Tudo little-endian e de tamanho fixo por tipo (menos frame e meta), então o
+arquivo pode ser lido com mmap sem copiar: os frames viram arrays numpy
+apontando direto para o arquivo.
+
+Quem grava só empacota os bytes (struct.pack) e põe numa fila; uma thread
+escreve no disco. Se o disco não der conta, os frames são descartados antes
+de qualquer outro registro.
+"""
+
+import json
+import logging
+import mmap
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ROBOLOG1'
+
+# tipos de registro
+META = 0
+FRAME = 1
+DETECTIONS = 2
+COMMAND = 3
+PWM = 4
+TICKS = 5
+
+RECORD_HEADER = struct.Struct('<BdI')
+FRAME_HEADER = struct.Struct('<IHHB')          # seq, largura, altura, canais
+DETECTIONS_HEADER = struct.Struct('<IH')       # seq, quantas detecções
+DETECTION = struct.Struct('<i2f8f3ff')         # tag_id, center, corners, pose_t, pose_err
+COMMAND_PAYLOAD = struct.Struct('<dd')         # linear cm/s, angular graus/s
+TICKS_PAYLOAD = struct.Struct('<II')           # pulsos esquerda, direita
+
+
+class ReplayDetection:
+    "Detecção lida do log, com os mesmos atributos usados do pupil_apriltags."
+    __slots__ = ('tag_id', 'center', 'corners', 'pose_t', 'pose_err', 'pose_R')
+
+    def __init__(self, tag_id, center, corners, pose_t, pose_err):
+        self.tag_id = tag_id
+        self.center = center
+        self.corners = corners
+        self.pose_t = pose_t
+        self.pose_err = pose_err
+        self.pose_R = None
+
+
+class FlightRecorder:
+    def __init__(self, path, frame_every=0, max_pending_bytes=32 * 1024 * 1024, flush_s=1.0):
+        """
+        path: arquivo do log (sobrescrito).
+        frame_every: grava 1 a cada N frames (0 = não grava frames).
+        max_pending_bytes: quanto pode acumular na fila antes de descartar frames.
+        flush_s: de quanto em quanto tempo força a escrita no disco.
+        """
+        self.path = path
+        self.frame_every = frame_every
+        self.max_pending_bytes = max_pending_bytes
+        self.flush_s = flush_s
+
+        self._queue = deque()
+        self._pending_bytes = 0
+        self._wakeup = threading.Event()
+        self._running = True
+        self._frames_seen = 0
+        self.dropped_frames = 0
+        self.records = 0
+
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _push(self, kind, t, payload):
+        self._queue.append(RECORD_HEADER.pack(kind, t, len(payload)) + payload)
+        self._pending_bytes += len(payload) + RECORD_HEADER.size
+        self.records += 1
+        self._wakeup.set()
+
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        while self._running or self._queue:
+            self._wakeup.wait(timeout=self.flush_s)
+            self._wakeup.clear()
+            while self._queue:
+                chunk = self._queue.popleft()
+                self._pending_bytes -= len(chunk)
+                self._file.write(chunk)
+            if time.monotonic() - last_flush >= self.flush_s:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.flush()
+
+    def record_meta(self, info, t=None):
+        "Dicionário qualquer (argumentos, resolução, calibração...), em JSON."
+        self._push(META, time.monotonic() if t is None else t, json.dumps(info).encode())
+
+    def record_frame(self, seq, t, frame):
+        "Frame cru (cinza ou BGR). Respeita frame_every e descarta se a fila estiver cheia."
+        if not self.frame_every:
+            return
+        self._frames_seen += 1
+        if (self._frames_seen - 1) % self.frame_every:
+            return
+        if self._pending_bytes + frame.nbytes > self.max_pending_bytes:
+            self.dropped_frames += 1
+            return
+        H, W = frame.shape[:2]
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        payload = FRAME_HEADER.pack(seq, W, H, channels) + np.ascontiguousarray(frame).tobytes()
+        self._push(FRAME, t, payload)
+
+    def record_detections(self, seq, t, detections):
+        parts = [DETECTIONS_HEADER.pack(seq, len(detections))]
+        for d in detections:
+            pose_t = d.pose_t.ravel() if d.pose_t is not None else (np.nan, np.nan, np.nan)
+            parts.append(DETECTION.pack(
+                int(d.tag_id), *d.center, *np.asarray(d.corners).ravel(), *pose_t,
+                d.pose_err if d.pose_err is not None else np.nan
+            ))
+        self._push(DETECTIONS, t, b''.join(parts))
+
+    def record_command(self, t, linear_cm_s, angular_deg_s):
+        self._push(COMMAND, t, COMMAND_PAYLOAD.pack(linear_cm_s, angular_deg_s))
+
+    def record_pwm(self, t, duties):
+        self._push(PWM, t, struct.pack(f'<B{len(duties)}f', len(duties), *duties))
+
+    def record_ticks(self, t, left_pulses, right_pulses):
+        self._push(TICKS, t, TICKS_PAYLOAD.pack(left_pulses, right_pulses))
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(timeout=5.0)
+        self._file.close()
+        logger.info(f"[REC] {self.records} registros em {self.path}, {self.dropped_frames} frames descartados")
+
+
+class LogReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} não é um log do gravador")
+
+    def __iter__(self):
+        "Gera (tipo, t, valor) na ordem gravada. Frames apontam para o mmap, sem cópia."
+        mm = self._mm
+        offset = len(MAGIC)
+        end = len(mm)
+        while offset + RECORD_HEADER.size <= end:
+            kind, t, size = RECORD_HEADER.unpack_from(mm, offset)
+            offset += RECORD_HEADER.size
+            if offset + size > end:
+                break   # último registro cortado (o programa morreu escrevendo)
+            yield kind, t, self._decode(kind, offset, size)
+            offset += size
+
+    def _decode(self, kind, offset, size):
+        mm = self._mm
+        if kind == FRAME:
+            seq, W, H, channels = FRAME_HEADER.unpack_from(mm, offset)
+            shape = (H, W) if channels == 1 else (H, W, channels)
+            frame = np.frombuffer(mm, dtype=np.uint8, count=W * H * channels,
+                                  offset=offset + FRAME_HEADER.size).reshape(shape)
+            return seq, frame
+        if kind == DETECTIONS:
+            seq, count = DETECTIONS_HEADER.unpack_from(mm, offset)
+            detections = []
+            pos = offset + DETECTIONS_HEADER.size
+            for _ in range(count):
+                v = DETECTION.unpack_from(mm, pos)
+                pos += DETECTION.size
+                detections.append(ReplayDetection(
+                    v[0], np.array(v[1:3]), np.array(v[3:11]).reshape(4, 2),
+                    np.array(v[11:14]).reshape(3, 1), v[14]
+                ))
+            return seq, detections
+        if kind == COMMAND:
+            return COMMAND_PAYLOAD.unpack_from(mm, offset)
+        if kind == PWM:
+            (count,) = struct.unpack_from('<B', mm, offset)
+            return struct.unpack_from(f'<{count}f', mm, offset + 1)
+        if kind == TICKS:
+            return TICKS_PAYLOAD.unpack_from(mm, offset)
+        if kind == META:
+            return json.loads(bytes(mm[offset:offset + size]))
+        return bytes(mm[offset:offset + size])
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
@@ -0,0 +1,228 @@
+"""
+Tarefas de controle a taxa fixa.
+
+Cada PeriodicTask chama fn() em prazos absolutos do relógio monotônico (o
+ciclo k começa em t0 + k*período), em vez de dormir um período depois do
+trabalho: o tempo gasto em fn(), ou esperando o GIL enquanto o servidor e a
+visão estão ocupados, não empurra os ciclos seguintes. Ciclo que termina
+depois do próximo prazo conta como overrun; atrasou mais de max_catchup
+períodos, os ciclos perdidos são pulados (mantendo a fase) em vez de
+rodarem em rajada.
+
+Tarefas realtime=True podem ser fixadas num núcleo (os.sched_setaffinity) e
+ganhar prioridade de tempo real (SCHED_FIFO). Sem permissão (root ou
+CAP_SYS_NICE) só avisa e segue na prioridade normal. Configura pelo
+ambiente (RUNTIME_CONTROL_CPU=3, RUNTIME_CONTROL_PRIORITY=50) ou por
+scheduler.configure().
+"""
+
+import logging
+import os
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+def pin_thread(cpu=None, priority=None, name=''):
+    """
+    Fixa a thread que chamou no núcleo cpu e/ou dá prioridade SCHED_FIFO.
+    Retorna {'cpu', 'priority'} com o que realmente foi aplicado.
+    """
+    pinned = {'cpu': None, 'priority': None}
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})     # 0 = esta thread, não o processo todo
+            pinned['cpu'] = cpu
+        except (AttributeError, OSError) as e:
+            logger.warning(f"[SCHED] {name}: não consegui fixar no núcleo {cpu} ({e})")
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            pinned['priority'] = priority
+        except (AttributeError, OSError) as e:
+            logger.warning(f"[SCHED] {name}: sem prioridade de tempo real ({e}), "
+                           f"precisa de root ou CAP_SYS_NICE")
+    return pinned
+
+
+class PeriodicTask:
+    # quantas amostras de atraso e de duração guardar para as estatísticas
+    WINDOW = 1000
+
+    def __init__(self, name, fn, hz, cpu=None, priority=None, clock=time.monotonic, sleep=time.sleep,
+                 max_catchup=1):
+        """
+        name: nome nas estatísticas e no log.
+        fn: chamada a cada ciclo, sem argumentos; retornar False encerra a tarefa.
+        hz: taxa dos ciclos.
+        cpu, priority: núcleo e prioridade SCHED_FIFO (1-99) da thread, None = não mexe.
+        clock, sleep: relógio e espera (ex: os do backend do chassi, que na
+            simulação podem andar mais rápido que o tempo real).
+        max_catchup: quantos períodos de atraso recuperar rodando ciclos
+            seguidos antes de pular os perdidos.
+        """
+        self.name = name
+        self.fn = fn
+        self.hz = hz
+        self.period = 1.0 / hz
+        self.cpu = cpu
+        self.priority = priority
+        self.max_catchup = max_catchup
+        self._clock = clock
+        self._sleep = sleep
+
+        self.dt = self.period       # intervalo real entre o início deste ciclo e o anterior
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.pinned = None
+        self._lateness_s = array('d', [0.0]) * self.WINDOW
+        self._exec_s = array('d', [0.0]) * self.WINDOW
+        self._running = False
+        self._thread = None
+
+    def run(self):
+        "Roda na thread atual até stop() ou fn() retornar False."
+        self._running = True
+        self._loop()
+
+    def start(self):
+        "Roda numa thread própria (daemon)."
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        if self.cpu is not None or self.priority is not None:
+            self.pinned = pin_thread(self.cpu, self.priority, self.name)
+
+        period = self.period
+        deadline = self._clock()
+        last_start = None
+
+        while self._running:
+            start = self._clock()
+            if last_start is not None:
+                self.dt = start - last_start
+            last_start = start
+
+            keep = self.fn()
+
+            end = self._clock()
+            i = self.runs % self.WINDOW
+            self._lateness_s[i] = start - deadline
+            self._exec_s[i] = end - start
+            self.runs += 1
+            if keep is False:
+                break
+
+            deadline += period
+            if end > deadline:
+                self.overruns += 1
+                behind = int((end - deadline) / period)
+                if behind >= self.max_catchup:
+                    # pula os ciclos perdidos mantendo a fase
+                    self.skipped += behind
+                    deadline += behind * period
+
+            remaining = deadline - self._clock()
+            if remaining > 0:
+                self._sleep(remaining)
+
+        self._running = False
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def get_stats(self):
+        "Atraso do início de cada ciclo em relação ao prazo (jitter) e duração de fn(), em ms."
+        n = min(self.runs, self.WINDOW)
+        stats = {
+            'hz': self.hz,
+            'period_ms': self.period * 1000.0,
+            'running': self._running,
+            'loops': self.runs,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'cpu': self.pinned['cpu'] if self.pinned else None,
+            'priority': self.pinned['priority'] if self.pinned else None,
+            'jitter_mean_ms': None,
+            'jitter_p99_ms': None,
+            'jitter_max_ms': None,
+            'exec_p99_ms': None,
+            'exec_max_ms': None,
+        }
+        if n:
+            late = sorted(self._lateness_s[:n])
+            exec_s = sorted(self._exec_s[:n])
+            stats['jitter_mean_ms'] = sum(late) / n * 1000.0
+            stats['jitter_p99_ms'] = late[min(int(n * 0.99), n - 1)] * 1000.0
+            stats['jitter_max_ms'] = late[-1] * 1000.0
+            stats['exec_p99_ms'] = exec_s[min(int(n * 0.99), n - 1)] * 1000.0
+            stats['exec_max_ms'] = exec_s[-1] * 1000.0
+        return stats
+
+
+class Scheduler:
+    def __init__(self, control_cpu=None, control_priority=None):
+        """
+        Registro das tarefas periódicas do processo.
+        control_cpu, control_priority: núcleo e prioridade das tarefas
+            criadas com realtime=True.
+        """
+        self.control_cpu = control_cpu
+        self.control_priority = control_priority
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def configure(self, control_cpu=None, control_priority=None):
+        "Vale para as tarefas criadas depois."
+        if control_cpu is not None:
+            self.control_cpu = control_cpu
+        if control_priority is not None:
+            self.control_priority = control_priority
+
+    def add(self, name, fn, hz, realtime=False, **kwargs):
+        """
+        Cria (sem iniciar) uma PeriodicTask e registra com esse nome,
+        substituindo uma anterior. realtime=True usa o núcleo e a
+        prioridade de controle configurados.
+        """
+        if realtime:
+            kwargs.setdefault('cpu', self.control_cpu)
+            kwargs.setdefault('priority', self.control_priority)
+        task = PeriodicTask(name, fn, hz, **kwargs)
+        with self._lock:
+            self._tasks[name] = task
+        return task
+
+    def get_stats(self):
+        return {name: task.get_stats() for name, task in list(self._tasks.items())}
+
+    def stop_all(self):
+        for task in list(self._tasks.values()):
+            task.stop()
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# instância do processo, usada por todos os módulos
+scheduler = Scheduler(
+    control_cpu=_env_int('RUNTIME_CONTROL_CPU'),
+    control_priority=_env_int('RUNTIME_CONTROL_PRIORITY'),
+)
@@ -0,0 +1,31 @@
+"""
+Onde rodar trabalho pesado de CPU (visão, JPEG, leitura da câmera).
+
+No modo normal (threads do SO) offload() só chama a função. No modo
+cooperativo (eventlet) as "threads" viram greenlets num loop só, e uma
+chamada longa ao OpenCV travaria todos os clientes; aí offload() manda a
+chamada para um pool de threads nativas (eventlet.tpool) e o greenlet
+espera sem bloquear o loop.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def enable_eventlet(pool_size=4):
+    "Liga o pool de threads nativas do eventlet. Chamar depois do monkey_patch()."
+    global _executor
+    from eventlet import tpool
+
+    tpool.set_num_threads(pool_size)
+    _executor = tpool.execute
+    logger.info(f"[WORKERS] Trabalho pesado vai para {pool_size} threads nativas")
+
+
+def offload(fn, *args, **kwargs):
+    if _executor is None:
+        return fn(*args, **kwargs)
+    return _executor(fn, *args, **kwargs)
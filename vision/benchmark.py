@@ -0,0 +1,351 @@
+"""
+Benchmark do pipeline de visão (VisionSystem.detect_tags).
+
+Reproduz frames gravados (pasta de imagens ou vídeo) ou, se não tiver,
+frames sintéticos com AprilTags renderizadas, varrendo nthreads,
+quad_decimate, refine_edges e resolução. Mede FPS, latência p50/p95/p99,
+recall das detecções e erro de pose contra o ground truth.
+Roda sem tela, então dá para rodar num Linux qualquer antes de mandar para o robô.
+
+Uso (da raiz do repositório):
+    python -m vision.benchmark
+    python -m vision.benchmark --frames gravacao/ --json resultado.json
+    python -m vision.benchmark --frames gravacao.mp4 --compare baseline.json
+
+Ground truth dos frames gravados (opcional):
+    pasta/ground_truth.json  -> {"frame_0001.png": [{"tag_id": 3, "pose_t": [x, y, z]}], ...}
+    video.json (ao lado de video.mp4) -> {"0": [...], "1": [...], ...}  (índice do frame)
+pose_t em metros, no referencial da câmera (igual ao do pupil_apriltags).
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from pupil_apriltags import Detector
+
+from vision.tag_detection import VisionSystem
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+# ============================================================================
+# FONTES DE FRAMES
+# ============================================================================
+
+def _parse_ground_truth(entries):
+    return [(int(e['tag_id']), np.asarray(e['pose_t'], dtype=float).reshape(3)) for e in entries]
+
+
+def _load_ground_truth(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        raw = json.load(f)
+    return {key: _parse_ground_truth(entries) for key, entries in raw.items()}
+
+
+def load_recorded(path, limit=None):
+    """
+    Carrega frames gravados. Retorna lista de (frame, ground_truth), onde
+    ground_truth é lista de (tag_id, pose_t) ou None se não tiver.
+    """
+    frames = []
+
+    if os.path.isdir(path):
+        gt = _load_ground_truth(os.path.join(path, 'ground_truth.json'))
+        names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTENSIONS))
+        for name in names[:limit]:
+            img = cv2.imread(os.path.join(path, name))
+            if img is None:
+                logger.warning(f"Não consegui ler {name}, pulando")
+                continue
+            frames.append((img, gt.get(name) if gt is not None else None))
+    else:
+        gt = _load_ground_truth(os.path.splitext(path)[0] + '.json')
+        cap = cv2.VideoCapture(path)
+        index = 0
+        while limit is None or len(frames) < limit:
+            ok, img = cap.read()
+            if not ok:
+                break
+            frames.append((img, gt.get(str(index)) if gt is not None else None))
+            index += 1
+        cap.release()
+
+    return frames
+
+
+def _tag_image(dictionary, tag_id, cell_px=10):
+    "Imagem da tag (8x8 células da aruco) com 1 célula de borda branca em volta."
+    size = 8 * cell_px
+    if hasattr(cv2.aruco, 'generateImageMarker'):
+        marker = cv2.aruco.generateImageMarker(dictionary, tag_id, size)
+    else:
+        marker = cv2.aruco.drawMarker(dictionary, tag_id, size)   # OpenCV < 4.7
+    marker = cv2.copyMakeBorder(marker, cell_px, cell_px, cell_px, cell_px,
+                                cv2.BORDER_CONSTANT, value=255)
+    return cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
+
+
+def render_synthetic(resolution, camera_matrix, count, tag_size, seed=0):
+    """
+    Renderiza count frames com uma tag36h11 em pose aleatória conhecida.
+    Usa o camera_matrix do VisionSystem, então o erro de pose mede só o detector.
+    """
+    rng = np.random.default_rng(seed)
+    W, H = resolution
+    dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_APRILTAG_36h11)
+
+    # a tag_size do apriltag é a borda preta (8 células); a imagem tem 10
+    half = tag_size / 2.0 * 10.0 / 8.0
+    obj = np.array([[-half, -half, 0], [half, -half, 0], [half, half, 0], [-half, half, 0]])
+
+    frames = []
+    while len(frames) < count:
+        tag_id = int(rng.integers(0, 30))
+        z = rng.uniform(0.25, 1.5)
+        t = np.array([rng.uniform(-0.3, 0.3) * z, rng.uniform(-0.2, 0.2) * z, z])
+        yaw = rng.uniform(-0.6, 0.6)
+        R = np.array([[np.cos(yaw), 0, np.sin(yaw)],
+                      [0, 1, 0],
+                      [-np.sin(yaw), 0, np.cos(yaw)]])
+
+        cam = obj @ R.T + t
+        uv = cam @ camera_matrix.T
+        uv = uv[:, :2] / uv[:, 2:3]
+        if (uv < 0).any() or (uv[:, 0] >= W).any() or (uv[:, 1] >= H).any():
+            continue    # tag fora da imagem, sorteia outra
+
+        tag = _tag_image(dictionary, tag_id)
+        h, w = tag.shape[:2]
+        src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+        M = cv2.getPerspectiveTransform(src, uv.astype(np.float32))
+
+        frame = rng.integers(60, 190, size=(H, W, 3), dtype=np.uint8)
+        frame = cv2.GaussianBlur(frame, (5, 5), 0)
+        cv2.warpPerspective(tag, M, (W, H), dst=frame, borderMode=cv2.BORDER_TRANSPARENT)
+        noise = rng.normal(0, 4, size=frame.shape)
+        frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+        frames.append((frame, [(tag_id, t)]))
+
+    return frames
+
+
+def _resize_frames(frames, resolution):
+    """
+    Ajusta frames gravados para a resolução do teste. Se mudou o tamanho,
+    a pose do ground truth não vale mais (só os IDs), então é descartada.
+    """
+    W, H = resolution
+    out = []
+    for frame, gt in frames:
+        if frame.shape[1] == W and frame.shape[0] == H:
+            out.append((frame, gt))
+            continue
+        resized = cv2.resize(frame, (W, H), interpolation=cv2.INTER_AREA)
+        out.append((resized, None if gt is None else [(tag_id, None) for tag_id, _ in gt]))
+    return out
+
+
+# ============================================================================
+# MEDIÇÃO
+# ============================================================================
+
+def run_case(vision, frames):
+    latencies = np.empty(len(frames))
+    expected = 0
+    found = 0
+    false_positives = 0
+    pose_errors = []
+    has_gt = False
+
+    vision.detect_tags(frames[0][0], draw=False)    # aquecimento, não conta
+
+    for i, (frame, gt) in enumerate(frames):
+        t0 = time.perf_counter()
+        _, detections = vision.detect_tags(frame, draw=False)
+        latencies[i] = time.perf_counter() - t0
+
+        if gt is None:
+            continue
+        has_gt = True
+
+        by_id = {d.tag_id: d for d in detections}
+        expected += len(gt)
+        gt_ids = set()
+        for tag_id, pose_t in gt:
+            gt_ids.add(tag_id)
+            d = by_id.get(tag_id)
+            if d is None:
+                continue
+            found += 1
+            if pose_t is not None:
+                pose_errors.append(np.linalg.norm(d.pose_t.ravel() - pose_t))
+        false_positives += sum(1 for tag_id in by_id if tag_id not in gt_ids)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000.0
+    return {
+        'frames': len(frames),
+        'fps': len(frames) / latencies.sum(),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'recall': (found / expected if expected else None) if has_gt else None,
+        'false_positives': false_positives if has_gt else None,
+        'pose_err_cm': float(np.mean(pose_errors)) * 100.0 if pose_errors else None,
+    }
+
+
+def run_sweep(args):
+    recorded = None
+    if args.frames:
+        recorded = load_recorded(args.frames, args.limit)
+        if not recorded:
+            logger.warning(f"Nenhum frame em {args.frames}, usando tags sintéticas")
+            recorded = None
+
+    rows = []
+    for resolution in args.resolutions:
+        vision = VisionSystem(family=args.family, tag_size_meters=args.tag_size, resolution=resolution)
+        if not vision.initialized:
+            raise RuntimeError("pupil_apriltags não inicializou")
+
+        if recorded is not None:
+            frames = _resize_frames(recorded, resolution)
+        else:
+            frames = render_synthetic(resolution, vision.camera_matrix, args.count,
+                                      args.tag_size, seed=args.seed)
+
+        for nthreads, decimate, refine in itertools.product(args.nthreads, args.decimate, args.refine):
+            # troca o detector do VisionSystem para medir o mesmo caminho do robô
+            vision.detector = Detector(
+                families=args.family,
+                nthreads=nthreads,
+                quad_decimate=decimate,
+                quad_sigma=0.0,
+                refine_edges=refine
+            )
+            row = {
+                'resolution': f"{resolution[0]}x{resolution[1]}",
+                'nthreads': nthreads,
+                'quad_decimate': decimate,
+                'refine_edges': refine,
+            }
+            row.update(run_case(vision, frames))
+            rows.append(row)
+            print_row(row)
+
+    return rows
+
+
+# ============================================================================
+# RELATÓRIO
+# ============================================================================
+
+HEADER = (f"{'res':>9} {'thr':>3} {'dec':>4} {'ref':>3} {'fps':>7} {'p50ms':>7} "
+          f"{'p95ms':>7} {'p99ms':>7} {'recall':>6} {'fp':>4} {'err_cm':>6}")
+
+
+def _fmt(value, width, spec=''):
+    if value is None:
+        return '-'.rjust(width)
+    return format(value, f'>{width}{spec}')
+
+
+def print_row(row):
+    print(f"{row['resolution']:>9} {row['nthreads']:>3} {row['quad_decimate']:>4} "
+          f"{int(row['refine_edges']):>3} {row['fps']:>7.1f} {row['p50_ms']:>7.2f} "
+          f"{row['p95_ms']:>7.2f} {row['p99_ms']:>7.2f} "
+          f"{_fmt(row['recall'], 6, '.2f')} {_fmt(row['false_positives'], 4)} "
+          f"{_fmt(row['pose_err_cm'], 6, '.2f')}")
+
+
+def _case_key(row):
+    return (row['resolution'], row['nthreads'], row['quad_decimate'], row['refine_edges'])
+
+
+def compare(rows, baseline_path, tolerance):
+    """
+    Compara com um resultado anterior (--json). Retorna a lista de regressões:
+    FPS caiu ou p95 subiu mais que a tolerância, ou recall caiu.
+    """
+    with open(baseline_path) as f:
+        baseline = {_case_key(r): r for r in json.load(f)['rows']}
+
+    regressions = []
+    for row in rows:
+        base = baseline.get(_case_key(row))
+        if base is None:
+            continue
+        name = "{} thr={} dec={} refine={}".format(*_case_key(row))
+        if row['fps'] < base['fps'] * (1.0 - tolerance):
+            regressions.append(f"{name}: FPS {base['fps']:.1f} -> {row['fps']:.1f}")
+        if row['p95_ms'] > base['p95_ms'] * (1.0 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+        if row['recall'] is not None and base['recall'] is not None and row['recall'] < base['recall'] - 0.02:
+            regressions.append(f"{name}: recall {base['recall']:.2f} -> {row['recall']:.2f}")
+    return regressions
+
+
+def _int_list(text):
+    return [int(v) for v in text.split(',')]
+
+
+def _float_list(text):
+    return [float(v) for v in text.split(',')]
+
+
+def _bool_list(text):
+    return [v.strip().lower() in ('1', 'true', 'sim') for v in text.split(',')]
+
+
+def _resolution_list(text):
+    return [tuple(int(v) for v in res.split('x')) for res in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do VisionSystem.detect_tags")
+    parser.add_argument('--frames', help="pasta de imagens ou arquivo de vídeo (padrão: tags sintéticas)")
+    parser.add_argument('--limit', type=int, default=None, help="máximo de frames gravados a usar")
+    parser.add_argument('--count', type=int, default=100, help="frames sintéticos por resolução")
+    parser.add_argument('--resolutions', type=_resolution_list, default=[(320, 240), (640, 480), (1280, 720)])
+    parser.add_argument('--nthreads', type=_int_list, default=[1, 2, 4])
+    parser.add_argument('--decimate', type=_float_list, default=[1.0, 2.0])
+    parser.add_argument('--refine', type=_bool_list, default=[True, False])
+    parser.add_argument('--family', default='tag36h11')
+    parser.add_argument('--tag-size', type=float, default=0.05, help="lado da tag em metros")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="salva os resultados neste arquivo")
+    parser.add_argument('--compare', help="resultado anterior (--json) para checar regressão")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="piora aceitável de FPS/p95 (fração)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    print(HEADER)
+    rows = run_sweep(args)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': rows}, f, indent=2)
+
+    if args.compare:
+        regressions = compare(rows, args.compare, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSÃO: {r}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Calibração da câmera (intrínsecos e distorção) por câmera e por resolução.
+
+Cada calibração fica num JSON em vision/calibrations/<camera>_<W>x<H>.json
+(ou na pasta de VISION_CALIBRATION_DIR). O VisionSystem carrega o arquivo
+da resolução que vai usar; se só existir de outra resolução com o mesmo
+aspecto, os intrínsecos são escalados. Os mapas do remap e a matriz nova
+são calculados uma vez e guardados junto da calibração.
+
+Gerar uma calibração (tabuleiro de xadrez impresso, da raiz do repositório):
+    python -m vision.calibration --device 0 --resolution 640x480
+    python -m vision.calibration --images fotos/*.png --resolution 640x480 --name robo
+Sem tela: a câmera é lida continuamente e um frame é guardado sempre que o
+tabuleiro aparece numa posição diferente das anteriores.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_DIR = os.environ.get(
+    'VISION_CALIBRATION_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibrations')
+)
+
+# calibrações já lidas do disco: caminho -> CameraCalibration
+_cache = {}
+
+
+class CameraCalibration:
+    def __init__(self, camera_matrix, dist_coefficients, resolution, rms=None):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=float).reshape(3, 3)
+        self.dist_coefficients = np.asarray(dist_coefficients, dtype=float).reshape(-1, 1)
+        self.resolution = tuple(resolution)
+        self.rms = rms
+
+        self._maps = None       # (map1, map2, matriz nova), calculados uma vez
+
+    @property
+    def camera_params(self):
+        "(fx, fy, cx, cy), o formato do pupil_apriltags."
+        K = self.camera_matrix
+        return (K[0, 0], K[1, 1], K[0, 2], K[1, 2])
+
+    def scaled(self, resolution):
+        "A mesma câmera em outra resolução (mesmo aspecto): escala fx, fy, cx, cy."
+        sx = resolution[0] / self.resolution[0]
+        sy = resolution[1] / self.resolution[1]
+        K = self.camera_matrix.copy()
+        K[0, :] *= sx
+        K[1, :] *= sy
+        return CameraCalibration(K, self.dist_coefficients, resolution, self.rms)
+
+    def undistort_maps(self):
+        """
+        Tabelas do cv2.remap que tiram a distorção do frame inteiro, e a
+        matriz da câmera da imagem corrigida (sem distorção). Calculadas na
+        primeira chamada; no formato de ponto fixo, que é o remap mais rápido.
+        """
+        if self._maps is None:
+            new_matrix, _ = cv2.getOptimalNewCameraMatrix(
+                self.camera_matrix, self.dist_coefficients, self.resolution, 0.0
+            )
+            map1, map2 = cv2.initUndistortRectifyMap(
+                self.camera_matrix, self.dist_coefficients, None, new_matrix,
+                self.resolution, cv2.CV_16SC2
+            )
+            self._maps = (map1, map2, new_matrix)
+        return self._maps
+
+    def undistort(self, image, dst=None):
+        map1, map2, _ = self.undistort_maps()
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=dst)
+
+    def to_dict(self):
+        return {
+            'resolution': list(self.resolution),
+            'camera_matrix': self.camera_matrix.tolist(),
+            'dist_coefficients': self.dist_coefficients.ravel().tolist(),
+            'rms': self.rms,
+        }
+
+    @classmethod
+    def from_dict(cls, raw):
+        return cls(raw['camera_matrix'], raw['dist_coefficients'], raw['resolution'], raw.get('rms'))
+
+
+def calibration_path(camera, resolution, directory=None):
+    W, H = resolution
+    return os.path.join(directory or CALIBRATION_DIR, f"{camera}_{W}x{H}.json")
+
+
+def _read(path):
+    if path not in _cache:
+        with open(path) as f:
+            _cache[path] = CameraCalibration.from_dict(json.load(f))
+    return _cache[path]
+
+
+def load_calibration(camera='default', resolution=(640, 480), directory=None):
+    """
+    Calibração da câmera nessa resolução, ou None se não tiver nenhuma.
+    Se só houver de outra resolução com o mesmo aspecto, usa a maior delas escalada.
+    """
+    path = calibration_path(camera, resolution, directory)
+    if os.path.isfile(path):
+        return _read(path)
+
+    W, H = resolution
+    candidates = []
+    for other in glob.glob(calibration_path(camera, ('*', '*'), directory)):
+        calib = _read(other)
+        cW, cH = calib.resolution
+        if cW * H == cH * W:
+            candidates.append(calib)
+    if not candidates:
+        return None
+
+    source = max(candidates, key=lambda c: c.resolution[0])
+    logger.info(f"[CALIB] Usando calibração {source.resolution} escalada para {resolution}")
+    key = path + '#scaled'
+    if key not in _cache:
+        _cache[key] = source.scaled(resolution)
+    return _cache[key]
+
+
+def save_calibration(calib, camera='default', directory=None):
+    path = calibration_path(camera, calib.resolution, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(calib.to_dict(), f, indent=2)
+    _cache.pop(path, None)
+    return path
+
+
+# ============================================================================
+# FERRAMENTA DE CALIBRAÇÃO
+# ============================================================================
+
+def _board_points(board, square_m):
+    cols, rows = board
+    points = np.zeros((cols * rows, 3), np.float32)
+    points[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * square_m
+    return points
+
+
+def _find_corners(gray, board):
+    found, corners = cv2.findChessboardCorners(
+        gray, board, cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+    )
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+
+
+def collect_from_images(paths, board, resolution):
+    views = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        if (image.shape[1], image.shape[0]) != tuple(resolution):
+            image = cv2.resize(image, resolution)
+        corners = _find_corners(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), board)
+        if corners is None:
+            print(f"{path}: tabuleiro não encontrado")
+            continue
+        views.append(corners)
+    return views
+
+
+def collect_from_camera(device, board, resolution, count, min_shift_px=40.0, min_interval_s=0.5):
+    """
+    Lê a câmera e guarda uma vista sempre que o tabuleiro aparece longe
+    (min_shift_px no centro) de todas as vistas já guardadas.
+    """
+    cap = cv2.VideoCapture(device)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+    if not cap.isOpened():
+        raise RuntimeError(f"Não foi possível abrir a câmera {device}")
+
+    views = []
+    last_t = 0.0
+    try:
+        while len(views) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if time.monotonic() - last_t < min_interval_s:
+                continue
+            corners = _find_corners(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), board)
+            if corners is None:
+                continue
+            center = corners.reshape(-1, 2).mean(axis=0)
+            if any(np.linalg.norm(center - v.reshape(-1, 2).mean(axis=0)) < min_shift_px for v in views):
+                continue
+            views.append(corners)
+            last_t = time.monotonic()
+            print(f"Vista {len(views)}/{count}")
+    finally:
+        cap.release()
+    return views
+
+
+def calibrate(views, board, square_m, resolution):
+    object_points = [_board_points(board, square_m)] * len(views)
+    rms, K, dist, _, _ = cv2.calibrateCamera(object_points, views, resolution, None, None)
+    return CameraCalibration(K, dist, resolution, float(rms))
+
+
+def _resolution(text):
+    W, H = text.lower().split('x')
+    return (int(W), int(H))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra a câmera com um tabuleiro de xadrez")
+    parser.add_argument('--device', default='0', help="índice da câmera ou arquivo de vídeo")
+    parser.add_argument('--images', help="glob de fotos do tabuleiro (no lugar da câmera)")
+    parser.add_argument('--resolution', type=_resolution, default=(640, 480))
+    parser.add_argument('--board', type=_resolution, default=(9, 6), help="cantos internos, ex: 9x6")
+    parser.add_argument('--square-mm', type=float, default=25.0, help="lado do quadrado do tabuleiro")
+    parser.add_argument('--count', type=int, default=20, help="vistas a coletar da câmera")
+    parser.add_argument('--name', default='default', help="nome da câmera no arquivo salvo")
+    parser.add_argument('--dir', default=None, help="pasta das calibrações")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    if args.images:
+        views = collect_from_images(sorted(glob.glob(args.images)), args.board, args.resolution)
+    else:
+        device = int(args.device) if args.device.isdigit() else args.device
+        views = collect_from_camera(device, args.board, args.resolution, args.count)
+
+    if len(views) < 5:
+        raise SystemExit(f"Só {len(views)} vistas com o tabuleiro, precisa de pelo menos 5")
+
+    calib = calibrate(views, args.board, args.square_mm / 1000.0, args.resolution)
+    path = save_calibration(calib, args.name, args.dir)
+    print(f"Erro de reprojeção: {calib.rms:.3f} px com {len(views)} vistas")
+    print(f"Salvo em {path}")
+
+
+if __name__ == '__main__':
+    main()
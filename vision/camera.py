@@ -0,0 +1,285 @@
+import threading
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from runtime.metrics import metrics
+from runtime.workers import offload
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRing:
+    def __init__(self, size=4):
+        """
+        Buffer circular com os últimos frames capturados.
+        Um único escritor (a thread de captura) e quantos leitores quiser.
+        Não usa lock: o escritor grava o slot inteiro (uma tupla imutável)
+        e só depois publica o número de sequência, então um leitor nunca vê
+        um slot pela metade.
+        size: quantos frames antigos ficam guardados.
+        """
+        self.size = size
+        self._slots = [None] * size
+        self._seq = 0   # sequência do último frame publicado (0 = nenhum ainda)
+
+    def publish(self, frame, timestamp):
+        seq = self._seq + 1
+        self._slots[seq % self.size] = (seq, timestamp, frame)
+        self._seq = seq     # publica só depois do slot estar pronto
+        return seq
+
+    def latest(self):
+        "Retorna (seq, timestamp, frame) do frame mais novo, ou None."
+        seq = self._seq
+        if seq == 0:
+            return None
+        return self._slots[seq % self.size]
+
+    @property
+    def seq(self):
+        return self._seq
+
+
+class SimCapture:
+    def __init__(self, resolution=(640, 480), fps=30.0):
+        """
+        Câmera simulada com a mesma cara do cv2.VideoCapture (read, set,
+        isOpened, release), para rodar o app e o main.py sem câmera (ex: o
+        teste de carga em mission/loadtest.py). Entrega frames BGR a fps
+        fixo: fundo com ruído (o JPEG custa parecido com uma imagem real) e
+        um quadrado preto de borda branca andando, que o detector examina
+        como candidato a tag.
+        """
+        W, H = resolution
+        self.resolution = resolution
+        self.period = 1.0 / fps
+        rng = np.random.default_rng(0)
+        self._background = rng.integers(90, 166, size=(H, W, 3), dtype=np.uint8)
+        self._next = time.monotonic()
+        self._n = 0
+
+    def set(self, prop, value):
+        return False    # nada é configurável
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        # prazo absoluto: o fps não deriva com o tempo gasto gerando o frame
+        self._next += self.period
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next = time.monotonic()
+
+        W, H = self.resolution
+        side = min(W, H) // 4
+        x = int((W - side - 16) * (0.5 + 0.5 * np.sin(self._n / 30.0))) + 8
+        y = (H - side) // 2
+        frame = self._background.copy()
+        frame[y - 8:y + side + 8, x - 8:x + side + 8] = 255
+        frame[y:y + side, x:x + side] = 0
+        self._n += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class CameraService:
+    # formatos aceitos no modo 'gray' (o que a câmera manda antes de qualquer conversão)
+    GRAY_FORMATS = ('YUYV', 'MJPG')
+
+    def __init__(self, device=0, resolution=(640, 480), buffer_size=4, color_mode='bgr',
+                 pixel_format='YUYV'):
+        """
+        Dona única da câmera. Uma thread lê os frames e publica o mais novo
+        num FrameRing; o loop de controle, o detector e os viewers do MJPEG
+        leem dali em vez de abrir /dev/video0 cada um.
+        device: índice (ou caminho) passado ao cv2.VideoCapture, ou 'sim'
+            para a câmera simulada (SimCapture).
+        resolution: (largura, altura) pedida à câmera.
+        buffer_size: tamanho do buffer circular.
+        color_mode: 'bgr' (padrão do OpenCV) ou 'gray': publica só a
+            luminância, sem nunca montar a imagem colorida. Serve para quem
+            só detecta (main.py), não para o vídeo do app.
+        pixel_format: no modo 'gray', o formato pedido à câmera. 'YUYV': o
+            plano Y é usado direto, sem cópia; 'MJPG': o JPEG é decodificado
+            direto em tons de cinza. Se o driver não entregar o formato cru,
+            volta para BGR e o VisionSystem converte.
+        """
+        if pixel_format not in self.GRAY_FORMATS:
+            raise ValueError(f"pixel_format deve ser um de {self.GRAY_FORMATS}")
+
+        self.device = device
+        self.resolution = resolution
+        self.color_mode = color_mode
+        self.pixel_format = pixel_format
+        self.ring = FrameRing(buffer_size)
+
+        self._cap = None
+        self._thread = None
+        self._running = False
+        self._new_frame = threading.Condition()    # só para acordar leitores
+        self._read_seq = 0     # último frame entregue pelo read()
+
+    def start(self):
+        if self._running:
+            return self
+
+        if self.device == 'sim':
+            self._cap = SimCapture(self.resolution)
+        else:
+            self._cap = cv2.VideoCapture(self.device)
+        W, H = self.resolution
+        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, W)
+        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, H)
+        # buffer interno do driver pequeno, senão a gente lê frame velho
+        self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if self.color_mode == 'gray':
+            # pede o formato cru e desliga a conversão para BGR do OpenCV
+            self._cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.pixel_format))
+            self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+        if not self._cap.isOpened():
+            self._cap.release()
+            self._cap = None
+            raise RuntimeError(f"Não foi possível abrir a câmera {self.device}")
+
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+        logger.info(f"[CAM] Captura iniciada em {W}x{H} (dispositivo {self.device})")
+        return self
+
+    def _capture_loop(self):
+        while self._running:
+            t0 = metrics.start('capture')
+            ok, frame = offload(self._cap.read)     # bloqueia esperando a câmera
+            metrics.record('capture', t0)
+            if not ok:
+                logger.error("[CAM] Falha na leitura da câmera")
+                break
+
+            if self.color_mode == 'gray':
+                frame = self._luma(frame)
+                if frame is None:
+                    continue
+
+            self.ring.publish(frame, time.monotonic())
+            with self._new_frame:
+                self._new_frame.notify_all()
+
+        self._running = False
+        with self._new_frame:
+            self._new_frame.notify_all()   # acorda quem estiver esperando para ver a falha
+
+    def _luma(self, raw):
+        "Só a luminância do frame cru, sem passar por BGR."
+        W, H = self.resolution
+        if raw.ndim == 3 and raw.shape[2] == 2:
+            # YUYV (Y0 U Y1 V...): o canal 0 é o Y de cada pixel; é uma view, sem cópia
+            return raw[:, :, 0]
+        if self.pixel_format == 'YUYV' and raw.ndim < 3 and raw.size == W * H * 2:
+            # o V4L2 do OpenCV entrega o buffer cru como uma linha só
+            return raw.reshape(H, W, 2)[:, :, 0]
+        if self.pixel_format == 'MJPG' and raw.ndim < 3:
+            # o decodificador pula a cor (sem upsampling do croma nem conversão)
+            gray = cv2.imdecode(raw.reshape(-1), cv2.IMREAD_GRAYSCALE)
+            if gray is not None:
+                return gray
+
+        # formato inesperado: volta para BGR e avisa uma vez (o VisionSystem converte)
+        logger.warning(f"[CAM] Câmera {self.device} não entregou {self.pixel_format} cru, usando BGR")
+        self.color_mode = 'bgr'
+        if raw.ndim == 3 and raw.shape[2] == 3:
+            return raw
+        self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        return None     # este frame não dá para aproveitar
+
+    @property
+    def running(self):
+        return self._running
+
+    def latest(self):
+        "Retorna (seq, timestamp, frame) do frame mais novo, sem bloquear."
+        return self.ring.latest()
+
+    def wait_frame(self, last_seq=0, timeout=1.0):
+        """
+        Espera um frame mais novo que last_seq.
+        Retorna (seq, timestamp, frame) ou None se deu timeout ou a câmera parou.
+        """
+        if self.ring.seq <= last_seq:
+            with self._new_frame:
+                self._new_frame.wait_for(
+                    lambda: self.ring.seq > last_seq or not self._running,
+                    timeout=timeout
+                )
+
+        if self.ring.seq <= last_seq:
+            return None
+        return self.ring.latest()
+
+    def read(self, timeout=1.0):
+        """
+        Mesma cara do cv2.VideoCapture.read(): retorna (ok, frame).
+        Sempre entrega um frame que ainda não foi entregue pelo read(); é
+        pensado para um consumidor só (o loop de controle). Outros leitores
+        devem usar wait_frame() guardando a própria sequência.
+        """
+        item = self.wait_frame(self._read_seq, timeout)
+        if item is None:
+            return False, None
+
+        self._read_seq = item[0]
+        return True, item[2]
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+        logger.info("[CAM] Captura encerrada")
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_camera(device=0, resolution=(640, 480), color_mode='bgr', pixel_format='YUYV'):
+    """
+    Retorna o CameraService compartilhado do dispositivo, criando e
+    iniciando se ainda não existir. Todo mundo no processo deve pegar a
+    câmera por aqui.
+    Se ela já está aberta com outra configuração, vale a que está: só
+    avisa, menos no pedido de BGR para uma câmera publicando cinza (os
+    frames não serviriam), que levanta RuntimeError.
+    """
+    with _services_lock:
+        service = _services.get(device)
+        if service is None or not service.running:
+            service = CameraService(device, resolution, color_mode=color_mode,
+                                    pixel_format=pixel_format).start()
+            _services[device] = service
+        else:
+            if service.resolution != resolution:
+                logger.warning(f"[CAM] Câmera {device} já aberta em {service.resolution}, "
+                               f"ignorando pedido de {resolution}")
+            if color_mode == 'bgr' and service.color_mode == 'gray':
+                raise RuntimeError(f"Câmera {device} já aberta em cinza, não entrega BGR")
+            if color_mode != service.color_mode:
+                # cinza pedido, BGR entregue: quem consome converte (detect_tags já faz)
+                logger.warning(f"[CAM] Câmera {device} já aberta em {service.color_mode}, "
+                               f"ignorando pedido de {color_mode}")
+            elif color_mode == 'gray' and pixel_format != service.pixel_format:
+                logger.warning(f"[CAM] Câmera {device} já aberta com {service.pixel_format}, "
+                               f"ignorando pedido de {pixel_format}")
+        return service
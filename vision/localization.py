@@ -0,0 +1,152 @@
+"""
+Localização do robô por várias tags ao mesmo tempo.
+
+Com um mapa de onde cada tag está no mundo, todos os cantos de todas as
+tags visíveis entram num solvePnP só (com a camera_matrix e os
+dist_coefficients do VisionSystem). Resolver tudo junto é bem mais estável
+do que confiar numa tag só, e o jacobiano da reprojeção dá a covariância.
+
+Formato do mapa (JSON, metros e graus; mundo com z para cima):
+    {
+      "tags": {
+        "3": {"position": [1.20, 0.00, 0.15], "rpy_deg": [90, 0, 90]},
+        ...
+      }
+    }
+rpy_deg é a rotação do referencial da tag (x direita, y para baixo, z
+entrando na tag, como no apriltag) em relação ao mundo.
+"""
+
+import json
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# pose fundida do robô: cm e graus, covariância 3x3 de (x_cm, y_cm, theta_graus)
+RobotPoseEstimate = namedtuple(
+    'RobotPoseEstimate',
+    ['x_cm', 'y_cm', 'theta_deg', 'covariance', 'tag_ids', 'rms_px']
+)
+
+# desvio mínimo assumido para a detecção dos cantos (pixels), para a
+# covariância não ir a zero quando a reprojeção fica perfeita
+MIN_CORNER_SIGMA_PX = 0.5
+
+
+def rpy_to_matrix(roll_deg, pitch_deg, yaw_deg):
+    r, p, y = (math.radians(a) for a in (roll_deg, pitch_deg, yaw_deg))
+    Rx = np.array([[1, 0, 0], [0, math.cos(r), -math.sin(r)], [0, math.sin(r), math.cos(r)]])
+    Ry = np.array([[math.cos(p), 0, math.sin(p)], [0, 1, 0], [-math.sin(p), 0, math.cos(p)]])
+    Rz = np.array([[math.cos(y), -math.sin(y), 0], [math.sin(y), math.cos(y), 0], [0, 0, 1]])
+    return Rz @ Ry @ Rx
+
+
+def tag_corners(tag_size):
+    "Cantos no referencial da tag, na mesma ordem de Detection.corners."
+    s = tag_size / 2.0
+    return np.array([[-s, s, 0], [s, s, 0], [s, -s, 0], [-s, -s, 0]], dtype=float)
+
+
+class TagMap:
+    def __init__(self, tags, tag_size):
+        """
+        tags: {tag_id: (R_mundo_tag 3x3, t_mundo_tag 3)}.
+        tag_size: lado da tag em metros.
+        """
+        self.tags = tags
+        self.tag_size = tag_size
+
+        # cantos de cada tag já em coordenadas do mundo
+        local = tag_corners(tag_size)
+        self.world_corners = {tag_id: local @ R.T + t for tag_id, (R, t) in tags.items()}
+
+    @classmethod
+    def load(cls, path, tag_size):
+        with open(path) as f:
+            raw = json.load(f)
+
+        tags = {}
+        for tag_id, entry in raw['tags'].items():
+            R = rpy_to_matrix(*entry.get('rpy_deg', (0.0, 0.0, 0.0)))
+            t = np.asarray(entry['position'], dtype=float)
+            tags[int(tag_id)] = (R, t)
+        return cls(tags, tag_size)
+
+    def __contains__(self, tag_id):
+        return tag_id in self.tags
+
+
+def _robot_pose(rvec, tvec):
+    "De world->câmera (rvec, tvec) para (x_cm, y_cm, theta_graus) da câmera no chão."
+    R, _ = cv2.Rodrigues(rvec)
+    position = -R.T @ tvec.reshape(3)
+    forward = R.T[:, 2]     # eixo z da câmera (para onde ela olha) no mundo
+    theta = math.degrees(math.atan2(forward[1], forward[0]))
+    return np.array([position[0] * 100.0, position[1] * 100.0, theta])
+
+
+def localize(tag_map, detections, camera_matrix, dist_coefficients):
+    """
+    Resolve a pose do robô com todas as tags do mapa visíveis no frame.
+    Retorna RobotPoseEstimate, ou None se nenhuma tag do mapa apareceu.
+    Assume a câmera no centro do robô, olhando para a frente.
+    """
+    known = [d for d in detections if d.tag_id in tag_map]
+    if not known:
+        return None
+
+    object_points = np.concatenate([tag_map.world_corners[d.tag_id] for d in known])
+    image_points = np.concatenate([d.corners for d in known]).astype(float)
+
+    # chute inicial: a tag com menor erro de pose, pela pose que o detector já deu
+    best = min(known, key=lambda d: d.pose_err if d.pose_err is not None else float('inf'))
+    rvec = tvec = None
+    use_guess = False
+    if best.pose_R is not None:
+        R_wt, t_wt = tag_map.tags[best.tag_id]
+        R_ct, t_ct = best.pose_R, best.pose_t.reshape(3)
+        R_cw = R_ct @ R_wt.T
+        t_cw = t_ct - R_cw @ t_wt
+        rvec, _ = cv2.Rodrigues(R_cw)
+        tvec = t_cw.reshape(3, 1)
+        use_guess = True
+
+    ok, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, dist_coefficients,
+                                  rvec=rvec, tvec=tvec, useExtrinsicGuess=use_guess, flags=cv2.SOLVEPNP_ITERATIVE)
+    if not ok:
+        return None
+
+    projected, jacobian = cv2.projectPoints(object_points, rvec, tvec, camera_matrix, dist_coefficients)
+    residuals = (projected.reshape(-1, 2) - image_points).ravel()
+    n = residuals.size
+    rms = float(np.sqrt(np.mean(residuals ** 2)))
+
+    # covariância de (rvec, tvec) pelo jacobiano da reprojeção
+    dof = max(n - 6, 1)
+    sigma2 = max(float(residuals @ residuals) / dof, MIN_CORNER_SIGMA_PX ** 2)
+    J = jacobian[:, :6]
+    cov6 = sigma2 * np.linalg.pinv(J.T @ J)
+
+    # propaga para (x, y, theta) por diferenças finitas
+    params = np.concatenate([rvec.ravel(), tvec.ravel()])
+    pose = _robot_pose(rvec, tvec)
+    J_pose = np.zeros((3, 6))
+    for i in range(6):
+        step = np.zeros(6)
+        step[i] = 1e-6
+        p = params + step
+        delta = _robot_pose(p[:3].reshape(3, 1), p[3:].reshape(3, 1)) - pose
+        delta[2] = (delta[2] + 180.0) % 360.0 - 180.0
+        J_pose[:, i] = delta / 1e-6
+    covariance = J_pose @ cov6 @ J_pose.T
+
+    return RobotPoseEstimate(
+        x_cm=float(pose[0]),
+        y_cm=float(pose[1]),
+        theta_deg=float(pose[2]),
+        covariance=covariance,
+        tag_ids=[d.tag_id for d in known],
+        rms_px=rms,
+    )
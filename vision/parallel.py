@@ -0,0 +1,246 @@
+"""
+Detecção em vários processos, um frame por processo.
+
+O pupil_apriltags só paraleliza partes de um frame, e no processo do app a
+detecção disputa o GIL com o Flask/Socket.IO. Aqui cada worker é um
+processo com o próprio VisionSystem; os frames vão em tons de cinza para
+slots de memória compartilhada (os pixels nunca passam por pickle, só o
+número do slot) e os resultados voltam na ordem de envio, então quem
+consome recebe sempre do mais velho para o mais novo.
+
+Só detect_tags: o rastreio por ROI (track_tag) e o modo adaptativo
+dependem do frame anterior e não combinam com frames em paralelo.
+
+Os workers são iniciados com 'spawn' (não herdam threads nem o estado do
+eventlet); o módulo principal precisa ser seguro de importar, com o código
+de inicialização atrás de if __name__ == '__main__'.
+"""
+
+import heapq
+import logging
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from runtime.metrics import metrics
+from runtime.pipeline import DetectionPacket
+
+logger = logging.getLogger(__name__)
+
+
+def _worker(shm_name, slot_shape, vision_kwargs, tasks, results):
+    # import aqui: o processo filho cria o próprio detector
+    from vision.tag_detection import VisionSystem
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray(slot_shape, dtype=np.uint8, buffer=shm.buf)
+    vision = VisionSystem(**vision_kwargs)
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            order, slot, seq, t_capture, detect_kwargs = task
+            try:
+                _, detections = vision.detect_tags(frames[slot], draw=False, **detect_kwargs)
+            except Exception as e:
+                logger.error(f"[PARALLEL] Erro detectando o frame {seq}: {e}")
+                detections = []
+            results.put((order, slot, seq, t_capture, time.monotonic(), detections))
+    finally:
+        del frames
+        shm.close()
+
+
+class ParallelDetector:
+    # frame sem resultado há mais que isso é dado como perdido (worker morreu) e o slot volta
+    LOST_AFTER_S = 2.0
+
+    def __init__(self, workers=3, resolution=(640, 480), on_result=None, slots=None, detect_kwargs=None,
+                 **vision_kwargs):
+        """
+        workers: quantos processos detectando (num Pi de 4 núcleos, 3 deixa
+            um núcleo para a captura, o controle e o servidor).
+        resolution: (largura, altura) dos frames enviados.
+        on_result: chamada com cada DetectionPacket, na ordem de envio, na
+            thread coletora (deve ser rápida, ex: LatestValue.put).
+        slots: frames em voo ao mesmo tempo (padrão: 2 por worker).
+        detect_kwargs: argumentos do detect_tags nos workers (ex: {'ids': (3,),
+            'pose': 'wanted'}), os mesmos do caminho sequencial; sem eles
+            calcula a pose de todas as tags. submit() pode trocar por frame.
+        vision_kwargs: repassados ao VisionSystem de cada worker
+            (family, tag_size_meters, camera_name, undistort...).
+        """
+        self.workers = workers
+        self.resolution = resolution
+        self.on_result = on_result
+        self.slots = slots or 2 * workers
+        self.detect_kwargs = detect_kwargs or {}
+
+        vision_kwargs.setdefault('nthreads', 1)
+        vision_kwargs['resolution'] = resolution
+        self._vision_kwargs = vision_kwargs
+
+        W, H = resolution
+        self._slot_shape = (self.slots, H, W)
+        self._shm = None
+        self._frames = None
+        self._processes = []
+        self._collector = None
+
+        self._free = list(range(self.slots))
+        self._owners = {}           # ordem -> (slot, enviado_em) dos frames em voo
+        self._free_lock = threading.Lock()
+        self._next_order = 0        # ordem do próximo frame enviado
+        self._deliver_order = 0     # ordem do próximo resultado a entregar
+        self._running = False
+
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.lost = 0
+
+    def start(self):
+        ctx = mp.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self._slot_shape)))
+        self._frames = np.ndarray(self._slot_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+
+        for _ in range(self.workers):
+            p = ctx.Process(
+                target=_worker,
+                args=(self._shm.name, self._slot_shape, self._vision_kwargs, self._tasks, self._results),
+                daemon=True
+            )
+            p.start()
+            self._processes.append(p)
+
+        self._running = True
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        logger.info(f"[PARALLEL] {self.workers} processos detectando, {self.slots} slots de frame")
+        return self
+
+    def submit(self, seq, t_capture, frame, detect_kwargs=None):
+        """
+        Manda um frame (BGR ou cinza) para detecção. Não bloqueia: se todos
+        os slots estão ocupados o frame é descartado e retorna False.
+        detect_kwargs: None usa os do construtor.
+        """
+        with self._free_lock:
+            if not self._free:
+                self.dropped += 1
+                return False
+            slot = self._free.pop()
+            order = self._next_order
+            self._next_order += 1
+            self._owners[order] = (slot, time.monotonic())
+
+        # o cinza vai direto para o slot compartilhado, sem buffer intermediário
+        dst = self._frames[slot]
+        if frame.ndim == 2:
+            np.copyto(dst, frame)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=dst)
+
+        if detect_kwargs is None:
+            detect_kwargs = self.detect_kwargs
+        self._tasks.put((order, slot, seq, t_capture, detect_kwargs))
+        self.submitted += 1
+        return True
+
+    def _collect(self):
+        pending = []    # heap de (ordem, pacote) que chegaram antes da vez
+        while self._running:
+            try:
+                order, _, seq, t_capture, t_detect, detections = self._results.get(timeout=0.5)
+            except Exception:   # queue.Empty, ou fila fechada no close()
+                # nada chegou em 0.5 s: se um resultado se perdeu (worker morreu),
+                # devolve o slot e entrega o que já está pronto em vez de travar a fila
+                self._reclaim_lost(pending)
+                self._deliver(pending)
+                continue
+
+            with self._free_lock:
+                owner = self._owners.pop(order, None)
+                if owner is not None:
+                    self._free.append(owner[0])
+            if owner is None or order < self._deliver_order:
+                continue    # chegou depois de ser dado como perdido; o slot já foi reaproveitado
+            self.completed += 1
+            metrics.observe('parallel_latency', time.monotonic() - t_capture)
+
+            heapq.heappush(pending, (order, DetectionPacket(seq, t_capture, t_detect, detections)))
+            self._deliver(pending)
+            if pending:
+                # algo mais velho ainda não voltou: pode ser só lento, ou ter se perdido
+                self._reclaim_lost(pending)
+                self._deliver(pending)
+
+    def _reclaim_lost(self, pending):
+        """
+        Devolve os slots dos frames sem resultado há mais de LOST_AFTER_S e
+        pula a entrega para depois deles. Só pelo tempo: os workers terminam
+        fora de ordem, e um frame mais velho que o primeiro pronto pode
+        ainda estar sendo lido do slot.
+        """
+        now = time.monotonic()
+        first_ready = pending[0][0] if pending else None
+        with self._free_lock:
+            lost = [order for order, (_, sent_at) in self._owners.items()
+                    if now - sent_at > self.LOST_AFTER_S]
+            for order in lost:
+                self._free.append(self._owners.pop(order)[0])
+            waiting = list(self._owners)
+        if lost:
+            self.lost += len(lost)
+            logger.warning(f"[PARALLEL] {len(lost)} frames sem resultado, slots devolvidos")
+
+        # o próximo a entregar é o mais velho que ainda pode chegar
+        candidates = waiting + ([first_ready] if first_ready is not None else [])
+        self._deliver_order = max(self._deliver_order, min(candidates, default=self._next_order))
+
+    def _deliver(self, pending):
+        while pending and pending[0][0] <= self._deliver_order:
+            order, packet = heapq.heappop(pending)
+            self._deliver_order = order + 1
+            if self.on_result is None:
+                continue
+            try:
+                self.on_result(packet)
+            except Exception as e:
+                # erro de quem consome não pode matar a coletora (os slots nunca voltariam)
+                logger.error(f"[PARALLEL] Erro no on_result do frame {packet.seq}: {e}")
+
+    def close(self):
+        if not self._running:
+            return
+        self._running = False
+        for _ in self._processes:
+            self._tasks.put(None)
+        for p in self._processes:
+            p.join(timeout=2.0)
+            if p.is_alive():
+                p.terminate()
+        self._processes = []
+        if self._collector is not None:
+            self._collector.join(timeout=1.0)
+        self._frames = None
+        self._shm.close()
+        self._shm.unlink()
+        logger.info(f"[PARALLEL] {self.completed} frames detectados, {self.dropped} descartados")
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'dropped': self.dropped,
+            'lost': self.lost,
+        }
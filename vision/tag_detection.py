@@ -2,30 +2,146 @@ import cv2
 from pupil_apriltags import Detector
 import numpy as np
 import logging
+import time
+
+from runtime.metrics import metrics
+from vision.calibration import load_calibration
+from vision.localization import TagMap, localize, tag_corners
 
 logger = logging.getLogger(__name__)
 
+# detecções compactas (VisionSystem.detect): uma linha por tag, sem objetos Python.
+# Tags sem pose pedida ficam com has_pose=False e pose em NaN.
+DETECTION_DTYPE = np.dtype([
+    ('tag_id', 'i4'),
+    ('center', 'f4', (2,)),
+    ('corners', 'f4', (4, 2)),
+    ('decision_margin', 'f4'),
+    ('has_pose', '?'),
+    ('pose_R', 'f4', (3, 3)),
+    ('pose_t', 'f4', (3,)),
+    ('pose_err', 'f4'),
+])
+
+# de quais tags calcular a pose: nenhuma, só as pedidas (ids) ou todas
+POSE_POLICIES = ('none', 'wanted', 'all')
+
+
+def detections_to_array(detections):
+    "Lista de Detection do pupil_apriltags -> np.recarray com DETECTION_DTYPE."
+    out = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+    for i, d in enumerate(detections):
+        row = out[i]
+        row['tag_id'] = d.tag_id
+        row['center'] = d.center
+        row['corners'] = d.corners
+        row['decision_margin'] = d.decision_margin
+        pose_t = getattr(d, 'pose_t', None)
+        if pose_t is None:
+            row['pose_R'] = np.nan
+            row['pose_t'] = np.nan
+            row['pose_err'] = np.nan
+        else:
+            row['has_pose'] = True
+            row['pose_R'] = d.pose_R
+            row['pose_t'] = np.ravel(pose_t)
+            row['pose_err'] = np.nan if d.pose_err is None else d.pose_err
+    return out.view(np.recarray)
+
+
 class VisionSystem:
-    def __init__(self, family="tag36h11", tag_size_meters=0.05, resolution=(1280, 720)):
+    # níveis de quad_decimate do modo adaptativo, do mais fino para o mais grosso
+    ADAPTIVE_LEVELS = (1.0, 1.5, 2.0, 3.0)
+    # menor lado (em pixels, já decimado) que a tag pode ter para ainda ser achada com folga
+    ADAPTIVE_MIN_TAG_PX = 24.0
+    # com o orçamento empurrando para um nível mais grosso, a cada tantos frames
+    # roda uma vez o nível que a distância pede, para medir de novo o tempo dele
+    ADAPTIVE_PROBE_EVERY = 30
+
+    def __init__(self, family="tag36h11", tag_size_meters=0.05, resolution=(1280, 720),
+                 roi_padding=0.5, roi_max_misses=3, adaptive=False, frame_budget_s=None,
+                 tag_map=None, camera_name='default', undistort='corners', nthreads=6):
         """
         Inicializa o sistema de visão usando pupil_apriltags.
+        roi_padding: no modo de rastreio (track_tag), quanto a ROI cresce em
+            volta da tag, como fração do tamanho dela.
+        roi_max_misses: quantos frames sem achar a tag na ROI antes de voltar
+            a procurar na imagem inteira.
+        adaptive: escolhe a decimação a cada frame pela distância da última
+            tag vista (perto = grosso, longe = resolução cheia).
+        frame_budget_s: no modo adaptativo, tempo máximo desejado de detecção
+            por frame; se um nível estoura, usa o próximo mais grosso.
+        tag_map: TagMap (ou caminho do JSON) com a pose de cada tag no mundo,
+            usado por localize().
+        camera_name: nome da calibração em vision/calibrations (ver
+            vision/calibration.py); sem calibração usa os intrínsecos padrão.
+        undistort: com calibração, como tratar a distorção da lente:
+            'corners' detecta na imagem crua e refaz a pose das tags com os
+            cantos e a distorção (custo só por tag); 'remap' corrige o frame
+            inteiro com mapas pré-calculados antes de detectar (as detecções
+            ficam nas coordenadas da imagem corrigida); None ignora.
+        nthreads: threads do detector dentro de um frame (com vários
+            processos detectando, ver vision/parallel.py, o melhor é 1).
         """
         self.tag_size = tag_size_meters
+        self.adaptive = adaptive
+        self.frame_budget_s = frame_budget_s
+
+        if isinstance(tag_map, str):
+            tag_map = TagMap.load(tag_map, tag_size_meters)
+        self.tag_map = tag_map
+
+        self.roi_padding = roi_padding
+        self.roi_max_misses = roi_max_misses
+        self._track_id = None
+        self._track_corners = None      # cantos da tag no último frame em que foi vista
+        self._track_velocity = np.zeros(2)  # deslocamento do centro entre os dois últimos frames
+        self._track_misses = 0
 
         try:
-            self.detector = Detector(
-                families=family,
-                nthreads=6,
-                quad_decimate=1.0,
-                quad_sigma=0.0,
-                refine_edges=True
-            )
+            self.detector = self._make_detector(family, 1.0, nthreads)
             logger.info(f"Detector pupil_apriltags iniciado com a família: {family}")
             self.initialized = True
         except Exception as e:
             logger.error(f"Falha ao iniciar pupil_apriltags: {e}")
             self.initialized = False
 
+        # pool de detectores já configurados, um por nível de decimação.
+        # refine_edges=True em todos: os quads são achados na imagem decimada,
+        # mas as bordas são refinadas na imagem cheia, então a pose não piora muito
+        self._detector_pool = []
+        self._level_time_s = [None] * len(self.ADAPTIVE_LEVELS)   # média móvel do tempo por nível
+        self._level_frames = [0] * len(self.ADAPTIVE_LEVELS)
+        self._adaptive_frames = 0
+        self._last_distance = None
+        self.adaptive_report = None
+        if self.adaptive and self.initialized:
+            self._detector_pool = [self.detector] + [
+                self._make_detector(family, dec, nthreads) for dec in self.ADAPTIVE_LEVELS[1:]
+            ]
+
+        # buffers reaproveitados pelo _gray (detecção não é reentrante mesmo)
+        self._gray_buf = None
+        self._undistort_buf = None
+
+        self.calibration = load_calibration(camera_name, resolution)
+        self.undistort = undistort if self.calibration is not None else None
+        self._tag_object_points = tag_corners(tag_size_meters)
+
+        if self.calibration is not None:
+            logger.info(f"Calibração '{camera_name}' carregada para {resolution}")
+            if self.undistort == 'remap':
+                # a imagem vai ser corrigida antes de detectar: intrínsecos da imagem nova, sem distorção
+                _, _, camera_matrix = self.calibration.undistort_maps()
+                self.dist_coefficients = np.zeros((5, 1))
+            else:
+                camera_matrix = self.calibration.camera_matrix
+                self.dist_coefficients = self.calibration.dist_coefficients
+            self.camera_matrix = camera_matrix
+            self.camera_params = (camera_matrix[0, 0], camera_matrix[1, 1],
+                                  camera_matrix[0, 2], camera_matrix[1, 2])
+            return
+
         W, H = resolution
 
         if W == 1280:
@@ -39,7 +155,7 @@ class VisionSystem:
             cx = 320.0
             cy = 240.0
         else:
-            logger.warning("Resolução desconhecida, usando f=W")
+            logger.warning("Resolução desconhecida e sem calibração, usando f=W")
             fx = float(W)
             fy = float(W)
             cx = W / 2.0
@@ -55,25 +171,302 @@ class VisionSystem:
             [0,  0,  1]
         ])
 
-    def detect_tags(self, frame, draw=True):
+    def _gray(self, frame):
+        """
+        A biblioteca espera uma img em preto e branco. Frame que já vem em
+        cinza (câmera no modo 'gray') é usado direto; o BGR é convertido
+        num buffer reaproveitado entre frames, sem alocar um novo a cada vez.
+        """
+        if frame.ndim == 2:
+            gray = frame
+        else:
+            if self._gray_buf is None or self._gray_buf.shape != frame.shape[:2]:
+                self._gray_buf = np.empty(frame.shape[:2], dtype=np.uint8)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray_buf)
+
+        if self.undistort == 'remap':
+            if self._undistort_buf is None or self._undistort_buf.shape != gray.shape:
+                self._undistort_buf = np.empty(gray.shape, dtype=np.uint8)
+            gray = self.calibration.undistort(gray, dst=self._undistort_buf)
+        return gray
+
+    def _solve_poses(self, detections):
+        """
+        Pose de cada tag pelos 4 cantos, com camera_matrix e dist_coefficients.
+        Usado no modo 'corners' (o pupil_apriltags supõe lente sem distorção)
+        e quando só algumas tags precisam de pose.
+        """
+        for d in detections:
+            ok, rvec, tvec = cv2.solvePnP(
+                self._tag_object_points, d.corners.astype(float),
+                self.camera_matrix, self.dist_coefficients, flags=cv2.SOLVEPNP_IPPE_SQUARE
+            )
+            if ok:
+                d.pose_R, _ = cv2.Rodrigues(rvec)
+                d.pose_t = tvec.reshape(3, 1)
+        return detections
+
+    def detect_tags(self, frame, draw=True, ids=None, pose='all'):
+        """
+        Detecta as tags do frame, BGR ou já em tons de cinza (2D). Com
+        draw=True desenha no próprio frame recebido.
+        ids: IDs que interessam ao chamador (para pose='wanted').
+        pose: 'all' calcula a pose de todas as tags, 'wanted' só das que
+            estão em ids, 'none' de nenhuma (pose_R/pose_t ficam None).
+            Todas as tags detectadas são retornadas, com ou sem pose.
+        """
         if not self.initialized:
             return frame, []
 
-        # a biblioteca espera uma img em preto e branco
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        t = metrics.start('grayscale')
+        gray = self._gray(frame)
+        t = metrics.record('grayscale', t)
+
+        # a pose do próprio pupil_apriltags só serve para "todas" e sem distorção;
+        # nos outros casos é calculada depois, só para as tags escolhidas
+        detector_pose = pose == 'all' and self.undistort != 'corners'
+        detections = self._run_detector(gray, self.camera_params, estimate_pose=detector_pose)
+        t = metrics.record('detect', t)
+
+        if not detector_pose:
+            for d in detections:
+                d.pose_R = d.pose_t = d.pose_err = None
+
+        if not detector_pose and pose != 'none':
+            if pose == 'wanted':
+                wanted = [d for d in detections if ids is not None and d.tag_id in ids]
+            else:
+                wanted = detections
+            self._solve_poses(wanted)
+            metrics.record('pose', t)
+
+        if draw:
+            self._draw(frame, detections)
+
+        return frame, detections
+
+    def detect(self, frame, ids=None, pose='wanted'):
+        """
+        Igual ao detect_tags (sem desenhar), mas retorna um np.recarray
+        compacto (DETECTION_DTYPE) no lugar da lista de Detection. Os campos
+        continuam acessíveis como atributos: det.tag_id, det.pose_t...
+        """
+        _, detections = self.detect_tags(frame, draw=False, ids=ids, pose=pose)
+        return detections_to_array(detections)
+
+    def track_tag(self, frame, tag_id, draw=True):
+        """
+        Igual ao detect_tags, mas otimizado para seguir uma tag só.
+        Depois que a tag é vista, os próximos frames só procuram numa ROI em
+        volta da posição prevista dela (últimos cantos + velocidade), e os
+        resultados voltam para coordenadas do frame inteiro. Se a tag sumir
+        da ROI por roi_max_misses frames, volta a procurar no frame todo.
+        Só as detecções dentro da ROI são retornadas enquanto rastreia.
+        No modo 'corners' só a tag seguida tem pose; as outras vêm com
+        pose_R/pose_t None.
+        """
+        if not self.initialized:
+            return frame, []
 
-        # Detectar com cálculo de pose
-        detections = self.detector.detect(
+        if tag_id != self._track_id:
+            self.reset_tracking()
+            self._track_id = tag_id
+
+        t = metrics.start('grayscale')
+        gray = self._gray(frame)
+        t = metrics.record('grayscale', t)
+
+        # no modo 'corners' a pose do detector sairia sem distorção e seria
+        # refeita de qualquer jeito: só resolve a da tag seguida, depois
+        detector_pose = self.undistort != 'corners'
+        roi = self._predict_roi(gray.shape)
+        if roi is None:
+            detections = self._run_detector(gray, self.camera_params, estimate_pose=detector_pose)
+        else:
+            detections = self._detect_in_roi(gray, roi, estimate_pose=detector_pose)
+        t = metrics.record('detect', t)
+        if not detector_pose:
+            for d in detections:
+                d.pose_R = d.pose_t = d.pose_err = None
+            self._solve_poses([d for d in detections if d.tag_id == tag_id])
+            metrics.record('pose', t)
+
+        target = None
+        for d in detections:
+            if d.tag_id == tag_id:
+                target = d
+                break
+
+        if target is not None:
+            if self._track_corners is not None:
+                self._track_velocity = target.corners.mean(axis=0) - self._track_corners.mean(axis=0)
+            self._track_corners = target.corners
+            self._track_misses = 0
+        elif self._track_corners is not None:
+            self._track_misses += 1
+            if self._track_misses >= self.roi_max_misses:
+                self.reset_tracking(keep_id=True)   # perdeu, volta a procurar no frame inteiro
+
+        if draw:
+            if roi is not None:
+                x0, y0, x1, y1 = roi
+                cv2.rectangle(frame, (x0, y0), (x1, y1), (255, 0, 0), 1)
+            self._draw(frame, detections)
+
+        return frame, detections
+
+    @staticmethod
+    def _make_detector(family, quad_decimate, nthreads=6):
+        return Detector(
+            families=family,
+            nthreads=nthreads,
+            quad_decimate=quad_decimate,
+            quad_sigma=0.0,
+            refine_edges=True
+        )
+
+    def _run_detector(self, gray, camera_params, estimate_pose=True):
+        if not self.adaptive:
+            return self.detector.detect(
+                gray,
+                estimate_tag_pose=estimate_pose,
+                camera_params=camera_params,
+                tag_size=self.tag_size
+            )
+
+        level = self._choose_level()
+        t0 = time.perf_counter()
+        detections = self._detector_pool[level].detect(
             gray,
-            estimate_tag_pose=True,
-            camera_params=self.camera_params,
+            estimate_tag_pose=estimate_pose,
+            camera_params=camera_params,
             tag_size=self.tag_size
         )
+        dt = time.perf_counter() - t0
+
+        # média móvel exponencial do tempo desse nível; a primeira execução de
+        # cada nível (alocações, caches frios) não entra
+        if self._level_frames[level]:
+            prev = self._level_time_s[level]
+            self._level_time_s[level] = dt if prev is None else 0.8 * prev + 0.2 * dt
+        self._level_frames[level] += 1
+
+        # a tag mais distante é a que limita a decimação; se estamos seguindo
+        # uma tag, só ela importa
+        distances = [self._distance(d) for d in detections
+                     if self._track_id is None or d.tag_id == self._track_id]
+        self._last_distance = max(distances) if distances else None
+
+        self.adaptive_report = {
+            'level': level,
+            'quad_decimate': self.ADAPTIVE_LEVELS[level],
+            'frame_time_ms': dt * 1000.0,
+            'distance_m': self._last_distance,
+        }
+        return detections
+
+    def _distance(self, d):
+        "Distância da tag: pela pose, ou sem pose pelo tamanho aparente (lado em pixels)."
+        if getattr(d, 'pose_t', None) is not None:
+            return d.pose_t[2][0]
+        side_px = np.linalg.norm(d.corners[0] - d.corners[1])
+        return self.camera_params[0] * self.tag_size / max(side_px, 1.0)
+
+    def _choose_level(self):
+        levels = self.ADAPTIVE_LEVELS
+
+        # sem tag conhecida: resolução cheia para achar tags longe
+        level = 0
+        if self._last_distance is not None and self._last_distance > 0:
+            # tamanho aparente da tag em pixels: f * tamanho / distância
+            tag_px = self.camera_params[0] * self.tag_size / self._last_distance
+            for i, dec in enumerate(levels):
+                if tag_px / dec >= self.ADAPTIVE_MIN_TAG_PX:
+                    level = i
 
-        if not draw:
-            return frame, detections
+        # se o nível escolhido estoura o orçamento, engrossa; de tempos em tempos
+        # testa o nível pedido de novo (a média só anda quando o nível roda, e a
+        # CPU pode ter folgado), senão ficaria preso no grosso até o fim
+        self._adaptive_frames += 1
+        if self.frame_budget_s is not None and self._adaptive_frames % self.ADAPTIVE_PROBE_EVERY:
+            while (level < len(levels) - 1 and self._level_time_s[level] is not None
+                   and self._level_time_s[level] > self.frame_budget_s):
+                level += 1
 
-        # Desenhar
+        return level
+
+    def get_adaptive_summary(self):
+        "Quantos frames rodaram em cada nível e o tempo médio (ms) de cada um."
+        return [
+            {
+                'quad_decimate': dec,
+                'frames': self._level_frames[i],
+                'avg_time_ms': None if self._level_time_s[i] is None else self._level_time_s[i] * 1000.0,
+            }
+            for i, dec in enumerate(self.ADAPTIVE_LEVELS)
+        ]
+
+    def reset_adaptive(self):
+        "Esquece os tempos e a distância do modo adaptativo (ex: depois do aquecimento)."
+        self._level_time_s = [None] * len(self.ADAPTIVE_LEVELS)
+        self._level_frames = [0] * len(self.ADAPTIVE_LEVELS)
+        self._adaptive_frames = 0
+        self._last_distance = None
+        self.adaptive_report = None
+
+    def reset_tracking(self, keep_id=False):
+        if not keep_id:
+            self._track_id = None
+        self._track_corners = None
+        self._track_velocity = np.zeros(2)
+        self._track_misses = 0
+
+    def _predict_roi(self, shape):
+        "Retorna (x0, y0, x1, y1) da ROI onde a tag deve estar, ou None para usar o frame todo."
+        if self._track_corners is None:
+            return None
+
+        H, W = shape[:2]
+        corners = self._track_corners + self._track_velocity
+        (min_x, min_y), (max_x, max_y) = corners.min(axis=0), corners.max(axis=0)
+
+        # cresce a ROI a cada frame perdido, a tag pode ter andado mais
+        pad = max(max_x - min_x, max_y - min_y) * self.roi_padding * (1 + self._track_misses)
+
+        x0 = max(int(min_x - pad), 0)
+        y0 = max(int(min_y - pad), 0)
+        x1 = min(int(max_x + pad) + 1, W)
+        y1 = min(int(max_y + pad) + 1, H)
+
+        if x1 - x0 < 16 or y1 - y0 < 16:
+            return None     # tag saindo da imagem, melhor procurar tudo
+        return (x0, y0, x1, y1)
+
+    def _detect_in_roi(self, gray, roi, estimate_pose=True):
+        x0, y0, x1, y1 = roi
+        crop = np.ascontiguousarray(gray[y0:y1, x0:x1])
+
+        # o centro óptico muda de lugar no recorte; com isso a pose já sai
+        # no referencial da câmera, igual à do frame inteiro
+        fx, fy, cx, cy = self.camera_params
+        detections = self._run_detector(crop, (fx, fy, cx - x0, cy - y0), estimate_pose=estimate_pose)
+
+        # volta os pixels para coordenadas do frame inteiro
+        offset = np.array([x0, y0], dtype=float)
+        shift = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]], dtype=float)
+        for d in detections:
+            d.corners = d.corners + offset
+            d.center = d.center + offset
+            d.homography = shift @ d.homography
+
+        return detections
+
+    def draw(self, frame, detections):
+        "Desenha detecções já prontas (ex: vindas de outro processo) no frame."
+        self._draw(frame, detections)
+
+    def _draw(self, frame, detections):
+        debug = logger.isEnabledFor(logging.DEBUG)
         for d in detections:
             # corners já vêm como array Nx2
             corners = d.corners.astype(int)
@@ -89,10 +482,19 @@ class VisionSystem:
             cv2.putText(frame, f"ID: {d.tag_id}", (corners[0][0], corners[0][1] - 10),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
         
-            x, y, z = self.estimate_position(d)
-            print(f"x={x}, y={y}, z={z}")
-
-        return frame, detections
+            # só em debug: print a cada tag de cada frame pesa no loop de vídeo
+            if debug and getattr(d, 'pose_t', None) is not None:
+                x, y, z = self.estimate_position(d)
+                logger.debug(f"Tag {d.tag_id}: x={x}, y={y}, z={z}")
     
+    def localize(self, detections):
+        """
+        Pose do robô no mundo usando todas as tags do mapa visíveis (PnP
+        conjunto). Retorna RobotPoseEstimate ou None.
+        """
+        if self.tag_map is None:
+            return None
+        return localize(self.tag_map, detections, self.camera_matrix, self.dist_coefficients)
+
     def estimate_position(self, detection):
         return detection.pose_t
\ No newline at end of file
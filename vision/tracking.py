@@ -0,0 +1,178 @@
+"""
+Rastreador de tags com filtro de Kalman.
+
+Cada tag vista ganha uma trilha com estado [x, y, z, vx, vy, vz] (pose_t no
+referencial da câmera, em metros) e modelo de velocidade constante. Entre
+detecções a trilha é prevista usando também o comando das rodas (o robô
+andando para frente aproxima a tag, girando a desloca para o lado), então o
+controle pode rodar numa taxa fixa mais alta que a da detecção e atravessar
+alguns frames perdidos sem parar o robô.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# estimativa de uma trilha num instante: pose_t prevista (3,), velocidade (3,),
+# age_s = tempo desde a última detecção aceita, innovation = último resíduo
+# medido - previsto (3,), nis = resíduo normalizado (Mahalanobis ao quadrado)
+TrackEstimate = namedtuple(
+    'TrackEstimate',
+    ['tag_id', 'pose_t', 'velocity', 'covariance', 'age_s', 'innovation', 'nis', 'hits']
+)
+
+# medição (só posição)
+H = np.hstack([np.eye(3), np.zeros((3, 3))])
+
+
+class TagTrack:
+    def __init__(self, tag_id, position, t, meas_var, velocity_var):
+        self.tag_id = tag_id
+        self.x = np.concatenate([position, np.zeros(3)])
+        self.P = np.diag(np.concatenate([meas_var, [velocity_var] * 3]))
+        self.t = t                  # instante do estado
+        self.t_measured = t         # instante da última detecção aceita
+        self.innovation = np.zeros(3)
+        self.nis = 0.0
+        self.hits = 1
+        self.rejected = 0           # medições seguidas fora do gate
+
+
+class TagTracker:
+    # chi-quadrado com 3 graus de liberdade, 99.9%
+    GATE_NIS = 16.27
+
+    def __init__(self, accel_sigma=0.5, meas_sigma_m=(0.01, 0.01, 0.03),
+                 initial_velocity_sigma=0.5, drop_after_s=1.0, max_rejected=3):
+        """
+        accel_sigma: ruído de processo, aceleração aleatória da tag em relação
+            à câmera (m/s²) além do que o comando das rodas explica.
+        meas_sigma_m: desvio da medição de pose_t em x, y, z (o z costuma ser o pior).
+        initial_velocity_sigma: incerteza da velocidade ao criar uma trilha (m/s).
+        drop_after_s: trilha sem detecção por mais que isso é descartada.
+        max_rejected: medições seguidas fora do gate até reiniciar a trilha
+            (a tag realmente pulou, por exemplo depois de ser movida).
+        """
+        self.accel_var = accel_sigma ** 2
+        self.R = np.diag(np.square(meas_sigma_m))
+        self.velocity_var = initial_velocity_sigma ** 2
+        self.drop_after_s = drop_after_s
+        self.max_rejected = max_rejected
+
+        self.tracks = {}
+        self._command = (0.0, 0.0)   # (linear m/s, angular rad/s)
+
+    def set_command(self, linear_cm_s, angular_deg_s):
+        "Comando atual das rodas (mesmas unidades do set_velocity), entrada de controle da previsão."
+        self._command = (linear_cm_s / 100.0, math.radians(angular_deg_s))
+
+    def _predict(self, track, t):
+        dt = t - track.t
+        if dt <= 0:
+            return
+        linear, angular = self._command
+
+        # velocidade constante
+        F = np.eye(6)
+        F[0:3, 3:6] = dt * np.eye(3)
+        x = F @ track.x
+
+        # movimento do robô: gira de angular*dt (positivo = esquerda) e anda linear*dt;
+        # no referencial da câmera (x direita, z frente) a tag faz o contrário
+        dtheta = angular * dt
+        c, s = math.cos(dtheta), math.sin(dtheta)
+        G = np.eye(6)
+        G[0, 0], G[0, 2] = c, s
+        G[2, 0], G[2, 2] = -s, c
+        G[3, 3], G[3, 5] = c, s
+        G[5, 3], G[5, 5] = -s, c
+        x = G @ x
+        x[2] -= linear * dt
+
+        # ruído de aceleração branca, por eixo
+        q = self.accel_var
+        Q = np.zeros((6, 6))
+        Q[0:3, 0:3] = np.eye(3) * q * dt ** 4 / 4.0
+        Q[0:3, 3:6] = Q[3:6, 0:3] = np.eye(3) * q * dt ** 3 / 2.0
+        Q[3:6, 3:6] = np.eye(3) * q * dt ** 2
+
+        A = G @ F
+        track.x = x
+        track.P = A @ track.P @ A.T + Q
+        track.t = t
+
+    def update(self, detections, t):
+        """
+        Incorpora as detecções de um frame capturado em t (time.monotonic()).
+        Se o estado já estiver à frente de t (detecção atrasada), a medição
+        é aplicada no estado atual, sem voltar no tempo.
+        """
+        for d in detections:
+            if d.pose_t is None:
+                continue
+            z = np.asarray(d.pose_t, dtype=float).reshape(3)
+            if not np.all(np.isfinite(z)):
+                continue    # tag sem pose calculada (VisionSystem.detect com pose='wanted')
+            track = self.tracks.get(d.tag_id)
+            if track is None:
+                self.tracks[d.tag_id] = TagTrack(d.tag_id, z, t, np.diag(self.R), self.velocity_var)
+                continue
+
+            self._predict(track, t)
+
+            y = z - H @ track.x
+            S = H @ track.P @ H.T + self.R
+            S_inv = np.linalg.inv(S)
+            nis = float(y @ S_inv @ y)
+            track.innovation = y
+            track.nis = nis
+
+            if nis > self.GATE_NIS:
+                track.rejected += 1
+                if track.rejected >= self.max_rejected:
+                    self.tracks[d.tag_id] = TagTrack(d.tag_id, z, t, np.diag(self.R), self.velocity_var)
+                continue
+
+            K = track.P @ H.T @ S_inv
+            track.x = track.x + K @ y
+            track.P = (np.eye(6) - K @ H) @ track.P
+            track.t_measured = max(track.t_measured, t)
+            track.hits += 1
+            track.rejected = 0
+
+        self._drop_old(t)
+
+    def _drop_old(self, t):
+        for tag_id in [i for i, tr in self.tracks.items() if t - tr.t_measured > self.drop_after_s]:
+            del self.tracks[tag_id]
+
+    def predict(self, t):
+        "Avança todas as trilhas até t usando o comando atual."
+        for track in self.tracks.values():
+            self._predict(track, t)
+        self._drop_old(t)
+
+    def get(self, tag_id, t=None):
+        """
+        Estimativa da tag em t (previsão a partir da última detecção), ou
+        None se não há trilha.
+        """
+        track = self.tracks.get(tag_id)
+        if track is None:
+            return None
+        if t is not None:
+            self._predict(track, t)
+        return TrackEstimate(
+            tag_id=tag_id,
+            pose_t=track.x[0:3].copy(),
+            velocity=track.x[3:6].copy(),
+            covariance=track.P[0:3, 0:3].copy(),
+            age_s=track.t - track.t_measured,
+            innovation=track.innovation.copy(),
+            nis=track.nis,
+            hits=track.hits,
+        )
+
+    def reset(self):
+        self.tracks.clear()